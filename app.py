@@ -2,6 +2,10 @@ from flask import Flask, redirect, url_for
 from config import config
 from models import db, SensorData, Usuario
 from mqtt_service import init_mqtt
+from patient_registry import patient_registry
+from log_config import configure_logging
+from metrics import init_metrics
+from db_routing import replica_router
 
 from datetime import datetime, timedelta
 
@@ -13,11 +17,17 @@ from routes.monitor_routes import monitor_bp
 def create_app(config_name='default'):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    configure_logging(app.config)
     
     # Inicializar extensiones
     db.init_app(app)
+    patient_registry.init_app(app)
+    replica_router.init_app(app, db)
     
-    # Inicializar MQTT
+    # Métricas de peticiones y consultas, expuestas en /metrics
+    init_metrics(app, db)
+    
+    # Inicializar MQTT (con MQTT_INGEST=false la ingesta corre aparte en ingest_app.py)
     init_mqtt(app)
     
     # Registrar Blueprints
@@ -28,6 +38,22 @@ def create_app(config_name='default'):
     # Tarea programada para limpiar datos antiguos
 
 
+    # Índices y particionado de la tabla de lecturas
+    from partition_service import init_partitions
+    init_partitions(app)
+    
+    # Tabla de agregados y comando de reconstrucción
+    from rollup_service import init_rollups
+    init_rollups(app)
+    
+    # Comando de importación masiva de lecturas históricas
+    from import_service import init_import
+    init_import(app)
+    
+    # Recordatorios de medicación (persistentes en notificaciones, un solo proceso líder)
+    from reminder_service import init_reminders
+    init_reminders(app)
+    
     # Inicializar Scheduler
     from scheduler_service import init_scheduler
     init_scheduler(app)
@@ -51,7 +77,7 @@ def create_app(config_name='default'):
             admin.set_password('admin123')
             db.session.add(admin)
             db.session.commit()
-            print("Usuario administrador creado")
+            app.logger.info("Usuario administrador creado")
         
     return app
 
@@ -0,0 +1,395 @@
+"""
+Benchmark de extremo a extremo con una flota simulada de dispositivos: MQTT → BD → /datos
+
+Uso:
+    python benchmarks/bench_fleet.py --devices 500 --hz 2 --duration 60
+    python benchmarks/bench_fleet.py --database-url mysql+pymysql://root:@localhost/bench_db \
+        --i-know-this-drops-tables --output run.json
+    python benchmarks/bench_fleet.py --broker 127.0.0.1:1883
+    python benchmarks/bench_fleet.py --payload bin --batch 10
+
+Arranca la aplicación completa (create_app con init_mqtt) contra una base de
+datos de pruebas (SQLite temporal por defecto; con --database-url se borran sus
+tablas, así que exige --i-know-this-drops-tables) y simula N dispositivos que
+publican temperatura, hr y spo2 a la frecuencia indicada, en JSON (una
+lectura por mensaje) o en lotes binarios de --batch lecturas. Sin --broker, los
+mensajes se entregan en proceso al cliente MQTT de la app desde un único hilo,
+como lo haría el hilo de red de paho; con --broker los dispositivos publican en
+un broker real y la app se suscribe a él. Mientras tanto, varios pollers
+consultan /datos y /api/stats como lo hace el dashboard.
+
+Tras el calentamiento mide durante --duration segundos y emite en JSON:
+rendimiento sostenido de la ingesta, latencia de cada INSERT+COMMIT del
+escritor por lotes, latencia de la muestra hasta el evento del dashboard (SSE)
+y percentiles de tiempo de respuesta de /datos y /api/stats.
+"""
+import argparse
+import contextlib
+import json
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import paho.mqtt.client as mqtt
+import binary_payload
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def summarize(values):
+    """Percentiles (ms) de una lista de latencias en milisegundos"""
+    if not values:
+        return {'n': 0}
+    data = np.asarray(values, dtype=np.float64)
+    summary = {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(data, PERCENTILES))}
+    summary['max'] = round(float(data.max()), 2)
+    summary['media'] = round(float(data.mean()), 2)
+    summary['n'] = int(data.size)
+    return summary
+
+
+class SimulatedDevice:
+    """Dispositivo con paseo aleatorio de temperatura, pulso y saturación"""
+
+    def __init__(self, device_id, rng, payload='json', batch=1, hz=1.0):
+        self.device_id = device_id
+        self.payload = payload
+        self.batch = batch if payload == 'bin' else 1
+        self.period = 1.0 / hz
+        self.topic = f"healthmonitor/{device_id}/{'bin' if payload == 'bin' else 'data'}"
+        self.rng = rng
+        self.temperature = rng.uniform(36.2, 37.0)
+        self.hr = rng.uniform(60, 90)
+        self.spo2 = rng.uniform(95, 99)
+
+    def next_payload(self):
+        if self.payload == 'bin':
+            # Lote con las últimas `batch` lecturas, muestreadas a la frecuencia del dispositivo
+            now = datetime.now()
+            samples = []
+            for i in range(self.batch):
+                self._step()
+                samples.append((now - timedelta(seconds=(self.batch - 1 - i) * self.period),
+                                self.temperature, int(round(self.hr)), int(round(self.spo2))))
+            return binary_payload.encode(samples)
+        self._step()
+        return json.dumps({
+            'device_id': self.device_id,
+            'temperature': round(self.temperature, 2),
+            'hr': int(round(self.hr)),
+            'spo2': int(round(self.spo2))
+        }).encode()
+
+    def _step(self):
+        self.temperature = min(max(self.temperature + self.rng.gauss(0, 0.02), 35.5), 40.0)
+        self.hr = min(max(self.hr + self.rng.gauss(0, 1.0), 45), 150)
+        self.spo2 = min(max(self.spo2 + self.rng.gauss(0, 0.3), 88), 100)
+
+
+class LoopbackBroker:
+    """
+    Sustituto en proceso del broker
+
+    Los dispositivos publican en una cola y un único hilo entrega cada mensaje
+    al `on_message` del cliente de la app, igual que el hilo de red de paho.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='loopback-broker', daemon=True)
+        self._thread.start()
+
+    def publish(self, topic, payload):
+        self._queue.put((topic, payload))
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            msg = mqtt.MQTTMessage(topic=item[0].encode())
+            msg.payload = item[1]
+            self.client.on_message(self.client, None, msg)
+
+
+class BrokerPublisher:
+    """Publicador de los dispositivos simulados contra un broker real"""
+
+    def __init__(self, host, port):
+        self.client = mqtt.Client()
+        self.client.max_queued_messages_set(0)
+        self.client.connect(host, port, 60)
+        self.client.loop_start()
+
+    def publish(self, topic, payload):
+        self.client.publish(topic, payload)
+
+    def depth(self):
+        return 0
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def run_fleet(broker, devices, hz, stop, counters):
+    """Publica un mensaje por dispositivo y periodo (o por lote), repartidos uniformemente en el tiempo"""
+    interval = devices[0].batch / (len(devices) * hz)
+    started = time.perf_counter()
+    sent = 0
+    while not stop.is_set():
+        due = int((time.perf_counter() - started) / interval)
+        while sent < due and not stop.is_set():
+            device = devices[sent % len(devices)]
+            broker.publish(device.topic, device.next_payload())
+            sent += 1
+        counters['enviados'] = sent
+        counters['objetivo'] = due
+        time.sleep(0.005)
+
+
+def run_poller(app, patient_ids, interval, stop, measuring, latencies, errors, rng):
+    """Consulta /datos y /api/stats alternativamente como una pestaña del dashboard"""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['user_name'] = 'benchmark'
+    cursors = {}
+    turn = 0
+    while not stop.is_set():
+        patient_id = rng.choice(patient_ids)
+        if turn % 4 == 3:
+            name, url = '/api/stats', f"/api/stats?days=1&patient_id={patient_id}"
+        else:
+            # Primera consulta completa y después incrementales con el cursor last_ts, como index.html
+            name, url = '/datos', f"/datos?range=5min&paciente_id={patient_id}"
+            if patient_id in cursors:
+                url += f"&since={cursors[patient_id]}"
+        started = time.perf_counter()
+        response = client.get(url)
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            errors[name] = errors.get(name, 0) + 1
+        elif name == '/datos':
+            last_ts = response.get_json().get('last_ts')
+            if last_ts:
+                cursors[patient_id] = last_ts
+        if measuring.is_set():
+            latencies[name].append(elapsed)
+        turn += 1
+        stop.wait(interval)
+
+
+def run_listener(event_bus, channel, stop, measuring, latencies):
+    """Suscriptor del canal SSE de un paciente: latencia desde la recepción de la muestra"""
+    subscription = event_bus.subscribe(channel)
+    try:
+        while not stop.is_set():
+            event = subscription.get(timeout=0.5)
+            if event is None or not measuring.is_set():
+                continue
+            latencies.append(time.time() * 1000 - event.data['ts'])
+    finally:
+        event_bus.unsubscribe(subscription)
+
+
+def run(args):
+    # La configuración se lee del entorno al importar config: preparar antes de importar la app
+    os.environ['DATABASE_URL'] = args.database_url
+    os.environ['REMINDERS_ENABLED'] = 'false'
+    os.environ['MQTT_INGEST'] = 'true'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if args.broker:
+        host, _, port = args.broker.partition(':')
+        os.environ['MQTT_BROKER'] = host
+        os.environ['MQTT_PORT'] = port or '1883'
+    else:
+        # Sin broker: el cliente de la app no abre conexión y recibe del LoopbackBroker
+        mqtt.Client.connect = lambda self, *a, **kw: mqtt.MQTT_ERR_SUCCESS
+        mqtt.Client.loop_start = lambda self: mqtt.MQTT_ERR_SUCCESS
+
+    from flask import Flask
+    from models import db, Paciente
+    import mqtt_service
+    from event_bus import event_bus, patient_channel
+
+    setup = Flask(__name__)
+    setup.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+    db.init_app(setup)
+    with setup.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(Paciente.__table__.insert(), [
+            {'nombre': f"Paciente {i:05d}", 'edad': 40, 'device_id': f"sim-{i:05d}",
+             'estado': 'normal', 'activo': i == 0}
+            for i in range(args.devices)
+        ])
+        db.session.commit()
+        patient_ids = [row.id for row in db.session.execute(db.select(Paciente.id))]
+
+    from app import create_app
+    app = create_app()
+
+    # Duración de cada INSERT+COMMIT del escritor por lotes
+    commit_ms, batch_rows = [], []
+    measuring = threading.Event()
+    writer = mqtt_service.sensor_writer
+    original_flush = writer.flush
+
+    def timed_flush():
+        started = time.perf_counter()
+        written = original_flush()
+        if written and measuring.is_set():
+            commit_ms.append((time.perf_counter() - started) * 1000)
+            batch_rows.append(written)
+        return written
+
+    writer.flush = timed_flush
+
+    rng = random.Random(args.seed)
+    devices = [SimulatedDevice(f"sim-{i:05d}", rng, args.payload, args.batch, args.hz) for i in range(args.devices)]
+    broker = (BrokerPublisher(host, int(port or 1883)) if args.broker
+              else LoopbackBroker(mqtt_service.mqtt_client))
+
+    stop = threading.Event()
+    fleet = {'enviados': 0, 'objetivo': 0}
+    http_latencies = {'/datos': [], '/api/stats': []}
+    http_errors = {}
+    sse_latencies = []
+    threads = [threading.Thread(target=run_fleet, args=(broker, devices, args.hz, stop, fleet), daemon=True)]
+    for channel_patient in patient_ids[:args.listeners]:
+        threads.append(threading.Thread(target=run_listener, daemon=True, args=(
+            event_bus, patient_channel(channel_patient), stop, measuring, sse_latencies)))
+    for i in range(args.pollers):
+        threads.append(threading.Thread(target=run_poller, daemon=True, args=(
+            app, patient_ids, args.poll_interval, stop, measuring, http_latencies, http_errors,
+            random.Random(args.seed + i + 1))))
+    for thread in threads:
+        thread.start()
+
+    print(f"Calentando {args.warmup}s con {args.devices} dispositivos a {args.hz} Hz...", file=sys.stderr)
+    time.sleep(args.warmup)
+    before = writer.get_stats()
+    sent_before = fleet['enviados']
+    started = time.perf_counter()
+    measuring.set()
+    time.sleep(args.duration)
+    measuring.clear()
+    elapsed = time.perf_counter() - started
+    after = writer.get_stats()
+    sent = fleet['enviados'] - sent_before
+
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    backlog = broker.depth()
+    broker.close()
+    queue_stats = mqtt_service.ingest_queue.get_stats()
+
+    # Parar todo lo que escribe en la base de datos antes de borrarla
+    from scheduler_service import scheduler
+    from vitals_rules import rule_engine
+    scheduler.shutdown(wait=False)
+    mqtt_service.ingest_queue.stop()
+    writer.stop()
+    rule_engine.stop()
+    mqtt_service.command_channel.stop()
+
+    flushed = after['flushed'] - before['flushed']
+    return {
+        'configuracion': {
+            'database': args.database_url.split('://')[0],
+            'broker': args.broker or 'loopback',
+            'dispositivos': args.devices,
+            'hz': args.hz,
+            'payload': args.payload,
+            'lecturas_por_mensaje': devices[0].batch,
+            'pollers': args.pollers,
+            'intervalo_poll_s': args.poll_interval,
+            'duracion_s': round(elapsed, 2),
+            'workers': queue_stats['workers'],
+            'batch_size': app.config.get('INGEST_BATCH_SIZE')
+        },
+        'ingesta': {
+            'objetivo_msg_s': args.devices * args.hz / devices[0].batch,
+            'enviados_msg_s': round(sent / elapsed, 1),
+            'enviadas_lecturas_s': round(sent * devices[0].batch / elapsed, 1),
+            'guardadas_filas_s': round(flushed / elapsed, 1),
+            'retraso_flota': fleet['objetivo'] - fleet['enviados'],
+            'pendientes_broker': backlog,
+            'descartadas': after['dropped'] - before['dropped'],
+            'fallidas': after['failed'] - before['failed'],
+            'cola_max_lag_ms': queue_stats['max_lag_ms'],
+            'cola_descartados': queue_stats['dropped']
+        },
+        'commit_ms': summarize(commit_ms),
+        'filas_por_commit': summarize(batch_rows),
+        'muestra_a_dashboard_ms': summarize(sse_latencies),
+        'http_ms': {name: summarize(values) for name, values in http_latencies.items()},
+        'http_errores': http_errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=200, help='Dispositivos simulados')
+    parser.add_argument('--hz', type=float, default=1.0, help='Lecturas por segundo de cada dispositivo')
+    parser.add_argument('--payload', choices=('json', 'bin'), default='json', help='Formato de los mensajes')
+    parser.add_argument('--batch', type=int, default=10, help='Lecturas por mensaje con --payload bin')
+    parser.add_argument('--duration', type=float, default=30, help='Segundos de medición')
+    parser.add_argument('--warmup', type=float, default=5, help='Segundos de calentamiento antes de medir')
+    parser.add_argument('--pollers', type=int, default=4, help='Clientes concurrentes consultando /datos y /api/stats')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Segundos entre consultas de cada poller')
+    parser.add_argument('--listeners', type=int, default=10, help='Pacientes con un suscriptor SSE')
+    parser.add_argument('--database-url', default=None, help='Base de datos de pruebas (por defecto SQLite temporal)')
+    parser.add_argument('--i-know-this-drops-tables', action='store_true',
+                        help='Confirma que se pueden borrar todas las tablas de --database-url')
+    parser.add_argument('--broker', default=None, help='host:puerto de un broker real (por defecto en proceso)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='Fichero donde escribir el JSON (por defecto stdout)')
+    args = parser.parse_args()
+    if args.database_url is not None and not args.i_know_this_drops_tables:
+        # run() empieza con drop_all(): nunca sobre una base de datos indicada sin confirmarlo
+        parser.error('--database-url borra y recrea todas las tablas de esa base de datos; '
+                     'añade --i-know-this-drops-tables si es una base de datos de pruebas')
+
+    tmpdir = None
+    if args.database_url is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        args.database_url = f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+
+    # Los registros de la app van a stderr con límite por mensaje y periodo; stdout queda
+    # reservado a la salida JSON por si alguna dependencia escribe en él
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = run(args)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
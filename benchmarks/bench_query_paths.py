@@ -0,0 +1,164 @@
+"""
+Benchmark de lectura de rangos grandes de lecturas: ORM vs tuplas Core vs cursor en streaming
+
+Uso:
+    python benchmarks/bench_query_paths.py --sizes 10000,100000,1000000
+    python benchmarks/bench_query_paths.py --database-url mysql+pymysql://root:@localhost/bench_db \
+        --i-know-this-drops-tables
+
+Por cada tamaño carga N lecturas de un paciente y mide, para cada camino de
+lectura, el tiempo total y el pico de memoria (tracemalloc) de leer el rango
+completo y extraer (fecha, valor, heart_rate, spo2). Imprime una tabla y, con
+--json, el resultado en formato JSON. Borra y recrea todas las tablas de la base
+de datos, así que con --database-url exige --i-know-this-drops-tables.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import db, Paciente, SensorData
+from controllers.monitor_controller import MonitorController
+
+
+def orm_path(patient_id, since):
+    records = SensorData.query.filter(
+        SensorData.paciente_id == patient_id, SensorData.fecha >= since
+    ).order_by(SensorData.fecha.asc()).all()
+    return [(r.fecha, r.valor, r.heart_rate, r.spo2) for r in records]
+
+
+def core_path(patient_id, since):
+    rows = db.session.execute(
+        db.select(SensorData.fecha, SensorData.valor, SensorData.heart_rate, SensorData.spo2)
+        .where(SensorData.paciente_id == patient_id, SensorData.fecha >= since)
+        .order_by(SensorData.fecha.asc())
+    ).all()
+    return [(r.fecha, r.valor, r.heart_rate, r.spo2) for r in rows]
+
+
+def stream_path(patient_id, since):
+    # Consumir el JSON generado por fragmentos, como lo haría la respuesta HTTP
+    size = 0
+    for chunk in MonitorController.stream_stats_json(days=3650, patient_id=patient_id):
+        size += len(chunk)
+    return size
+
+
+PATHS = {
+    'orm': orm_path,
+    'core': core_path,
+    'stream': stream_path
+}
+
+
+def load_rows(patient_id, count, batch=20000):
+    """Inserta `count` lecturas a 1 Hz terminando ahora"""
+    start = datetime.now() - timedelta(seconds=count)
+    for offset in range(0, count, batch):
+        rows = [{
+            'paciente_id': patient_id,
+            'valor': 36.5 + (i % 10) / 10,
+            'heart_rate': 60 + i % 40,
+            'spo2': 95 + i % 5,
+            'fecha': start + timedelta(seconds=i)
+        } for i in range(offset, min(offset + batch, count))]
+        db.session.execute(SensorData.__table__.insert(), rows)
+    db.session.commit()
+
+
+def measure(func, patient_id, since, repeat):
+    timings = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        gc.collect()
+        started = time.perf_counter()
+        func(patient_id, since)
+        timings.append(time.perf_counter() - started)
+        db.session.remove()
+
+    gc.collect()
+    tracemalloc.start()
+    func(patient_id, since)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.remove()
+    return min(timings), peak
+
+
+def run(database_url, sizes, repeat):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    db.init_app(app)
+
+    results = []
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        paciente = Paciente(nombre='Benchmark', edad=40, device_id='bench-device')
+        db.session.add(paciente)
+        db.session.commit()
+        patient_id = paciente.id
+
+        loaded = 0
+        for size in sorted(sizes):
+            load_rows(patient_id, size - loaded)
+            loaded = size
+            since = datetime.now() - timedelta(days=3650)
+            for name, func in PATHS.items():
+                seconds, peak = measure(func, patient_id, since, repeat)
+                results.append({
+                    'filas': size,
+                    'camino': name,
+                    'segundos': round(seconds, 4),
+                    'filas_por_segundo': round(size / seconds),
+                    'memoria_pico_mb': round(peak / 1024 / 1024, 2)
+                })
+        db.drop_all()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='Tamaños separados por comas')
+    parser.add_argument('--database-url', default=None, help='Base de datos de pruebas (por defecto SQLite temporal)')
+    parser.add_argument('--i-know-this-drops-tables', action='store_true',
+                        help='Confirma que se pueden borrar todas las tablas de --database-url')
+    parser.add_argument('--repeat', type=int, default=3, help='Repeticiones de cada medición de tiempo')
+    parser.add_argument('--json', action='store_true', help='Imprimir el resultado en JSON')
+    args = parser.parse_args()
+    if args.database_url is not None and not args.i_know_this_drops_tables:
+        # run() empieza y termina con drop_all(): nunca sobre una base de datos indicada sin confirmarlo
+        parser.error('--database-url borra y recrea todas las tablas de esa base de datos; '
+                     'añade --i-know-this-drops-tables si es una base de datos de pruebas')
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    tmpdir = None
+    database_url = args.database_url
+    if database_url is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        database_url = f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+
+    results = run(database_url, sizes, args.repeat)
+
+    if args.json:
+        print(json.dumps({'database': database_url.split('://')[0], 'resultados': results}, indent=2))
+    else:
+        print(f"{'filas':>9} {'camino':>7} {'segundos':>9} {'filas/s':>10} {'pico MB':>8}")
+        for r in results:
+            print(f"{r['filas']:>9} {r['camino']:>7} {r['segundos']:>9} {r['filas_por_segundo']:>10} {r['memoria_pico_mb']:>8}")
+
+    if tmpdir is not None:
+        tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
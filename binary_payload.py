@@ -0,0 +1,101 @@
+"""
+Formato binario compacto de los dispositivos: varias lecturas por mensaje MQTT
+
+Los dispositivos que publican en `healthmonitor/<device_id>/bin` envían, en
+little-endian:
+
+    cabecera (12 bytes)   versión u8 = 1, flags u8, muestras u16, base_ms u64
+    muestra (8 bytes)     dt_ms u32, temperatura i16 (centésimas de °C), hr u8, spo2 u8
+
+La hora de cada muestra es `base_ms + dt_ms` (epoch en milisegundos según el
+reloj del dispositivo). Con el flag FLAG_RELATIVE (dispositivos sin reloj) o
+si la hora se sale de `max_skew` respecto a la recepción, las horas se
+recalculan para que la muestra más reciente coincida con la recepción. Una lectura
+completa ocupa 8 bytes frente a ~70 en JSON, y el lote se decodifica sin
+copias con numpy.frombuffer.
+"""
+import struct
+from datetime import datetime, timedelta
+import numpy as np
+from import_service import LIMITS
+
+VERSION = 1
+FLAG_RELATIVE = 0x01
+
+HEADER = struct.Struct('<BBHQ')
+SAMPLE_DTYPE = np.dtype([('dt_ms', '<u4'), ('temperatura', '<i2'), ('heart_rate', 'u1'), ('spo2', 'u1')])
+
+
+class BinaryBatch:
+    """Lote binario sin decodificar tal como viaja por la cola de ingesta (los mensajes JSON van como dict)"""
+    __slots__ = ('device_id', 'payload')
+
+    def __init__(self, device_id, payload):
+        self.device_id = device_id
+        self.payload = bytes(payload)
+
+
+def encode(samples, base_ms=None):
+    """
+    Codifica lecturas (fecha, temperatura, heart_rate, spo2) en un payload binario
+    Sin `base_ms` se toma la hora de la muestra más antigua. Lo usan los simuladores y las pruebas de carga.
+    """
+    if base_ms is None:
+        base_ms = min(int(s[0].timestamp() * 1000) for s in samples) if samples else 0
+    body = np.empty(len(samples), dtype=SAMPLE_DTYPE)
+    for i, (fecha, temperatura, heart_rate, spo2) in enumerate(samples):
+        body[i] = (int(fecha.timestamp() * 1000) - base_ms, round(temperatura * 100), heart_rate, spo2)
+    return HEADER.pack(VERSION, 0, len(samples), base_ms) + body.tobytes()
+
+
+def decode(payload):
+    """
+    Retorna (flags, base_ms, muestras) con las muestras como arreglo estructurado
+    de solo lectura que comparte memoria con el payload
+    """
+    view = memoryview(payload)
+    if len(view) < HEADER.size:
+        raise ValueError("Payload binario demasiado corto")
+    version, flags, count, base_ms = HEADER.unpack_from(view)
+    if version != VERSION:
+        raise ValueError(f"Versión de payload binario no soportada: {version}")
+    expected = HEADER.size + count * SAMPLE_DTYPE.itemsize
+    if len(view) != expected:
+        raise ValueError(f"Payload binario de {len(view)} bytes, se esperaban {expected}")
+    return flags, base_ms, np.frombuffer(view, dtype=SAMPLE_DTYPE, count=count, offset=HEADER.size)
+
+
+def to_readings(payload, received_at, max_skew=timedelta(minutes=5)):
+    """
+    Decodifica un payload y retorna (fechas, temperatura, heart_rate, spo2, inválidas)
+
+    Las señales son arreglos NumPy ya filtrados por los rangos de LIMITS y
+    `fechas` la lista de datetime correspondiente, en orden cronológico.
+    """
+    flags, base_ms, samples = decode(payload)
+    if not len(samples):
+        return [], None, None, None, 0
+
+    # Ordenar primero (solo si hace falta, ordenar copia el lote): el desfase se
+    # mide y se corrige sobre la muestra más reciente
+    dt_ms = samples['dt_ms']
+    if (dt_ms[1:] < dt_ms[:-1]).any():
+        samples = samples[np.argsort(dt_ms, kind='stable')]
+    received_ms = received_at.timestamp() * 1000
+    t_ms = base_ms + samples['dt_ms'].astype(np.float64)
+    skew_ms = max_skew.total_seconds() * 1000
+    if flags & FLAG_RELATIVE or t_ms[-1] > received_ms + skew_ms or t_ms[-1] < received_ms - skew_ms:
+        # Sin reloj fiable: conservar los intervalos y anclar la última muestra a la recepción
+        t_ms = t_ms - t_ms[-1] + received_ms
+
+    temperatura = samples['temperatura'] / 100.0
+    heart_rate = samples['heart_rate']
+    spo2 = samples['spo2']
+    valid = np.ones(len(samples), dtype=bool)
+    for values, (low, high) in ((temperatura, LIMITS['valor']), (heart_rate, LIMITS['heart_rate']),
+                                (spo2, LIMITS['spo2'])):
+        valid &= (values >= low) & (values <= high)
+    invalid = int(len(samples) - valid.sum())
+
+    fechas = [datetime.fromtimestamp(ms / 1000) for ms in t_ms[valid].tolist()]
+    return fechas, temperatura[valid], heart_rate[valid], spo2[valid], invalid
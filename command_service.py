@@ -0,0 +1,283 @@
+"""
+Canal de comandos hacia los dispositivos con confirmación de entrega
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+import paho.mqtt.client as mqtt
+from models import db, Paciente, ComandoDispositivo
+
+logger = logging.getLogger(__name__)
+
+ESTADOS = ('pendiente', 'enviado', 'confirmado', 'fallido')
+
+
+class PendingCommand:
+    """Comando publicado que espera el ack del dispositivo"""
+    __slots__ = ('id', 'topic', 'payload', 'intentos', 'deadline')
+
+    def __init__(self, command_id, topic, payload):
+        self.id = command_id
+        self.topic = topic
+        self.payload = payload
+        self.intentos = 0
+        self.deadline = 0.0
+
+
+class CommandChannel:
+    """
+    Envía un mismo comando a muchos dispositivos y sigue su confirmación
+
+    `send` inserta todas las filas de comandos_dispositivo de una vez y publica
+    un mensaje QoS 1 por dispositivo en `<topic_prefix>/<device_id>` con
+    `{"id": ..., "cmd": ...}`. El cliente MQTT limita los mensajes QoS 1 en vuelo
+    hacia el broker a `max_inflight` (el resto espera en su cola), así que el
+    envío no bloquea. Cada dispositivo responde en `<ack_prefix>/<device_id>`
+    con el id recibido; los que no responden en `ack_timeout` segundos se
+    reenvían hasta `max_retries` veces y después quedan como fallidos. Los
+    cambios de estado se acumulan en memoria y se escriben con un UPDATE en
+    bloque cada `flush_interval_ms`.
+    """
+
+    def __init__(self, topic_prefix='healthmonitor/control', ack_prefix='healthmonitor/ack',
+                 max_inflight=1000, ack_timeout=10, max_retries=2, flush_interval_ms=500):
+        self.app = None
+        self.client = None
+        self.topic_prefix = topic_prefix
+        self.ack_prefix = ack_prefix
+        self.max_inflight = max_inflight
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.flush_interval_ms = flush_interval_ms
+
+        self._pending = {}  # id -> PendingCommand
+        self._deadlines = deque()  # (deadline, id, intento), en orden de vencimiento
+        self._updates = {}  # id -> columnas a actualizar en el próximo vaciado
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._running = False
+        self._thread = None
+
+        self.sent = 0
+        self.acked = 0
+        self.retried = 0
+        self.failed = 0
+        self.publish_errors = 0
+        self.last_fanout_ms = 0.0
+
+    def init_app(self, app, client):
+        """Configura el canal con la app y el cliente MQTT y arranca su hilo"""
+        self.app = app
+        self.client = client
+        self.topic_prefix = app.config.get('COMMAND_TOPIC_PREFIX', self.topic_prefix)
+        self.ack_prefix = app.config.get('COMMAND_ACK_PREFIX', self.ack_prefix)
+        self.max_inflight = app.config.get('COMMAND_MAX_INFLIGHT', self.max_inflight)
+        self.ack_timeout = app.config.get('COMMAND_ACK_TIMEOUT_SECONDS', self.ack_timeout)
+        self.max_retries = app.config.get('COMMAND_MAX_RETRIES', self.max_retries)
+        self.flush_interval_ms = app.config.get('COMMAND_FLUSH_INTERVAL_MS', self.flush_interval_ms)
+
+        client.max_inflight_messages_set(self.max_inflight)
+        # Los acks van por su propio callback y nunca llegan a la cola de ingesta;
+        # los comandos propios que recibe la suscripción a healthmonitor/# se ignoran
+        client.message_callback_add(f"{self.ack_prefix}/+", self.on_ack)
+        client.message_callback_add(f"{self.topic_prefix}/+", lambda client, userdata, msg: None)
+
+        with app.app_context():
+            ComandoDispositivo.__table__.create(bind=db.engine, checkfirst=True)
+        self.start()
+
+    def subscribe(self):
+        """Suscribe el cliente al tópico de acks (se llama en cada conexión)"""
+        self.client.subscribe(f"{self.ack_prefix}/+", qos=1)
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='command-channel', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Detiene el hilo y escribe los estados pendientes"""
+        if not self._running:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def send(self, targets, comando):
+        """
+        Envía `comando` a cada dispositivo de `targets`, pares (device_id, paciente_id)
+        Retorna el id del lote y el número de comandos publicados
+        """
+        if self.client is None:
+            raise RuntimeError("El canal de comandos no tiene cliente MQTT")
+        start = time.perf_counter()
+        lote = uuid.uuid4().hex
+        now = datetime.now()
+        rows = [
+            {'id': uuid.uuid4().hex, 'lote': lote, 'device_id': device_id, 'paciente_id': paciente_id,
+             'comando': comando, 'estado': 'pendiente', 'intentos': 0, 'fecha_creacion': now}
+            for device_id, paciente_id in targets
+        ]
+        if not rows:
+            return lote, 0
+        db.session.execute(ComandoDispositivo.__table__.insert(), rows)
+        db.session.commit()
+
+        commands = [
+            PendingCommand(row['id'], f"{self.topic_prefix}/{row['device_id']}",
+                           json.dumps({'id': row['id'], 'cmd': comando}))
+            for row in rows
+        ]
+        with self._cond:
+            for command in commands:
+                self._pending[command.id] = command
+                self._publish(command, now)
+            self._cond.notify()
+
+        self.last_fanout_ms = (time.perf_counter() - start) * 1000
+        logger.info("Command %s sent to %d devices in %.0f ms", comando, len(rows), self.last_fanout_ms,
+                    extra={'lote': lote})
+        return lote, len(rows)
+
+    def _publish(self, command, now):
+        # Llamar con el lock tomado
+        command.intentos += 1
+        command.deadline = time.time() + self.ack_timeout
+        self._deadlines.append((command.deadline, command.id, command.intentos))
+        info = self.client.publish(command.topic, command.payload, qos=1)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            # Sin conexión: el reintento por tiempo de espera lo volverá a publicar
+            self.publish_errors += 1
+        self.sent += 1
+        self._updates[command.id] = {'id': command.id, 'estado': 'enviado',
+                                     'intentos': command.intentos, 'fecha_envio': now}
+
+    def on_ack(self, client, userdata, msg):
+        """Callback de paho para los mensajes del tópico de acks"""
+        try:
+            data = json.loads(msg.payload.decode())
+            command_id = data.get('id') if isinstance(data, dict) else data
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            command_id = msg.payload.decode(errors='replace').strip()
+        now = datetime.now()
+        with self._cond:
+            # Los acks de comandos enviados por otros procesos no están en este canal
+            if self._pending.pop(command_id, None) is None:
+                return
+            self.acked += 1
+            update = self._updates.setdefault(command_id, {'id': command_id})
+            update.update(estado='confirmado', fecha_confirmacion=now)
+
+    def _run(self):
+        next_flush = time.time() + self.flush_interval_ms / 1000.0
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                now = time.time()
+                wake = next_flush
+                if self._deadlines:
+                    wake = min(wake, self._deadlines[0][0])
+                if wake > now:
+                    self._cond.wait(timeout=wake - now)
+                    if not self._running:
+                        return
+                self._expire(time.time())
+            if time.time() >= next_flush:
+                self.flush()
+                next_flush = time.time() + self.flush_interval_ms / 1000.0
+
+    def _expire(self, now):
+        # Llamar con el lock tomado; los vencimientos se añaden en orden, así que basta mirar el primero
+        fecha = datetime.now()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, command_id, intento = self._deadlines.popleft()
+            command = self._pending.get(command_id)
+            if command is None or command.intentos != intento:
+                continue  # Ya confirmado o reenviado después
+            if command.intentos <= self.max_retries:
+                self.retried += 1
+                self._publish(command, fecha)
+            else:
+                del self._pending[command_id]
+                self.failed += 1
+                self._updates[command_id] = {'id': command_id, 'estado': 'fallido',
+                                             'intentos': command.intentos}
+
+    def flush(self):
+        """Escribe en bloque los cambios de estado acumulados"""
+        with self._lock:
+            if not self._updates:
+                return 0
+            updates = list(self._updates.values())
+            self._updates = {}
+        # UPDATE por clave primaria agrupado por conjunto de columnas
+        groups = {}
+        for update in updates:
+            groups.setdefault(tuple(sorted(update)), []).append(update)
+        try:
+            with self.app.app_context():
+                for group in groups.values():
+                    db.session.execute(db.update(ComandoDispositivo), group)
+                db.session.commit()
+        except Exception as e:
+            logger.error("Error saving command states: %s", e)
+            with self._lock:
+                for update in updates:
+                    # Conservar los cambios más recientes si llegaron durante el fallo
+                    self._updates.setdefault(update['id'], update)
+            return 0
+        return len(updates)
+
+    def get_stats(self):
+        """Retorna los contadores del canal de comandos"""
+        with self._lock:
+            pending = len(self._pending)
+            unsaved = len(self._updates)
+        return {
+            'esperando_ack': pending,
+            'sin_guardar': unsaved,
+            'enviados': self.sent,
+            'confirmados': self.acked,
+            'reintentos': self.retried,
+            'fallidos': self.failed,
+            'errores_publicacion': self.publish_errors,
+            'ultimo_envio_ms': round(self.last_fanout_ms, 1)
+        }
+
+
+def resolve_targets(paciente_ids=None, estado=None):
+    """
+    Pares (device_id, paciente_id) de los pacientes con dispositivo que cumplen el filtro
+
+    Una lista de ids vacía no selecciona a nadie; solo None equivale a todos.
+    """
+    query = db.select(Paciente.device_id, Paciente.id).where(Paciente.device_id.isnot(None))
+    if paciente_ids is not None:
+        query = query.where(Paciente.id.in_(paciente_ids))
+    if estado:
+        query = query.where(Paciente.estado == estado)
+    return [(row.device_id, row.id) for row in db.session.execute(query)]
+
+
+def get_batch_status(lote):
+    """Cuenta los comandos de un lote por estado"""
+    conteos = dict(db.session.execute(
+        db.select(ComandoDispositivo.estado, db.func.count())
+        .where(ComandoDispositivo.lote == lote)
+        .group_by(ComandoDispositivo.estado)
+    ).all())
+    return {estado: conteos.get(estado, 0) for estado in ESTADOS}
+
+
+command_channel = CommandChannel()
@@ -3,20 +3,146 @@ Configuración de la aplicación Flask
 """
 import os
 
+
+def engine_options(uri, pool_size, max_overflow):
+    """Opciones del pool de conexiones (SQLite en memoria no admite tamaño de pool)"""
+    options = {
+        'pool_pre_ping': (os.environ.get('DB_POOL_PRE_PING') or 'true').lower() not in ('0', 'false', 'no'),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE') or 1800),  # Segundos; por debajo del wait_timeout de MySQL
+    }
+    if not uri.startswith('sqlite'):
+        options['pool_size'] = pool_size
+        options['max_overflow'] = max_overflow
+        options['pool_timeout'] = int(os.environ.get('DB_POOL_TIMEOUT') or 30)
+    return options
+
 class Config:
     """Configuración base"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your_secret_key_here_change_in_production'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'mysql+pymysql://root:@localhost/temperatura_db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI,
+                                               int(os.environ.get('DB_POOL_SIZE') or 10),
+                                               int(os.environ.get('DB_MAX_OVERFLOW') or 20))
+    
+    # Réplica de lectura opcional para las consultas del dashboard (db_routing.read_only)
+    SQLALCHEMY_REPLICA_URI = os.environ.get('DATABASE_REPLICA_URL')
+    SQLALCHEMY_BINDS = {
+        'replica': {'url': SQLALCHEMY_REPLICA_URI,
+                    **engine_options(SQLALCHEMY_REPLICA_URI,
+                                     int(os.environ.get('DB_REPLICA_POOL_SIZE') or 10),
+                                     int(os.environ.get('DB_REPLICA_MAX_OVERFLOW') or 20))}
+    } if SQLALCHEMY_REPLICA_URI else {}
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS') or 10)  # Por encima se lee de la primaria
+    REPLICA_LAG_CHECK_SECONDS = 2
     
     # Configuración MQTT
     MQTT_BROKER = os.environ.get('MQTT_BROKER') or 'broker.emqx.io'
     MQTT_PORT = int(os.environ.get('MQTT_PORT') or 1883)
     MQTT_TOPIC = 'healthmonitor/#'
+    # Con MQTT_INGEST=false la web no procesa lecturas (las recibe ingest_app.py) y solo publica comandos
+    MQTT_INGEST = (os.environ.get('MQTT_INGEST') or 'true').lower() not in ('0', 'false', 'no')
+    # Los dispositivos que publican en healthmonitor/<device_id>/bin envían lotes binarios (binary_payload.py)
+    MQTT_BINARY_SUFFIX = '/bin'
+    # En healthmonitor/<device_id>/data (JSON) el reparto por particiones se decide por el tópico
+    MQTT_JSON_SUFFIX = '/data'
+    MQTT_MAX_CLOCK_SKEW_SECONDS = 300  # Fuera de este desfase se ignora el reloj del dispositivo
+    # Reparto de la ingesta entre procesos por dispositivo: el proceso MQTT_PARTITION (0..N-1)
+    # solo procesa los dispositivos de su partición, así sus lecturas parciales y su
+    # estado en el motor de reglas quedan siempre en el mismo proceso
+    MQTT_PARTITIONS = int(os.environ.get('MQTT_PARTITIONS') or 1)
+    MQTT_PARTITION = int(os.environ.get('MQTT_PARTITION') or 0)
+    # Ya no se admite: una suscripción compartida ($share) reparte por mensaje, no por dispositivo
+    MQTT_SHARED_GROUP = os.environ.get('MQTT_SHARED_GROUP')
+    
+    # Logging estructurado (json o text) con límite de registros por mensaje y periodo
+    LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    LOG_FORMAT = os.environ.get('LOG_FORMAT') or 'json'
+    LOG_RATE_LIMIT = int(os.environ.get('LOG_RATE_LIMIT') or 10)  # 0 = sin límite
+    LOG_RATE_INTERVAL_SECONDS = 60
     
     # Configuración de datos
     DATA_VALIDITY_TIMEOUT = 30000  # 30 segundos en milisegundos
     OLD_DATA_RETENTION_DAYS = 30  # Días para mantener datos antiguos
+    
+    # Retención por particiones (MySQL) o borrado por bloques como respaldo
+    PARTITION_INTERVAL = os.environ.get('PARTITION_INTERVAL') or 'day'  # day o week
+    PARTITIONS_AHEAD = 7  # Periodos creados por adelantado
+    CLEANUP_CHUNK_SIZE = 5000
+    CLEANUP_CHUNK_PAUSE_MS = 100
+    
+    # Escritura por lotes de lecturas: lotes más grandes o intervalos más largos
+    # aumentan el rendimiento a costa de latencia hasta que el dato llega a la BD
+    INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE') or 500)
+    INGEST_FLUSH_INTERVAL_MS = int(os.environ.get('INGEST_FLUSH_INTERVAL_MS') or 250)
+    INGEST_MAX_BUFFER = int(os.environ.get('INGEST_MAX_BUFFER') or 50000)  # Filas en memoria antes de descartar
+    INGEST_MAX_RETRIES = int(os.environ.get('INGEST_MAX_RETRIES') or 5)  # Reintentos de un INSERT fallido
+    INGEST_RETRY_BACKOFF_MS = 500  # Espera antes del primer reintento; se duplica en cada fallo
+    INGEST_STOP_TIMEOUT_SECONDS = 10  # Tiempo máximo reintentando lo pendiente al detener la ingesta
+    
+    # Cola entre el hilo de red de MQTT y los hilos que procesan los mensajes
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS') or 4)
+    INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE') or 10000)
+    INGEST_BACKPRESSURE = os.environ.get('INGEST_BACKPRESSURE') or 'block'  # block, drop_oldest o spill
+    INGEST_SPILL_PATH = os.environ.get('INGEST_SPILL_PATH')  # Por defecto en el directorio temporal
+    
+    # Ventanas en memoria de las lecturas recientes por paciente (/datos de 5/15/30 min)
+    LIVE_WINDOW_MINUTES = 30
+    LIVE_BUFFER_CAPACITY = int(os.environ.get('LIVE_BUFFER_CAPACITY') or 3600)  # Lecturas por paciente (2 Hz × 30 min)
+    
+    # Motor de reglas que actualiza el estado del paciente con cada lectura
+    # (umbrales en vitals_rules.DEFAULT_THRESHOLDS, sustituibles con VITAL_THRESHOLDS)
+    RULES_SUSTAIN_SECONDS = int(os.environ.get('RULES_SUSTAIN_SECONDS') or 10)  # Para empeorar
+    RULES_RECOVERY_SECONDS = int(os.environ.get('RULES_RECOVERY_SECONDS') or 30)  # Para mejorar
+    RULES_FLUSH_INTERVAL_MS = 1000
+    
+    # Caché del registro de pacientes
+    PATIENT_CACHE_TTL = int(os.environ.get('PATIENT_CACHE_TTL') or 60)  # Segundos
+    PATIENT_CACHE_NEGATIVE_TTL = 5  # Segundos que un device_id sin paciente no se vuelve a buscar en la BD
+    
+    # Agregados (rollups) de lecturas por minuto, hora y día
+    ROLLUP_INTERVAL_SECONDS = int(os.environ.get('ROLLUP_INTERVAL_SECONDS') or 60)
+    ROLLUP_BATCH_SIZE = 10000
+    ROLLUP_SAFETY_LAG_SECONDS = int(os.environ.get('ROLLUP_SAFETY_LAG_SECONDS') or 30)  # Espera ante huecos de ids
+    
+    # Predicción (Holt con tendencia amortiguada) sobre los agregados por minuto
+    FORECAST_INTERVAL_SECONDS = int(os.environ.get('FORECAST_INTERVAL_SECONDS') or 60)
+    FORECAST_HORIZONS_MIN = (60, 120, 180)  # Horizontes en minutos
+    FORECAST_ALPHA = 0.3  # Suavizado del nivel
+    FORECAST_BETA = 0.05  # Suavizado de la tendencia
+    FORECAST_PHI = 0.98  # Amortiguación de la tendencia
+    FORECAST_WARMUP_HOURS = 6  # Historial usado al arrancar el modelo de un paciente
+    FORECAST_STATE_MAX_AGE_HOURS = 24  # Tiempo sin datos tras el que se olvida el modelo de un paciente inactivo
+    
+    # Intervalo de recálculo de la instantánea de estadísticas globales
+    STATS_SNAPSHOT_INTERVAL_SECONDS = int(os.environ.get('STATS_SNAPSHOT_INTERVAL_SECONDS') or 15)
+    
+    # Filas por lote al leer rangos grandes de lecturas con cursor del servidor
+    STREAM_BATCH_SIZE = 5000
+    
+    # Filas por lote (validación + INSERT de varias filas) en la importación masiva
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE') or 20000)
+    
+    # Stream de eventos (SSE) del monitor
+    SSE_HEARTBEAT_SECONDS = 15
+    SSE_RETRY_MS = 3000  # Espera sugerida al navegador antes de reconectar
+
+    # Recordatorios de medicación
+    REMINDERS_ENABLED = (os.environ.get('REMINDERS_ENABLED') or 'true').lower() not in ('0', 'false', 'no')
+    REMINDER_TOPIC = 'healthmonitor/control'
+    REMINDER_MESSAGE = 'VIBRAR'
+    REMINDER_HORIZON_MINUTES = 60  # Solo los que vencen en este horizonte se cargan en memoria
+    REMINDER_REFRESH_SECONDS = 15  # Recarga desde la tabla (recoge los creados en otros procesos)
+    REMINDER_LEASE_SECONDS = 30  # Concesión de líder; otro proceso la toma si no se renueva
+    REMINDER_MAX_DELAY_MINUTES = 10  # Los vencidos hace más tiempo ya no se envían
+
+    # Comandos a los dispositivos: <prefijo>/<device_id>, ack en <prefijo de ack>/<device_id>
+    COMMAND_TOPIC_PREFIX = 'healthmonitor/control'
+    COMMAND_ACK_PREFIX = 'healthmonitor/ack'
+    COMMAND_MAX_INFLIGHT = int(os.environ.get('COMMAND_MAX_INFLIGHT') or 1000)  # Mensajes QoS 1 sin PUBACK del broker
+    COMMAND_ACK_TIMEOUT_SECONDS = 10  # Espera del ack del dispositivo antes de reenviar
+    COMMAND_MAX_RETRIES = 2
+    COMMAND_FLUSH_INTERVAL_MS = 500  # Escritura en bloque de los estados de entrega
 
 class DevelopmentConfig(Config):
     """Configuración para desarrollo"""
@@ -1,9 +1,20 @@
 """
 Controlador para el monitoreo en tiempo real
 """
+import json
+import numpy as np
 from models import db, Paciente, SensorData
+from downsampling import downsample
+import rollup_service
+from forecast_service import forecast_engine
+from patient_registry import patient_registry
+from live_windows import live_windows
+from db_routing import read_only
 from datetime import datetime, timedelta
 
+# Columnas de lecturas que usan las vistas; se consultan como tuplas, sin hidratar objetos ORM
+SENSOR_COLUMNS = (SensorData.id, SensorData.fecha, SensorData.valor, SensorData.heart_rate, SensorData.spo2)
+
 class MonitorController:
     """Controlador para operaciones de monitoreo en tiempo real"""
     
@@ -18,13 +29,20 @@ class MonitorController:
         return Paciente.query.filter_by(activo=True).all()
     
     @staticmethod
-    def get_sensor_data(time_range='5min', patient_id=None):
+    @read_only
+    def get_sensor_data(time_range='5min', patient_id=None, since_id=None, since=None):
         """
         Obtiene datos de sensores para un rango de tiempo específico
         
         Args:
             time_range: Rango de tiempo ('5min', '15min', '30min', 'all')
             patient_id: ID del paciente (opcional, usa el activo por defecto)
+            since_id: Retorna solo registros con id mayor (consulta incremental)
+            since: Retorna solo registros posteriores a esta fecha (consulta incremental)
+        
+        Los rangos de 5/15/30 minutos se sirven desde la ventana en memoria del
+        paciente cuando la cubre (en ese caso los registros no traen id y el
+        cursor incremental es `since`); si no, se consultan y se precarga la ventana.
         """
         now = datetime.now()
         
@@ -38,56 +56,128 @@ class MonitorController:
         else:
             time_limit = None
         
+        patient_id = MonitorController.resolve_patient_id(patient_id)
+        use_window = time_limit is not None and patient_id is not None and since_id is None
+        if use_window:
+            records = live_windows.get_window(patient_id, time_limit, since)
+            if records is not None:
+                return records
+        
         # Construir query
-        query = SensorData.query
+        query = db.select(*SENSOR_COLUMNS)
         
         # Filtrar por paciente
         if patient_id:
-            query = query.filter(SensorData.paciente_id == int(patient_id))
-        else:
-            # Usar el paciente activo por defecto
-            paciente_activo = MonitorController.get_active_patient()
-            if paciente_activo:
-                query = query.filter(SensorData.paciente_id == paciente_activo.id)
+            query = query.where(SensorData.paciente_id == patient_id)
         
         # Filtrar por tiempo
         if time_limit:
-            query = query.filter(SensorData.fecha >= time_limit)
+            query = query.where(SensorData.fecha >= time_limit)
+        
+        # Filtrar por cursor incremental
+        if since_id is not None:
+            query = query.where(SensorData.id > since_id)
+        elif since is not None:
+            query = query.where(SensorData.fecha > since)
         
-        records = query.order_by(SensorData.fecha.asc()).all()
+        records = db.session.execute(query.order_by(SensorData.fecha.asc())).all()
+        
+        if use_window and since is None:
+            live_windows.warm(patient_id, records, time_limit)
         
         return records
     
     @staticmethod
-    def format_sensor_data(records, current_readings):
+    def resolve_patient_id(patient_id):
+        """ID del paciente indicado o, si no se indica, del paciente activo (None si no hay)"""
+        if patient_id:
+            return int(patient_id)
+        paciente_activo = patient_registry.get_active()
+        return paciente_activo.id if paciente_activo else None
+    
+    @staticmethod
+    @read_only
+    def iter_sensor_rows(patient_id, since=None, until=None, batch_size=5000):
+        """
+        Genera lotes de filas (fecha, valor, heart_rate, spo2) ordenadas por fecha
+        
+        Usa yield_per, que en MySQL abre un cursor del lado del servidor: la memoria
+        usada depende de `batch_size` y no del tamaño del rango.
+        """
+        query = db.select(SensorData.fecha, SensorData.valor, SensorData.heart_rate, SensorData.spo2)
+        if patient_id:
+            query = query.where(SensorData.paciente_id == patient_id)
+        if since is not None:
+            query = query.where(SensorData.fecha >= since)
+        if until is not None:
+            query = query.where(SensorData.fecha < until)
+        
+        result = db.session.execute(query.order_by(SensorData.fecha.asc()).execution_options(yield_per=batch_size))
+        try:
+            for rows in result.partitions():
+                yield rows
+        finally:
+            result.close()
+    
+    @staticmethod
+    def stream_stats_json(days=7, patient_id=None, batch_size=5000):
+        """
+        Genera la respuesta JSON de las lecturas de `days` días por fragmentos
+        
+        Cada fila es [epoch ms, temperatura, heart_rate, spo2]; el JSON completo
+        nunca se construye en memoria.
+        """
+        patient_id = MonitorController.resolve_patient_id(patient_id)
+        since = datetime.now() - timedelta(days=days)
+        
+        yield '{"formato":"filas","columnas":["t","temperatura","heart_rate","spo2"],"filas":['
+        first = True
+        for rows in MonitorController.iter_sensor_rows(patient_id, since, batch_size=batch_size):
+            chunk = json.dumps([[int(r.fecha.timestamp() * 1000), r.valor, r.heart_rate, r.spo2] for r in rows])
+            yield ('' if first else ',') + chunk[1:-1]
+            first = False
+        yield ']}'
+    
+    @staticmethod
+    @read_only
+    def get_latest_record(patient_id):
+        """Obtiene la última lectura registrada de un paciente"""
+        return SensorData.query.filter(
+            SensorData.paciente_id == patient_id
+        ).order_by(SensorData.fecha.desc()).first()
+    
+    @staticmethod
+    def get_current_values(records, current_readings, last_record=None):
+        """Valores actuales: lecturas en vivo si son recientes, si no la última lectura guardada"""
+        now = datetime.now()
+        
+        if current_readings['last_update'] and (now - current_readings['last_update']).seconds < 30:
+            return current_readings['temperature'], current_readings['heart_rate'], current_readings['spo2']
+        if records or last_record:
+            last_record = records[-1] if records else last_record
+            return float(last_record.valor), int(last_record.heart_rate), int(last_record.spo2)
+        return None, None, None
+    
+    @staticmethod
+    def format_sensor_data(records, current_readings, last_record=None, incremental=False, since_id=None):
         """
         Formatea los datos de sensores para la respuesta API
         
         Args:
             records: Lista de registros de SensorData
             current_readings: Lecturas actuales del MQTT
+            last_record: Última lectura conocida, para los valores actuales si `records` está vacío
+            incremental: Indica que `records` contiene solo las lecturas nuevas
+            since_id: Cursor recibido en una consulta incremental
         """
-        now = datetime.now()
-        
         # Preparar datos históricos
         history_temp = [{'x': r.fecha.strftime("%H:%M:%S"), 'y': float(r.valor)} for r in records]
         history_hr = [{'x': r.fecha.strftime("%H:%M:%S"), 'y': int(r.heart_rate)} for r in records]
         history_spo2 = [{'x': r.fecha.strftime("%H:%M:%S"), 'y': int(r.spo2)} for r in records]
+        timestamps = [int(r.fecha.timestamp() * 1000) for r in records]
+        last_id = max((r.id for r in records if r.id is not None), default=since_id)
         
-        # Determinar valores actuales
-        if current_readings['last_update'] and (now - current_readings['last_update']).seconds < 30:
-            temp_value = current_readings['temperature']
-            hr_value = current_readings['heart_rate']
-            spo2_value = current_readings['spo2']
-        elif records:
-            last_record = records[-1]
-            temp_value = float(last_record.valor)
-            hr_value = int(last_record.heart_rate)
-            spo2_value = int(last_record.spo2)
-        else:
-            temp_value = None
-            hr_value = None
-            spo2_value = None
+        temp_value, hr_value, spo2_value = MonitorController.get_current_values(records, current_readings, last_record)
         
         return {
             'temperatura_actual': temp_value,
@@ -96,57 +186,173 @@ class MonitorController:
             'historico_temperatura': history_temp,
             'historico_heart': history_hr,
             'historico_spo2': history_spo2,
+            'timestamps': timestamps,
+            'last_id': last_id,
+            'last_ts': MonitorController.last_timestamp(records),
+            'incremental': incremental,
+            'last_update': current_readings['last_update'].isoformat() if current_readings['last_update'] else None
+        }
+    
+    @staticmethod
+    def format_sensor_data_columnar(records, current_readings, last_record=None, incremental=False, since_id=None):
+        """
+        Formato columnar de format_sensor_data: un único eje de tiempo en epoch ms
+        y un arreglo numérico por señal, construidos en una sola pasada
+        """
+        tiempos = []
+        temperatura = []
+        heart_rate = []
+        spo2 = []
+        last_id = since_id
+        for r in records:
+            tiempos.append(int(r.fecha.timestamp() * 1000))
+            temperatura.append(float(r.valor))
+            heart_rate.append(int(r.heart_rate))
+            spo2.append(int(r.spo2))
+            if r.id is not None and (last_id is None or r.id > last_id):
+                last_id = r.id
+        
+        temp_value, hr_value, spo2_value = MonitorController.get_current_values(records, current_readings, last_record)
+        
+        return {
+            'formato': 'columnar',
+            'temperatura_actual': temp_value,
+            'heart_rate': hr_value,
+            'spo2': spo2_value,
+            'series': {
+                't': tiempos,
+                'temperatura': temperatura,
+                'heart_rate': heart_rate,
+                'spo2': spo2
+            },
+            'last_id': last_id,
+            'last_ts': MonitorController.last_timestamp(records),
+            'incremental': incremental,
             'last_update': current_readings['last_update'].isoformat() if current_readings['last_update'] else None
         }
     
     @staticmethod
-    def get_stats_data(days=7, patient_id=None):
-        """Obtiene datos estadísticos para un número de días (para un paciente individual o general)"""
+    def last_timestamp(records):
+        """Fecha de la lectura más reciente en epoch ms con decimales (cursor `since` exacto) o None"""
+        if not records:
+            return None
+        return max(r.fecha for r in records).timestamp() * 1000
+    
+    @staticmethod
+    @read_only
+    def get_stats_data(days=7, patient_id=None, max_points=None, method='lttb', columnar=False):
+        """
+        Obtiene datos estadísticos para un número de días (para un paciente individual o general)
+        
+        Args:
+            days: Número de días hacia atrás
+            patient_id: ID del paciente (opcional, usa el activo por defecto)
+            max_points: Máximo de puntos por señal; si hay más registros se reducen en el servidor
+            method: Método de reducción ('lttb' o 'minmax')
+            columnar: Retorna las fechas como epoch en ms en 't' en lugar de ISO 8601 en 'dias'
+        
+        Si se indica `max_points` y los agregados están construidos, se usa la
+        granularidad más gruesa que aún aporta `max_points` puntos en el rango.
+        """
         now = datetime.now()
         time_limit = now - timedelta(days=days)
         
-        query = SensorData.query.filter(SensorData.fecha >= time_limit)
+        # Si no se especifica paciente, usamos el activo por defecto para stats también
+        # o podríamos mostrar global, pero para "Panel de Salud" suele ser individual
+        patient_id = MonitorController.resolve_patient_id(patient_id)
         
-        if patient_id:
-            query = query.filter(SensorData.paciente_id == int(patient_id))
+        granularity = None
+        if max_points and patient_id and rollup_service.is_ready():
+            granularity = rollup_service.choose_granularity(days, max_points)
+        
+        if granularity:
+            rollups = rollup_service.get_series(patient_id, time_limit, granularity)
+            fechas = [r.bucket for r in rollups]
+            temperatura = [round(r.temp_sum / r.muestras, 2) for r in rollups]
+            heart_rate = [int(round(r.hr_sum / r.muestras)) for r in rollups]
+            spo2 = [int(round(r.spo2_sum / r.muestras)) for r in rollups]
+            total_puntos = sum(r.muestras for r in rollups)
         else:
-            # Si no se especifica paciente, usamos el activo por defecto para stats también
-            # o podríamos mostrar global, pero para "Panel de Salud" suele ser individual
-            paciente_activo = MonitorController.get_active_patient()
-            if paciente_activo:
-                query = query.filter(SensorData.paciente_id == paciente_activo.id)
+            query = db.select(*SENSOR_COLUMNS).where(SensorData.fecha >= time_limit)
+            if patient_id:
+                query = query.where(SensorData.paciente_id == patient_id)
             
-        records = query.order_by(SensorData.fecha.asc()).all()
+            records = db.session.execute(query.order_by(SensorData.fecha.asc())).all()
+            
+            fechas = [r.fecha for r in records]
+            temperatura = [float(r.valor) for r in records]
+            heart_rate = [int(r.heart_rate) for r in records]
+            spo2 = [int(r.spo2) for r in records]
+            total_puntos = len(records)
         
         # Preparar datos
-        dias = [r.fecha.isoformat() for r in records]
-        temperatura = [float(r.valor) for r in records]
-        heart_rate = [int(r.heart_rate) for r in records]
-        spo2 = [int(r.spo2) for r in records]
+        if columnar:
+            time_key = 't'
+            tiempos = [int(f.timestamp() * 1000) for f in fechas]
+        else:
+            time_key = 'dias'
+            tiempos = [f.isoformat() for f in fechas]
         
-        # Predicciones LSTM (simuladas por ahora)
-        predictions = []
-        if temperatura:
-            last_temp = temperatura[-1]
-            predictions = [last_temp + i * 0.1 for i in range(1, 4)]
+        # Predicción precalculada por el job del scheduler
+        forecast = forecast_engine.get(patient_id) if patient_id else None
         
-        return {
-            'dias': dias,
+        data = {
+            time_key: tiempos,
             'temperatura': temperatura,
             'heart_rate': heart_rate,
             'spo2': spo2,
-            'predictions': predictions,
-            'last_prediction_update': datetime.now().isoformat()
+            'predictions': forecast['temperatura']['prediccion'] if forecast else [],
+            'forecast': forecast,
+            'last_prediction_update': forecast['actualizado'] if forecast else None,
+            'total_puntos': total_puntos,
+            'granularidad': granularity or 'raw'
         }
+        if columnar:
+            data['formato'] = 'columnar'
+        
+        if max_points and len(fechas) > max_points:
+            MonitorController.downsample_stats(data, fechas, max_points, method, time_key)
+        
+        return data
+    
+    @staticmethod
+    def downsample_stats(data, fechas, max_points, method='lttb', time_key='dias'):
+        """
+        Reduce cada señal de `data` a como máximo `max_points` puntos
+        
+        Cada señal conserva sus propios puntos, por lo que sus fechas se retornan
+        en '<time_key>_por_senal'; `time_key` pasa a ser el eje de la temperatura.
+        """
+        x = np.fromiter((f.timestamp() for f in fechas), dtype=np.float64, count=len(fechas))
+        tiempos = np.asarray(data[time_key], dtype=object)
+        
+        tiempos_por_senal = {}
+        for key in ('temperatura', 'heart_rate', 'spo2'):
+            values = np.asarray(data[key])
+            indices = downsample(x, values, max_points, method)
+            data[key] = values[indices].tolist()
+            tiempos_por_senal[key] = tiempos[indices].tolist()
+        
+        data[time_key] = tiempos_por_senal['temperatura']
+        data[f'{time_key}_por_senal'] = tiempos_por_senal
+        data['downsampled'] = method
 
     @staticmethod
+    @read_only
     def get_global_stats():
-        """Obtiene estadísticas globales de todos los pacientes"""
+        """
+        Obtiene estadísticas globales de todos los pacientes
+        
+        Los conteos por estado salen de un único GROUP BY y los promedios de una
+        única consulta agregada. Las vistas leen el resultado de DashboardSnapshot,
+        que lo recalcula periódicamente.
+        """
         # Estadísticas de pacientes
-        total_pacientes = Paciente.query.count()
-        normales = Paciente.query.filter_by(estado='normal').count()
-        advertencia = Paciente.query.filter_by(estado='advertencia').count()
-        peligro = Paciente.query.filter(Paciente.estado.in_(['peligro', 'critico'])).count()
+        conteos = dict(db.session.query(Paciente.estado, db.func.count(Paciente.id)).group_by(Paciente.estado).all())
+        total_pacientes = sum(conteos.values())
+        normales = conteos.get('normal', 0)
+        advertencia = conteos.get('advertencia', 0)
+        peligro = conteos.get('peligro', 0) + conteos.get('critico', 0)
         
         # Pacientes que requieren atención
         pacientes_criticos = Paciente.query.filter(
@@ -157,17 +363,15 @@ class MonitorController:
         now = datetime.now()
         last_24h = now - timedelta(hours=24)
         
-        avg_temp = db.session.query(db.func.avg(SensorData.valor)).filter(
-            SensorData.fecha >= last_24h
-        ).scalar() or 0
-        
-        avg_hr = db.session.query(db.func.avg(SensorData.heart_rate)).filter(
-            SensorData.fecha >= last_24h
-        ).scalar() or 0
-        
-        avg_spo2 = db.session.query(db.func.avg(SensorData.spo2)).filter(
-            SensorData.fecha >= last_24h
-        ).scalar() or 0
+        if rollup_service.is_ready():
+            avg_temp, avg_hr, avg_spo2 = rollup_service.get_averages(last_24h)
+        else:
+            avg_temp, avg_hr, avg_spo2 = db.session.query(
+                db.func.avg(SensorData.valor),
+                db.func.avg(SensorData.heart_rate),
+                db.func.avg(SensorData.spo2)
+            ).filter(SensorData.fecha >= last_24h).one()
+            avg_temp, avg_hr, avg_spo2 = avg_temp or 0, avg_hr or 0, avg_spo2 or 0
         
         return {
             'total_pacientes': total_pacientes,
@@ -1,9 +1,19 @@
 """
 Controlador para la gestión de pacientes
 """
+import csv
+import io
+import json
+import zlib
 from models import db, Paciente
+from patient_registry import patient_registry
+from vitals_rules import rule_engine
+from controllers.monitor_controller import MonitorController
 from datetime import datetime
 
+EXPORT_FORMATS = ('csv', 'ndjson')
+PAGE_SIZE_MAX = 200
+
 class PatientController:
     """Controlador para operaciones CRUD de pacientes"""
     
@@ -13,6 +23,35 @@ class PatientController:
         # Devolvemos todos para que no desaparezcan al activar el monitoreo de uno
         return Paciente.query.all()
     
+    @staticmethod
+    def list_patients(after=None, limit=50, estado=None, search=None):
+        """
+        Página de pacientes ordenados por id con paginación por clave (keyset)
+        
+        Args:
+            after: Último id de la página anterior (None para la primera)
+            limit: Pacientes por página (máximo PAGE_SIZE_MAX)
+            estado: Filtra por estado
+            search: Prefijo del nombre
+        
+        Retorna (pacientes, cursor de la siguiente página o None). El coste de
+        cada página no depende de cuántas se hayan recorrido antes.
+        """
+        limit = max(1, min(limit, PAGE_SIZE_MAX))
+        query = db.select(Paciente)
+        if after is not None:
+            query = query.where(Paciente.id > after)
+        if estado:
+            query = query.where(Paciente.estado == estado)
+        if search:
+            # Escapar los comodines para que el prefijo se busque literalmente y use el índice
+            prefix = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.where(Paciente.nombre.like(f"{prefix}%", escape='\\'))
+        
+        pacientes = db.session.execute(query.order_by(Paciente.id).limit(limit + 1)).scalars().all()
+        next_cursor = pacientes[limit - 1].id if len(pacientes) > limit else None
+        return pacientes[:limit], next_cursor
+    
     @staticmethod
     def get_patient_by_id(patient_id):
         """Obtiene un paciente por su ID"""
@@ -33,6 +72,7 @@ class PatientController:
         )
         db.session.add(nuevo_paciente)
         db.session.commit()
+        patient_registry.invalidate()
         return nuevo_paciente
     
     @staticmethod
@@ -50,6 +90,10 @@ class PatientController:
         paciente.notas = data.get('notas', paciente.notas)
         
         db.session.commit()
+        patient_registry.invalidate()
+        # El estado puesto a mano sustituye al que llevaba el motor de reglas
+        # (solo en este proceso; ver VitalsRuleEngine.reset)
+        rule_engine.reset(patient_id)
         return paciente
     
     @staticmethod
@@ -58,6 +102,7 @@ class PatientController:
         paciente = Paciente.query.get_or_404(patient_id)
         paciente.activo = False
         db.session.commit()
+        patient_registry.invalidate()
         return paciente
     
     @staticmethod
@@ -70,17 +115,59 @@ class PatientController:
         paciente = Paciente.query.get_or_404(patient_id)
         paciente.activo = True
         db.session.commit()
+        patient_registry.invalidate()
         
         return paciente
     
     @staticmethod
     def get_patients_stats():
-        """Obtiene estadísticas de pacientes"""
-        pacientes = Paciente.query.filter_by(activo=True).all()
+        """Obtiene estadísticas de pacientes (un único GROUP BY por estado)"""
+        conteos = dict(db.session.query(Paciente.estado, db.func.count(Paciente.id))
+                       .filter(Paciente.activo == True).group_by(Paciente.estado).all())
         
         return {
-            'total': len(pacientes),
-            'normales': len([p for p in pacientes if p.estado == 'normal']),
-            'advertencia': len([p for p in pacientes if p.estado == 'advertencia']),
-            'criticos': len([p for p in pacientes if p.estado == 'critico'])
+            'total': sum(conteos.values()),
+            'normales': conteos.get('normal', 0),
+            'advertencia': conteos.get('advertencia', 0),
+            'criticos': conteos.get('critico', 0)
         }
+    
+    @staticmethod
+    def export_vitals(patient_id, since=None, until=None, fmt='csv', compress=False, batch_size=5000):
+        """
+        Genera el histórico de lecturas de un paciente en CSV o NDJSON por fragmentos
+        
+        Las filas se leen por lotes desde un cursor del servidor y cada lote se
+        emite en cuanto está listo, comprimido con gzip si `compress` es True,
+        así que la memoria no depende del tamaño del rango exportado.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Formato de exportación no soportado: {fmt}")
+        
+        compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: cabecera gzip
+        
+        def emit(text):
+            data = text.encode('utf-8')
+            return compressor.compress(data) if compressor else data
+        
+        if fmt == 'csv':
+            yield emit('fecha,temperatura,heart_rate,spo2\n')
+        
+        for rows in MonitorController.iter_sensor_rows(patient_id, since, until, batch_size=batch_size):
+            if fmt == 'csv':
+                buffer = io.StringIO()
+                csv.writer(buffer, lineterminator='\n').writerows(
+                    (r.fecha.isoformat(), r.valor, r.heart_rate, r.spo2) for r in rows
+                )
+                chunk = emit(buffer.getvalue())
+            else:
+                chunk = emit(''.join(
+                    json.dumps({'fecha': r.fecha.isoformat(), 'temperatura': r.valor,
+                                'heart_rate': r.heart_rate, 'spo2': r.spo2}) + '\n'
+                    for r in rows
+                ))
+            if chunk:
+                yield chunk
+        
+        if compressor:
+            yield compressor.flush()
@@ -0,0 +1,46 @@
+"""
+Instantánea en memoria de las estadísticas globales del dashboard
+"""
+import threading
+import time
+from datetime import datetime
+from controllers.monitor_controller import MonitorController
+
+
+class DashboardSnapshot:
+    """
+    Resultado de MonitorController.get_global_stats recalculado en segundo plano
+
+    Un job del scheduler llama a `refresh` cada pocos segundos; las vistas solo
+    leen la última instantánea, de modo que el coste por visita no depende del
+    número de usuarios con el dashboard abierto.
+    """
+
+    def __init__(self):
+        self._state = None  # (datos, instante monotónico, fecha de cálculo)
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Recalcula las estadísticas (requiere contexto de aplicación)"""
+        data = MonitorController.get_global_stats()
+        # Se reemplaza la tupla completa: los lectores nunca ven un estado a medias
+        self._state = (data, time.monotonic(), datetime.now())
+        return data
+
+    def get(self):
+        """Retorna la última instantánea con su antigüedad, calculándola si aún no existe"""
+        state = self._state
+        if state is None:
+            with self._lock:
+                state = self._state
+                if state is None:
+                    self.refresh()
+                    state = self._state
+
+        data, computed_at, computed_time = state
+        return dict(data,
+                    snapshot_age=round(time.monotonic() - computed_at, 1),
+                    snapshot_time=computed_time.isoformat())
+
+
+dashboard_snapshot = DashboardSnapshot()
@@ -0,0 +1,186 @@
+"""
+Envío de las consultas de solo lectura a la réplica de la base de datos
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'
+HEARTBEAT_KEY = 'replica_heartbeat'
+
+# Activo mientras se ejecuta una función marcada con @read_only
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+class RoutingSession(Session):
+    """Sesión que resuelve las consultas de @read_only contra la réplica si está al día"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _use_replica.get() and not self._flushing:
+            engine = replica_router.engine_for_reads()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(func):
+    """
+    Marca una función de controlador cuyas consultas pueden ir a la réplica
+
+    Con generadores, la marca se aplica mientras se consumen (las lecturas por
+    lotes ocurren al iterar, no al crear el generador).
+    """
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            generator = func(*args, **kwargs)
+            while True:
+                token = _use_replica.set(True)
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    _use_replica.reset(token)
+                yield item
+        return generator_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _use_replica.set(True)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Estado de la réplica de lectura y retraso medido con un latido
+
+    Cada `check_seconds` el proceso escribe la hora actual en la fila
+    'replica_heartbeat' de configuracion (en la primaria) y la lee en la
+    réplica; la diferencia con la hora actual es el retraso de replicación.
+    Mientras supere `max_lag_seconds`, o la réplica no responda, las lecturas
+    vuelven a la primaria.
+    """
+
+    def __init__(self, max_lag_seconds=10, check_seconds=2):
+        self.app = None
+        self.db = None
+        self.engine = None
+        self.max_lag_seconds = max_lag_seconds
+        self.check_seconds = check_seconds
+        self.lag_seconds = None
+        self.healthy = False
+        self._running = False
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.replica_reads = 0
+        self.fallback_reads = 0
+
+    def init_app(self, app, db):
+        """Activa el enrutado si hay una réplica configurada en SQLALCHEMY_BINDS"""
+        self.app = app
+        self.db = db
+        self.max_lag_seconds = app.config.get('REPLICA_MAX_LAG_SECONDS', self.max_lag_seconds)
+        self.check_seconds = app.config.get('REPLICA_LAG_CHECK_SECONDS', self.check_seconds)
+        if REPLICA_BIND not in app.config.get('SQLALCHEMY_BINDS', {}):
+            return
+        with app.app_context():
+            self.engine = db.engines[REPLICA_BIND]
+            self.check()
+        self.start()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='replica-lag', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._stop.set()
+
+    def engine_for_reads(self):
+        """Motor de la réplica o None si hay que leer de la primaria"""
+        if self.engine is None:
+            return None
+        if self.healthy:
+            self.replica_reads += 1
+            return self.engine
+        self.fallback_reads += 1
+        return None
+
+    def check(self):
+        """Escribe el latido en la primaria y mide el retraso en la réplica"""
+        from models import Configuracion
+        from sqlalchemy.exc import IntegrityError
+
+        db = self.db
+        now = time.time()
+        try:
+            updated = db.session.execute(
+                db.update(Configuracion).where(Configuracion.clave == HEARTBEAT_KEY).values(valor=f"{now:.3f}")
+            ).rowcount
+            if not updated:
+                db.session.add(Configuracion(clave=HEARTBEAT_KEY, valor=f"{now:.3f}",
+                                             descripcion='Latido para medir el retraso de la réplica'))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error writing replica heartbeat: %s", e)
+
+        try:
+            with self.engine.connect() as conn:
+                value = conn.execute(
+                    text("SELECT valor FROM configuracion WHERE clave = :clave"), {'clave': HEARTBEAT_KEY}
+                ).scalar()
+            self.lag_seconds = max(time.time() - float(value), 0.0) if value is not None else None
+        except Exception as e:
+            logger.warning("Replica unreachable: %s", e)
+            self.lag_seconds = None
+
+        healthy = self.lag_seconds is not None and self.lag_seconds <= self.max_lag_seconds
+        if healthy != self.healthy:
+            if healthy:
+                logger.info("Replica reads enabled (lag %.1fs)", self.lag_seconds)
+            else:
+                lag = f"{self.lag_seconds:.1f}s" if self.lag_seconds is not None else 'unknown'
+                logger.warning("Replica reads disabled (lag %s, max %ss)", lag, self.max_lag_seconds)
+        self.healthy = healthy
+        return healthy
+
+    def _run(self):
+        while not self._stop.wait(self.check_seconds):
+            try:
+                with self.app.app_context():
+                    self.check()
+            except Exception:
+                logger.exception("Error checking replica lag")
+
+    def get_stats(self):
+        """Retorna el estado de la réplica y cuántas lecturas fueron a cada servidor"""
+        return {
+            'configurada': self.engine is not None,
+            'activa': self.healthy,
+            'retraso_s': round(self.lag_seconds, 2) if self.lag_seconds is not None else None,
+            'max_retraso_s': self.max_lag_seconds,
+            'lecturas_replica': self.replica_reads,
+            'lecturas_primaria': self.fallback_reads
+        }
+
+
+replica_router = ReplicaRouter()
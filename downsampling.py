@@ -0,0 +1,87 @@
+"""
+Reducción de series temporales para gráficos (LTTB y mín/máx por bloques)
+"""
+import numpy as np
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: índices de los `threshold` puntos que mejor
+    conservan la forma visual de la serie
+
+    El primer y el último punto siempre se conservan. Cada bloque se evalúa con
+    operaciones vectorizadas, por lo que el bucle de Python es de `threshold`
+    iteraciones y no de len(x).
+    """
+    n = len(x)
+    if threshold >= n or n < 2:
+        return np.arange(n)
+    if threshold < 3:
+        # Sin bloques intermedios: solo el primer y el último punto
+        return np.array([0, n - 1])
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Límites de los bloques intermedios (el primero y el último punto van aparte)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Promedio del bloque siguiente (o el último punto en el último bloque)
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        areas = np.abs((x[a] - avg_x) * (bucket_y - y[a]) - (x[a] - bucket_x) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    return selected
+
+
+def minmax_indices(x, y, threshold):
+    """
+    Índices del mínimo y el máximo de cada bloque (threshold // 2 bloques)
+
+    Conserva los picos de la señal, útil para detectar valores anómalos.
+    Es completamente vectorizado: los bloques se agrupan en una matriz.
+    """
+    n = len(y)
+    buckets = max(threshold // 2, 1)
+    if threshold >= n:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.float64)
+    size = -(-n // buckets)
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    blocks = padded.reshape(buckets, size)
+
+    # Bloques vacíos al final (solo relleno) se descartan
+    valid = ~np.all(np.isnan(blocks), axis=1)
+    blocks = blocks[valid]
+    offsets = np.arange(buckets)[valid] * size
+
+    mins = offsets + np.nanargmin(blocks, axis=1)
+    maxs = offsets + np.nanargmax(blocks, axis=1)
+    return np.unique(np.concatenate((mins, maxs)))
+
+
+METHODS = {
+    'lttb': lttb_indices,
+    'minmax': minmax_indices
+}
+
+
+def downsample(x, y, max_points, method='lttb'):
+    """Retorna los índices a conservar para dibujar la serie con como máximo `max_points` puntos"""
+    if method not in METHODS:
+        raise ValueError(f"Método de reducción desconocido: {method}")
+    return METHODS[method](x, y, max_points)
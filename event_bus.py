@@ -0,0 +1,116 @@
+"""
+Bus de eventos en memoria (pub/sub) para difundir lecturas en tiempo real
+"""
+import itertools
+import queue
+import threading
+from collections import deque
+
+
+class Event:
+    """Evento publicado en un canal"""
+    __slots__ = ('id', 'channel', 'data')
+
+    def __init__(self, id, channel, data):
+        self.id = id
+        self.channel = channel
+        self.data = data
+
+
+class Subscription:
+    """Suscripción a un canal; cada suscriptor tiene su propia cola acotada"""
+
+    def __init__(self, channel, maxsize):
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, event):
+        # Si el consumidor va lento se descarta el evento más antiguo
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Retorna el siguiente evento o None si vence el timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    """
+    Difusión de eventos a los suscriptores de cada canal
+
+    Cada canal guarda los últimos `history` eventos para que un cliente que se
+    reconecta con Last-Event-ID reciba lo que se perdió mientras estaba desconectado.
+    """
+
+    def __init__(self, history=256, queue_size=1000):
+        self.history = history
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._history = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        self.published = 0
+
+    def publish(self, channel, data):
+        """Publica `data` en el canal y retorna el id del evento"""
+        with self._lock:
+            event = Event(next(self._ids), channel, data)
+            history = self._history.get(channel)
+            if history is None:
+                history = self._history[channel] = deque(maxlen=self.history)
+            history.append(event)
+            subscribers = tuple(self._subscribers.get(channel, ()))
+            self.published += 1
+
+        for subscription in subscribers:
+            subscription.put(event)
+        return event.id
+
+    def subscribe(self, channel, last_event_id=None):
+        """Crea una suscripción, reenviando los eventos posteriores a `last_event_id`"""
+        subscription = Subscription(channel, self.queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._history.get(channel, ()):
+                    if event.id > last_event_id:
+                        subscription.put(event)
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def get_stats(self):
+        """Retorna los contadores del bus"""
+        with self._lock:
+            return {
+                'canales': len(self._subscribers),
+                'suscriptores': sum(len(s) for s in self._subscribers.values()),
+                'publicados': self.published
+            }
+
+
+event_bus = EventBus()
+
+
+def patient_channel(patient_id):
+    """Nombre del canal de lecturas de un paciente"""
+    return f'paciente:{patient_id}'
@@ -0,0 +1,184 @@
+"""
+Predicción de señales vitales por paciente con suavizado exponencial de Holt
+"""
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from models import db, Paciente, VitalsRollup
+import rollup_service
+
+SIGNALS = ('temperatura', 'heart_rate', 'spo2')
+Z_95 = 1.96
+
+
+class PatientForecast:
+    """Estado del modelo de un paciente: nivel, tendencia y varianza del error por señal"""
+    __slots__ = ('level', 'trend', 'variance', 'last_bucket', 'samples', 'forecast')
+
+    def __init__(self):
+        self.level = np.full(len(SIGNALS), np.nan)
+        self.trend = np.zeros(len(SIGNALS))
+        self.variance = np.zeros(len(SIGNALS))
+        self.last_bucket = None
+        self.samples = 0
+        self.forecast = None
+
+
+def holt_update(level, trend, variance, y, alpha, beta, phi, gamma):
+    """
+    Un paso del modelo de Holt con tendencia amortiguada sobre arrays de cualquier forma
+
+    Las posiciones con `y` NaN conservan su estado; las que aún no tienen nivel
+    se inicializan con la observación. Retorna (nivel, tendencia, varianza).
+    """
+    observed = ~np.isnan(y)
+    fresh = observed & np.isnan(level)
+    known = observed & ~fresh
+
+    predicted = level + phi * trend
+    error = np.where(known, y - predicted, 0.0)
+    new_level = np.where(known, predicted + alpha * error, level)
+    new_trend = np.where(known, beta * (new_level - level) + (1 - beta) * phi * trend, trend)
+    new_variance = np.where(known, (1 - gamma) * variance + gamma * error ** 2, variance)
+
+    new_level = np.where(fresh, y, new_level)
+    new_trend = np.where(fresh, 0.0, new_trend)
+    return new_level, new_trend, new_variance
+
+
+def holt_forecast(level, trend, variance, horizons, alpha, phi):
+    """Predicción y semiancho de la banda del 95 % para cada horizonte (en pasos)"""
+    h = np.asarray(horizons, dtype=np.float64)[:, None]
+    damping = phi * (1 - phi ** h) / (1 - phi) if phi < 1 else h
+    prediction = level[None, :] + damping * trend[None, :]
+    band = Z_95 * np.sqrt(variance[None, :] * (1 + (h - 1) * alpha ** 2))
+    return prediction, band
+
+
+class ForecastEngine:
+    """
+    Predicciones precalculadas de todos los pacientes activos
+
+    Un job del scheduler llama a `update`, que lee de los agregados por minuto
+    solo los intervalos nuevos desde la última ejecución y actualiza a la vez
+    (con operaciones vectorizadas sobre pacientes × señales) el estado de todos
+    los modelos, sin reajustar desde cero. Las consultas leen la predicción ya
+    calculada con `get`. Los modelos de los pacientes que dejan de estar activos
+    se conservan durante `max_age_hours` desde su último dato, así que al volver
+    a activarlos continúan donde estaban en lugar de calentarse de nuevo.
+    """
+
+    def __init__(self, horizons=(60, 120, 180), alpha=0.3, beta=0.05, phi=0.98, gamma=0.05, warmup_hours=6,
+                 max_age_hours=24):
+        self.horizons = horizons
+        self.alpha = alpha
+        self.beta = beta
+        self.phi = phi
+        self.gamma = gamma
+        self.warmup_hours = warmup_hours
+        self.max_age_hours = max_age_hours
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def configure(self, app):
+        self.horizons = app.config.get('FORECAST_HORIZONS_MIN', self.horizons)
+        self.alpha = app.config.get('FORECAST_ALPHA', self.alpha)
+        self.beta = app.config.get('FORECAST_BETA', self.beta)
+        self.phi = app.config.get('FORECAST_PHI', self.phi)
+        self.warmup_hours = app.config.get('FORECAST_WARMUP_HOURS', self.warmup_hours)
+        self.max_age_hours = app.config.get('FORECAST_STATE_MAX_AGE_HOURS', self.max_age_hours)
+
+    def update(self, until=None):
+        """
+        Incorpora los agregados por minuto completos hasta `until` (requiere contexto de aplicación)
+        Retorna el número de intervalos nuevos procesados
+        """
+        if not rollup_service.is_ready():
+            return 0
+        until = until or rollup_service.truncate(datetime.now() - timedelta(minutes=2), 'minute')
+        patient_ids = db.session.execute(
+            db.select(Paciente.id).where(Paciente.activo == True)
+        ).scalars().all()
+        if not patient_ids:
+            return 0
+
+        with self._lock:
+            states = {pid: self._states.get(pid) or PatientForecast() for pid in patient_ids}
+        warmup = until - timedelta(hours=self.warmup_hours)
+        since = {pid: state.last_bucket or warmup for pid, state in states.items()}
+
+        rows = db.session.execute(
+            db.select(VitalsRollup.paciente_id, VitalsRollup.bucket, VitalsRollup.muestras,
+                      VitalsRollup.temp_sum, VitalsRollup.hr_sum, VitalsRollup.spo2_sum)
+            .where(VitalsRollup.granularidad == 'minute',
+                   VitalsRollup.paciente_id.in_(patient_ids),
+                   VitalsRollup.bucket > min(since.values()),
+                   VitalsRollup.bucket < until)
+            .order_by(VitalsRollup.bucket)
+        ).all()
+        rows = [r for r in rows if r.bucket > since[r.paciente_id] and r.muestras]
+
+        if rows:
+            # Matriz pacientes × minutos × señales con NaN donde no hay datos
+            order = {pid: i for i, pid in enumerate(states)}
+            buckets = sorted({r.bucket for r in rows})
+            column = {bucket: j for j, bucket in enumerate(buckets)}
+            values = np.full((len(states), len(buckets), len(SIGNALS)), np.nan)
+            for r in rows:
+                values[order[r.paciente_id], column[r.bucket]] = (
+                    r.temp_sum / r.muestras, r.hr_sum / r.muestras, r.spo2_sum / r.muestras
+                )
+
+            level = np.stack([s.level for s in states.values()])
+            trend = np.stack([s.trend for s in states.values()])
+            variance = np.stack([s.variance for s in states.values()])
+            for j in range(len(buckets)):
+                level, trend, variance = holt_update(level, trend, variance, values[:, j],
+                                                     self.alpha, self.beta, self.phi, self.gamma)
+
+            observed = ~np.isnan(values[:, :, 0])
+            for i, (pid, state) in enumerate(states.items()):
+                state.level, state.trend, state.variance = level[i], trend[i], variance[i]
+                if observed[i].any():
+                    state.samples += int(observed[i].sum())
+                    state.last_bucket = buckets[int(np.flatnonzero(observed[i])[-1])]
+
+        computed = datetime.now().isoformat()
+        for state in states.values():
+            if state.last_bucket is not None:
+                state.forecast = self._forecast(state, computed)
+
+        with self._lock:
+            self._states.update(states)
+            # Modelos de pacientes inactivos sin datos desde hace más de max_age_hours
+            oldest = until - timedelta(hours=self.max_age_hours)
+            expired = [pid for pid, state in self._states.items()
+                       if pid not in states and (state.last_bucket is None or state.last_bucket < oldest)]
+            for pid in expired:
+                del self._states[pid]
+        return len(rows)
+
+    def _forecast(self, state, computed):
+        prediction, band = holt_forecast(state.level, state.trend, state.variance,
+                                         self.horizons, self.alpha, self.phi)
+        forecast = {
+            'horizontes_min': list(self.horizons),
+            'desde': state.last_bucket.isoformat(),
+            'actualizado': computed,
+            'muestras': state.samples
+        }
+        for k, signal in enumerate(SIGNALS):
+            forecast[signal] = {
+                'prediccion': np.round(prediction[:, k], 2).tolist(),
+                'inferior': np.round(prediction[:, k] - band[:, k], 2).tolist(),
+                'superior': np.round(prediction[:, k] + band[:, k], 2).tolist()
+            }
+        return forecast
+
+    def get(self, patient_id):
+        """Última predicción calculada del paciente o None"""
+        state = self._states.get(patient_id)
+        return state.forecast if state is not None else None
+
+
+forecast_engine = ForecastEngine()
@@ -0,0 +1,255 @@
+"""
+Importación masiva de lecturas históricas almacenadas en los dispositivos
+"""
+import csv
+import gzip
+import io
+import json
+import re
+import time
+from datetime import datetime
+import numpy as np
+from models import db, SensorData
+from patient_registry import patient_registry
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# Nombres aceptados por columna: los del payload MQTT y los del fichero de exportación
+FIELDS = (
+    ('fecha', ('fecha', 'timestamp', 'ts')),
+    ('valor', ('temperatura', 'temperature', 'valor')),
+    ('heart_rate', ('heart_rate', 'hr')),
+    ('spo2', ('spo2',))
+)
+
+# Rangos aceptados por señal; las filas fuera de rango se descartan
+LIMITS = {
+    'valor': (25.0, 45.0),
+    'heart_rate': (20, 250),
+    'spo2': (50, 100)
+}
+
+
+def detect_format(filename, fmt=None):
+    """Formato del fichero a partir del parámetro o de su extensión (.csv, .ndjson, .jsonl, opcionalmente .gz)"""
+    if fmt:
+        fmt = fmt.lower()
+    else:
+        name = (filename or '').lower()
+        if name.endswith('.gz'):
+            name = name[:-3]
+        fmt = 'ndjson' if name.endswith(('.ndjson', '.jsonl')) else 'csv'
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Formato de importación no soportado: {fmt}")
+    return fmt
+
+
+def open_stream(stream, filename=None):
+    """Envuelve un flujo binario como texto, descomprimiendo si es gzip"""
+    if (filename or '').lower().endswith('.gz'):
+        stream = gzip.GzipFile(fileobj=stream)
+    return io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+
+def iter_batches(text_stream, fmt, batch_size=20000):
+    """Lee el fichero por lotes de `batch_size` registros como tuplas (fecha, valor, heart_rate, spo2)"""
+    if fmt == 'csv':
+        reader = csv.reader(text_stream)
+        header = [h.strip().lower() for h in next(reader, [])]
+        positions = []
+        for column, names in FIELDS:
+            index = next((header.index(n) for n in names if n in header), None)
+            if index is None:
+                raise ValueError(f"Falta la columna {names[0]} en el CSV")
+            positions.append(index)
+        records = (tuple(row[i] if i < len(row) else None for i in positions) for row in reader if row)
+    else:
+        def parse_lines():
+            for line in text_stream:
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    yield (None, None, None, None)
+                    continue
+                if not isinstance(data, dict):
+                    # Una línea válida que no es un objeto cuenta como fila inválida
+                    yield (None, None, None, None)
+                    continue
+                yield tuple(next((data[n] for n in names if data.get(n) is not None), None)
+                            for _, names in FIELDS)
+        records = parse_lines()
+
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _parse_time(value):
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        try:
+            fecha = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        # Con zona horaria: a la hora local sin zona, como las marcas Unix y las lecturas MQTT
+        return fecha.astimezone().replace(tzinfo=None) if fecha.tzinfo else fecha
+    # Marca de tiempo Unix en segundos o milisegundos
+    try:
+        return datetime.fromtimestamp(number / 1000 if number > 1e11 else number)
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+# ISO 8601 sin zona horaria y con año de cuatro cifras: lo que numpy convierte igual que _parse_time
+_NAIVE_ISO = re.compile(r'\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,6})?)?)?')
+
+
+def parse_times(values):
+    """Convierte las fechas a datetime64[us]; las inválidas quedan como NaT"""
+    # Camino rápido solo si todas son ISO 8601 sin zona horaria: numpy leería los
+    # enteros como microsegundos y pasaría a UTC las fechas con desfase
+    if all(v is None or v == '' or (isinstance(v, str) and _NAIVE_ISO.fullmatch(v)) for v in values):
+        try:
+            return np.array(values, dtype='datetime64[us]')
+        except ValueError:
+            pass
+    return np.array([_parse_time(v) for v in values], dtype='datetime64[us]')
+
+
+def parse_numbers(values):
+    """Convierte una columna a float64; los valores vacíos o inválidos quedan como NaN"""
+    try:
+        return np.array([np.nan if v is None or v == '' else v for v in values], dtype=np.float64)
+    except (TypeError, ValueError):
+        result = np.full(len(values), np.nan)
+        for i, v in enumerate(values):
+            try:
+                result[i] = float(v)
+            except (TypeError, ValueError):
+                pass
+        return result
+
+
+def prepare_batch(records, patient_id):
+    """
+    Valida y deduplica un lote de registros de forma vectorizada
+
+    Descarta filas con fecha inválida o señales fuera de rango, repeticiones de
+    la misma fecha dentro del lote y fechas que ya existen en la base de datos
+    para el paciente. Retorna (filas a insertar, inválidas, duplicadas).
+    """
+    columns = list(zip(*records))
+    fechas = parse_times(columns[0])
+    signals = {name: parse_numbers(columns[i]) for i, (name, _) in enumerate(FIELDS) if i > 0}
+
+    valid = ~np.isnat(fechas)
+    for name, values in signals.items():
+        low, high = LIMITS[name]
+        valid &= (values >= low) & (values <= high)
+    invalid = int(len(records) - valid.sum())
+
+    fechas = fechas[valid]
+    signals = {name: values[valid] for name, values in signals.items()}
+    if not len(fechas):
+        return [], invalid, 0
+
+    # Una lectura por fecha dentro del lote (np.unique además las ordena)
+    fechas, first = np.unique(fechas, return_index=True)
+    signals = {name: values[first] for name, values in signals.items()}
+    duplicated = int(valid.sum() - len(fechas))
+
+    # Fechas que ya están guardadas para el paciente en el rango del lote
+    existing = db.session.execute(
+        db.select(SensorData.fecha).where(
+            SensorData.paciente_id == patient_id,
+            SensorData.fecha >= fechas[0].item(),
+            SensorData.fecha <= fechas[-1].item()
+        )
+    ).scalars().all()
+    if existing:
+        new = ~np.isin(fechas, np.array(existing, dtype='datetime64[us]'))
+        duplicated += int(len(fechas) - new.sum())
+        fechas = fechas[new]
+        signals = {name: values[new] for name, values in signals.items()}
+
+    rows = [
+        {'paciente_id': patient_id, 'fecha': fecha, 'valor': valor, 'heart_rate': int(hr), 'spo2': int(spo2)}
+        for fecha, valor, hr, spo2 in zip(fechas.tolist(), signals['valor'].tolist(),
+                                          signals['heart_rate'].tolist(), signals['spo2'].tolist())
+    ]
+    return rows, invalid, duplicated
+
+
+def import_readings(device_id, text_stream, fmt='csv', batch_size=20000, progress=None):
+    """
+    Importa las lecturas de un fichero CSV/NDJSON de un dispositivo
+
+    El paciente se resuelve una sola vez a partir de `device_id`; cada lote se
+    valida, se deduplica y se inserta con un INSERT de varias filas en su propia
+    transacción. `progress` recibe el resumen parcial tras cada lote.
+    """
+    paciente = patient_registry.get_by_device(device_id)
+    if paciente is None:
+        raise ValueError(f"No hay ningún paciente con el dispositivo {device_id}")
+
+    started = time.perf_counter()
+    result = {
+        'device_id': device_id,
+        'paciente_id': paciente.id,
+        'leidas': 0,
+        'insertadas': 0,
+        'invalidas': 0,
+        'duplicadas': 0,
+        'segundos': 0.0,
+        'filas_por_segundo': 0
+    }
+
+    for records in iter_batches(text_stream, fmt, batch_size):
+        rows, invalid, duplicated = prepare_batch(records, paciente.id)
+        if rows:
+            db.session.execute(SensorData.__table__.insert(), rows)
+        db.session.commit()
+
+        result['leidas'] += len(records)
+        result['insertadas'] += len(rows)
+        result['invalidas'] += invalid
+        result['duplicadas'] += duplicated
+        elapsed = time.perf_counter() - started
+        result['segundos'] = round(elapsed, 3)
+        result['filas_por_segundo'] = round(result['leidas'] / elapsed) if elapsed else 0
+        if progress:
+            progress(result)
+
+    return result
+
+
+def init_import(app):
+    """Registra el comando de importación de lecturas históricas"""
+    import click
+
+    @app.cli.command('import-readings')
+    @click.argument('device_id')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), default=None,
+                  help='Formato del fichero (por defecto según la extensión)')
+    def import_readings_command(device_id, path, fmt):
+        """Importa un fichero CSV/NDJSON de lecturas guardadas en un dispositivo"""
+        def report(result):
+            print(f"{result['leidas']} filas leídas, {result['insertadas']} insertadas "
+                  f"({result['filas_por_segundo']} filas/s)")
+
+        with open(path, 'rb') as f:
+            result = import_readings(device_id, open_stream(f, path), detect_format(path, fmt),
+                                     batch_size=app.config.get('IMPORT_BATCH_SIZE', 20000), progress=report)
+        print(f"Importación completada: {result['insertadas']} insertadas, {result['duplicadas']} duplicadas, "
+              f"{result['invalidas']} inválidas en {result['segundos']} s")
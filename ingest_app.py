@@ -0,0 +1,123 @@
+"""
+Servicio de ingesta MQTT independiente de la aplicación web
+
+Uso:
+    python ingest_app.py
+    python ingest_app.py --processes 4
+    python ingest_app.py --processes 4 --metrics-port 9100
+    python ingest_app.py --partitions 8 --first-partition 4 --processes 4
+
+Comparte `models` y `config` con la web pero no registra rutas. Los procesos se
+reparten los dispositivos, no los mensajes: cada uno tiene una partición
+(0..N-1) y solo procesa los dispositivos cuyo device_id cae en ella, así las
+lecturas parciales de un dispositivo se fusionan y sus reglas se evalúan
+siempre en el mismo proceso. Todos reciben todos los mensajes de
+healthmonitor/# y descartan los ajenos, de modo que el tráfico desde el broker
+crece con el número de procesos. En healthmonitor/<device_id>/data y
+healthmonitor/<device_id>/bin el descarte se hace por el tópico, sin decodificar
+el mensaje; el device_id del tópico debe coincidir con el del cuerpo.
+
+Con --processes arranca un proceso por núcleo (o el número indicado) en esta
+máquina, con las particiones --first-partition en adelante; --partitions es el
+total entre todas las máquinas (por defecto, los procesos de esta). Cada
+partición debe tener exactamente un proceso en marcha. La web debe arrancarse
+con MQTT_INGEST=false para no procesar las lecturas dos veces.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from flask import Flask
+from config import config
+from models import db
+from mqtt_service import init_mqtt, ingest_queue, sensor_writer
+from vitals_rules import rule_engine
+from patient_registry import patient_registry
+from log_config import configure_logging
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def create_ingest_app(config_name='default', partitions=1, partition=0):
+    """Aplicación mínima (configuración y base de datos) para el proceso de ingesta"""
+    app = Flask(__name__)
+    app.config.from_object(config[config_name])
+    configure_logging(app.config)
+    app.config['MQTT_PARTITIONS'] = partitions
+    app.config['MQTT_PARTITION'] = partition
+
+    db.init_app(app)
+    patient_registry.init_app(app)
+    return app
+
+
+def run(config_name='default', partitions=1, partition=0, metrics_port=None):
+    """Conecta el cliente de ingesta y espera hasta recibir SIGTERM o SIGINT"""
+    app = create_ingest_app(config_name, partitions, partition)
+    client = init_mqtt(app, ingest=True)
+    if client is None:
+        raise SystemExit(1)
+    if metrics_port:
+        # Sin servidor web: /metrics en un puerto propio del proceso
+        metrics.start_http_server(metrics_port)
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopped.set())
+    signal.signal(signal.SIGINT, lambda *args: stopped.set())
+    logger.info("Ingestion process %d handling partition %d of %d", os.getpid(), partition, partitions)
+    stopped.wait()
+
+    client.loop_stop()
+    client.disconnect()
+    # Los procesos hijos de multiprocessing no ejecutan atexit: vaciar explícitamente
+    ingest_queue.stop()
+    sensor_writer.stop()
+    rule_engine.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default=os.environ.get('FLASK_CONFIG', 'default'), choices=list(config))
+    parser.add_argument('--partitions', type=int, default=int(os.environ.get('MQTT_PARTITIONS') or 0),
+                        help='Particiones de dispositivos entre todas las máquinas (0 = los procesos de esta)')
+    parser.add_argument('--first-partition', type=int, default=int(os.environ.get('MQTT_PARTITION') or 0),
+                        help='Partición del primer proceso de esta máquina')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Procesos de ingesta en esta máquina (0 = uno por núcleo)')
+    parser.add_argument('--metrics-port', type=int, default=int(os.environ.get('METRICS_PORT') or 0),
+                        help='Puerto de /metrics (el proceso i usa puerto + i; 0 = desactivado)')
+    args = parser.parse_args()
+
+    processes = args.processes or os.cpu_count() or 1
+    partitions = args.partitions or args.first_partition + processes
+    if args.first_partition < 0 or args.first_partition + processes > partitions:
+        parser.error(f'las particiones {args.first_partition}..{args.first_partition + processes - 1} '
+                     f'no caben en --partitions {partitions}')
+    if processes == 1:
+        run(args.config, partitions, args.first_partition, args.metrics_port)
+        return
+
+    # Cada proceso tiene su propio cliente, cola, escritor y conexiones a la base de datos
+    workers = [multiprocessing.Process(target=run, name=f'ingest-{args.first_partition + i}',
+                                       args=(args.config, partitions, args.first_partition + i,
+                                             args.metrics_port + i if args.metrics_port else None))
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    def terminate(*args):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    main()
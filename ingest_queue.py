@@ -0,0 +1,259 @@
+"""
+Cola acotada entre el hilo de red de MQTT y los hilos que procesan las lecturas
+"""
+import atexit
+import base64
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+from datetime import datetime
+import metrics
+from binary_payload import BinaryBatch
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('block', 'drop_oldest', 'spill')
+
+
+def default_spill_path(partition=0):
+    """Fichero de derrame por partición: los procesos de ingesta de una máquina no comparten fichero"""
+    return os.path.join(tempfile.gettempdir(), f'healthmonitor-ingest-spill-p{partition}.ndjson')
+
+
+def _encode_batch(value):
+    # Los lotes binarios se guardan en el fichero de derrame en base64
+    if isinstance(value, BinaryBatch):
+        return {'$bin': value.device_id, '$b64': base64.b64encode(value.payload).decode('ascii')}
+    raise TypeError(f"{type(value).__name__} no serializable")
+
+
+def _decode_batch(obj):
+    if set(obj) == {'$bin', '$b64'}:
+        return BinaryBatch(obj['$bin'], base64.b64decode(obj['$b64']))
+    return obj
+
+
+class IngestQueue:
+    """
+    Reparte los mensajes recibidos entre `workers` hilos trabajadores
+
+    Cada trabajador tiene su propia cola y los mensajes se asignan según su clave
+    (device_id), así las lecturas parciales de un mismo dispositivo se procesan
+    en el orden de llegada. Cuando una cola está llena se aplica `policy`:
+
+    - block: el hilo de red espera hasta que haya hueco (contrapresión al broker)
+    - drop_oldest: se descarta el mensaje más antiguo de la cola
+    - spill: el mensaje se escribe en `spill_path` y se reprocesa cuando la cola se vacía
+    """
+
+    def __init__(self, handler=None, workers=4, max_size=10000, policy='block', spill_path=None):
+        self.handler = handler
+        self.workers = workers
+        self.max_size = max_size
+        self.policy = policy
+        self.spill_path = spill_path or default_spill_path()
+
+        self._queues = []
+        self._threads = []
+        self._running = False
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._spill_pending = False
+
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.errors = 0
+        self.lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def init_app(self, app, handler):
+        """Configura la cola con la app y arranca los trabajadores"""
+        self.handler = handler
+        self.workers = max(1, app.config.get('INGEST_WORKERS', self.workers))
+        self.max_size = app.config.get('INGEST_QUEUE_SIZE', self.max_size)
+        self.policy = app.config.get('INGEST_BACKPRESSURE', self.policy)
+        partition = app.config.get('MQTT_PARTITION', 0)
+        spill_path = app.config.get('INGEST_SPILL_PATH')
+        if spill_path and app.config.get('MQTT_PARTITIONS', 1) > 1:
+            # La misma variable de entorno llega a todas las particiones de la máquina
+            root, ext = os.path.splitext(spill_path)
+            spill_path = f"{root}-p{partition}{ext}"
+        self.spill_path = spill_path or default_spill_path(partition)
+        if self.policy not in POLICIES:
+            raise ValueError(f"Política de contrapresión no soportada: {self.policy}")
+        self.start()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        size = max(1, -(-self.max_size // self.workers))
+        self._queues = [queue.Queue(maxsize=size) for _ in range(self.workers)]
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), name=f'ingest-worker-{i}', daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+        # Mensajes derramados en una ejecución anterior
+        self._spill_pending = os.path.exists(self.spill_path)
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Procesa lo que queda en las colas y detiene los trabajadores"""
+        if not self._running:
+            return
+        self._running = False
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    def put(self, key, data, received_at=None):
+        """Encola un mensaje ya decodificado; retorna False si se descartó"""
+        item = (data, received_at or datetime.now())
+        q = self._queues[hash(key) % len(self._queues)]
+        with self._lock:
+            self.enqueued += 1
+
+        if self.policy == 'block':
+            q.put(item)
+            return True
+
+        try:
+            q.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        if self.policy == 'spill':
+            self._spill(item)
+            return True
+
+        while True:
+            try:
+                q.get_nowait()
+                with self._lock:
+                    self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                q.put_nowait(item)
+                return True
+            except queue.Full:
+                continue
+
+    def _spill(self, item):
+        data, received_at = item
+        line = json.dumps({'t': received_at.isoformat(), 'd': data}, default=_encode_batch)
+        try:
+            with self._spill_lock:
+                with open(self.spill_path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+                self._spill_pending = True
+            with self._lock:
+                self.spilled += 1
+        except OSError as e:
+            with self._lock:
+                self.dropped += 1
+            logger.error("Error spilling ingest message to %s: %s", self.spill_path, e)
+
+    def _replay_spill(self):
+        # Un solo trabajador reprocesa el fichero de principio a fin; los demás siguen con su cola
+        if not self._replay_lock.acquire(blocking=False):
+            return
+        try:
+            self._replay_file()
+        finally:
+            self._replay_lock.release()
+
+    def _replay_file(self):
+        # Los nuevos derrames van a un fichero nuevo mientras se reprocesa el anterior
+        replay_path = self.spill_path + '.replay'
+        with self._spill_lock:
+            if not self._spill_pending:
+                return
+            self._spill_pending = False
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spill_path):
+                    return
+                os.replace(self.spill_path, replay_path)
+
+        with open(replay_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line, object_hook=_decode_batch)
+                    data, received_at = entry['d'], datetime.fromisoformat(entry['t'])
+                except (ValueError, KeyError, TypeError):
+                    # Línea truncada o corrupta (JSONDecodeError es un ValueError)
+                    continue
+                self._process(data, received_at, replayed=True)
+        os.remove(replay_path)
+
+        with self._spill_lock:
+            # Lo derramado durante el reprocesado se reprocesa en la siguiente pasada
+            if os.path.exists(self.spill_path) and os.path.getsize(self.spill_path):
+                self._spill_pending = True
+
+    def _run(self, q):
+        while True:
+            try:
+                item = q.get(timeout=0.5)
+            except queue.Empty:
+                if not self._running:
+                    return
+                if self._spill_pending:
+                    try:
+                        self._replay_spill()
+                    except Exception:
+                        # El fichero queda en disco y se reintenta con el siguiente derrame o arranque
+                        logger.exception("Error replaying spilled ingest messages from %s", self.spill_path)
+                continue
+            if item is None:
+                return
+            self._process(*item)
+
+    def _process(self, data, received_at, replayed=False):
+        lag_ms = (datetime.now() - received_at).total_seconds() * 1000
+        try:
+            self.handler(data, received_at, replayed)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            metrics.mqtt_messages_failed.inc('process')
+            logger.exception("Error processing MQTT message")
+        with self._lock:
+            self.processed += 1
+            if replayed:
+                self.replayed += 1
+            else:
+                self.lag_ms = lag_ms
+                self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+
+    def depth(self):
+        """Mensajes esperando en las colas"""
+        return sum(q.qsize() for q in self._queues)
+
+    def get_stats(self):
+        """Retorna la profundidad, el retraso y los contadores de la cola"""
+        return {
+            'depth': self.depth(),
+            'capacity': self.max_size,
+            'workers': self.workers,
+            'policy': self.policy,
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+            'replayed': self.replayed,
+            'errors': self.errors,
+            'lag_ms': round(self.lag_ms, 2),
+            'max_lag_ms': round(self.max_lag_ms, 2)
+        }
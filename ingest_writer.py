@@ -0,0 +1,271 @@
+"""
+Escritura diferida (write-behind) de lecturas de sensores en lotes
+"""
+import atexit
+import logging
+import threading
+import time
+from sqlalchemy.exc import InterfaceError, OperationalError
+from models import db, SensorData
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SensorDataWriter:
+    """
+    Acumula filas de SensorData en memoria y las inserta en bloque
+
+    El buffer se vacía cuando alcanza `batch_size` filas o cuando la fila más
+    antigua lleva `flush_interval_ms` esperando, lo que ocurra primero. Si la base
+    de datos no da abasto y el buffer supera `max_buffer` filas, las más antiguas
+    se descartan y se contabilizan en `dropped`.
+
+    Ante un error transitorio (conexión perdida, deadlock) las filas vuelven al
+    inicio del buffer y se reintentan tras `retry_backoff_ms`, el doble en cada
+    fallo seguido; tras `max_retries` reintentos se descartan y se cuentan en `failed`.
+    Ante cualquier otro error (p. ej. una clave foránea inválida) el lote se parte
+    por la mitad y se reintenta hasta aislar las filas que fallan, que son las
+    únicas que se descartan. Al detenerse se sigue reintentando durante
+    `stop_timeout` segundos como máximo.
+    """
+
+    def __init__(self, app=None, batch_size=500, flush_interval_ms=250, max_buffer=50000,
+                 max_retries=5, retry_backoff_ms=500, stop_timeout=10):
+        self.app = None
+        self.batch_size = batch_size
+        self.flush_interval_ms = flush_interval_ms
+        self.max_buffer = max_buffer
+        self.max_retries = max_retries
+        self.retry_backoff_ms = retry_backoff_ms
+        self.stop_timeout = stop_timeout
+
+        self._buffer = []
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._attempts = 0  # Fallos seguidos del vaciado
+        self._retry_at = None
+
+        self.buffered = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retries = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura el escritor con la app y arranca el hilo de vaciado"""
+        self.app = app
+        self.batch_size = app.config.get('INGEST_BATCH_SIZE', self.batch_size)
+        self.flush_interval_ms = app.config.get('INGEST_FLUSH_INTERVAL_MS', self.flush_interval_ms)
+        self.max_buffer = app.config.get('INGEST_MAX_BUFFER', self.max_buffer)
+        self.max_retries = app.config.get('INGEST_MAX_RETRIES', self.max_retries)
+        self.retry_backoff_ms = app.config.get('INGEST_RETRY_BACKOFF_MS', self.retry_backoff_ms)
+        self.stop_timeout = app.config.get('INGEST_STOP_TIMEOUT_SECONDS', self.stop_timeout)
+        self.start()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='sensor-data-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Detiene el hilo de vaciado y escribe lo pendiente, reintentando hasta `stop_timeout` segundos"""
+        if not self._running:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+        deadline = time.monotonic() + self.stop_timeout
+        while True:
+            self.flush()
+            with self._cond:
+                pending = bool(self._buffer)
+                retry_at = self._retry_at
+            now = time.monotonic()
+            if not pending or now >= deadline:
+                break
+            time.sleep(min(max((retry_at or now) - now, 0), deadline - now))
+
+        with self._cond:
+            rows, self._buffer = self._buffer, []
+            self._oldest = None
+            self._retry_at = None
+        if rows:
+            self.failed += len(rows)
+            logger.error("Discarding %d sensor rows still pending at shutdown", len(rows))
+
+    def add(self, paciente_id, valor, heart_rate, spo2, fecha):
+        """Encola una lectura para su inserción"""
+        self.add_many([{
+            'paciente_id': paciente_id,
+            'valor': valor,
+            'heart_rate': heart_rate,
+            'spo2': spo2,
+            'fecha': fecha
+        }])
+
+    def add_many(self, rows):
+        """Encola varias lecturas (diccionarios con las columnas de SensorData)"""
+        with self._cond:
+            was_empty = not self._buffer
+            if was_empty:
+                self._oldest = time.monotonic()
+            self._buffer.extend(rows)
+            self.buffered += len(rows)
+
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped += overflow
+
+            # Despertar al hilo para que programe el vaciado por tiempo o por tamaño
+            if was_empty or len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        """Inserta inmediatamente todas las filas pendientes y retorna cuántas se escribieron"""
+        with self._cond:
+            rows, self._buffer = self._buffer, []
+            self._oldest = None
+        if not rows:
+            return 0
+
+        with self._flush_lock:
+            started = time.perf_counter()
+            try:
+                self._insert(rows)
+                written = len(rows)
+            except (OperationalError, InterfaceError) as e:
+                self._requeue(rows, e)
+                return 0
+            except Exception as e:
+                logger.warning("Error writing %d sensor rows, isolating the failing ones: %s", len(rows), e)
+                written = self._insert_isolating(rows)
+                if not written:
+                    return 0
+
+            self._attempts = 0
+            self.flushed += written
+            self.flushes += 1
+            elapsed = time.perf_counter() - started
+            self.last_flush_ms = elapsed * 1000
+            metrics.db_flush_seconds.observe(elapsed)
+            metrics.db_flush_rows.inc(amount=written)
+            return written
+
+    def _insert(self, rows):
+        # Inserta las filas en una sola transacción
+        with self.app.app_context():
+            try:
+                for i in range(0, len(rows), self.batch_size):
+                    db.session.execute(SensorData.__table__.insert(), rows[i:i + self.batch_size])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _insert_isolating(self, rows):
+        # Bisección: cada mitad en su propia transacción hasta quedarse con filas sueltas que fallan.
+        # Un error transitorio devuelve al buffer las filas que aún no se han escrito
+        written = 0
+        chunks = [rows]
+        while chunks:
+            chunk = chunks.pop()
+            try:
+                self._insert(chunk)
+                written += len(chunk)
+            except (OperationalError, InterfaceError) as e:
+                remaining = chunk + [row for pending in reversed(chunks) for row in pending]
+                self._requeue(remaining, e)
+                return written
+            except Exception as e:
+                if len(chunk) == 1:
+                    self.failed += 1
+                    logger.error("Discarding sensor row for paciente %s at %s: %s",
+                                 chunk[0].get('paciente_id'), chunk[0].get('fecha'), e)
+                    continue
+                middle = len(chunk) // 2
+                chunks.append(chunk[middle:])
+                chunks.append(chunk[:middle])
+        self._attempts = 0
+        return written
+
+    def _requeue(self, rows, error):
+        # Devuelve las filas al inicio del buffer y programa el reintento con espera exponencial
+        self._attempts += 1
+        if self._attempts > self.max_retries:
+            self._attempts = 0
+            self.failed += len(rows)
+            logger.error("Discarding %d sensor rows after %d retries: %s", len(rows), self.max_retries, error)
+            return
+        delay = self.retry_backoff_ms * 2 ** (self._attempts - 1) / 1000.0
+        logger.warning("Error writing %d sensor rows, retry %d/%d in %.1fs: %s",
+                       len(rows), self._attempts, self.max_retries, delay, error)
+        with self._cond:
+            self._buffer[:0] = rows
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped += overflow
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._retry_at = time.monotonic() + delay
+            self.retries += 1
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._due():
+                    self._cond.wait(timeout=self._wait_time())
+                if not self._running:
+                    return
+            self.flush()
+
+    def _due(self):
+        if not self._buffer:
+            return False
+        if self._retry_at is not None:
+            if time.monotonic() < self._retry_at:
+                return False
+            self._retry_at = None
+            return True
+        if len(self._buffer) >= self.batch_size:
+            return True
+        return (time.monotonic() - self._oldest) * 1000 >= self.flush_interval_ms
+
+    def _wait_time(self):
+        if not self._buffer:
+            return None
+        if self._retry_at is not None:
+            return max(self._retry_at - time.monotonic(), 0)
+        elapsed = (time.monotonic() - self._oldest) * 1000
+        return max(self.flush_interval_ms - elapsed, 0) / 1000.0
+
+    def get_stats(self):
+        """Retorna los contadores del escritor"""
+        with self._cond:
+            pending = len(self._buffer)
+        return {
+            'pending': pending,
+            'buffered': self.buffered,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'retries': self.retries,
+            'flushes': self.flushes,
+            'last_flush_ms': round(self.last_flush_ms, 2)
+        }
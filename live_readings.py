@@ -0,0 +1,110 @@
+"""
+Almacén en memoria de las lecturas en tiempo real de cada dispositivo
+"""
+import threading
+import time
+from datetime import datetime
+
+
+class DeviceReading:
+    """Última lectura conocida de un dispositivo"""
+    __slots__ = ('device_id', 'temperature', 'heart_rate', 'spo2', 'last_update', 'last_seen')
+
+    def __init__(self, device_id):
+        self.device_id = device_id
+        self.temperature = None
+        self.heart_rate = None
+        self.spo2 = None
+        self.last_update = None
+        self.last_seen = 0.0
+
+    def as_dict(self):
+        return {
+            'temperature': self.temperature,
+            'heart_rate': self.heart_rate,
+            'spo2': self.spo2,
+            'last_update': self.last_update,
+            'device_id': self.device_id
+        }
+
+
+def empty_readings(device_id=None):
+    """Lecturas vacías con el mismo formato que LiveReadingsStore.get"""
+    return {
+        'temperature': None,
+        'heart_rate': None,
+        'spo2': None,
+        'last_update': None,
+        'device_id': device_id
+    }
+
+
+class LiveReadingsStore:
+    """
+    Lecturas actuales indexadas por device_id
+
+    Las actualizaciones llegan desde los hilos de ingesta de MQTT y las lecturas desde
+    los hilos de las peticiones, por eso todo acceso pasa por un único lock.
+    Los dispositivos que no envían datos durante `timeout_ms` se consideran
+    caducados y se eliminan de forma perezosa.
+    """
+
+    def __init__(self, timeout_ms=30000):
+        self.timeout_ms = timeout_ms
+        self._readings = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def update(self, device_id, temperature=None, heart_rate=None, spo2=None, received_at=None):
+        """
+        Fusiona una lectura parcial con el estado del dispositivo
+        `received_at` es la hora de recepción del mensaje (por defecto, ahora)
+        Retorna una tupla (temperature, heart_rate, spo2, last_update) con el estado resultante
+        """
+        now = time.monotonic()
+        with self._lock:
+            reading = self._readings.get(device_id)
+            if reading is None:
+                reading = self._readings[device_id] = DeviceReading(device_id)
+            if temperature is not None:
+                reading.temperature = temperature
+            if heart_rate is not None:
+                reading.heart_rate = heart_rate
+            if spo2 is not None:
+                reading.spo2 = spo2
+            reading.last_update = received_at or datetime.now()
+            reading.last_seen = now
+            state = (reading.temperature, reading.heart_rate, reading.spo2, reading.last_update)
+
+            if (now - self._last_sweep) * 1000 >= self.timeout_ms:
+                self._sweep(now)
+        return state
+
+    def get(self, device_id):
+        """Retorna las lecturas vigentes del dispositivo o lecturas vacías si no hay datos recientes"""
+        with self._lock:
+            reading = self._readings.get(device_id)
+            if reading is None:
+                return empty_readings()
+            if (time.monotonic() - reading.last_seen) * 1000 >= self.timeout_ms:
+                del self._readings[device_id]
+                return empty_readings()
+            return reading.as_dict()
+
+    def purge_expired(self):
+        """Elimina los dispositivos caducados y retorna cuántos se eliminaron"""
+        with self._lock:
+            return self._sweep(time.monotonic())
+
+    def _sweep(self, now):
+        limit = self.timeout_ms / 1000.0
+        expired = [device_id for device_id, reading in self._readings.items()
+                   if now - reading.last_seen >= limit]
+        for device_id in expired:
+            del self._readings[device_id]
+        self._last_sweep = now
+        return len(expired)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._readings)
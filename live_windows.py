@@ -0,0 +1,208 @@
+"""
+Ventanas en memoria con las lecturas recientes de cada paciente (buffer circular)
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from models import db, Paciente, SensorData
+
+logger = logging.getLogger(__name__)
+
+
+class WindowSample:
+    """Lectura servida desde memoria con los mismos atributos que una fila de SensorData (sin id)"""
+    __slots__ = ('id', 'fecha', 'valor', 'heart_rate', 'spo2')
+
+    def __init__(self, fecha, valor, heart_rate, spo2):
+        self.id = None
+        self.fecha = fecha
+        self.valor = valor
+        self.heart_rate = heart_rate
+        self.spo2 = spo2
+
+
+class PatientRingBuffer:
+    """
+    Buffer circular de tamaño fijo con una columna NumPy por señal
+
+    `complete_since` es el instante (epoch en segundos) a partir del cual el
+    buffer contiene todas las lecturas del paciente: avanza al sobrescribir las
+    más antiguas y retrocede al precargarlo desde la base de datos.
+    """
+    __slots__ = ('capacity', 't', 'temperatura', 'heart_rate', 'spo2', 'head', 'size', 'complete_since')
+
+    def __init__(self, capacity, complete_since):
+        self.capacity = capacity
+        self.t = np.zeros(capacity, dtype=np.float64)
+        self.temperatura = np.zeros(capacity, dtype=np.float32)
+        self.heart_rate = np.zeros(capacity, dtype=np.int16)
+        self.spo2 = np.zeros(capacity, dtype=np.int16)
+        self.head = 0
+        self.size = 0
+        self.complete_since = complete_since
+
+    def append(self, ts, temperatura, heart_rate, spo2):
+        if self.size == self.capacity:
+            # Se sobrescribe la lectura más antigua: el buffer ya no la cubre
+            self.complete_since = max(self.complete_since, self.t[self.head])
+        else:
+            self.size += 1
+        i = self.head
+        self.t[i] = ts
+        self.temperatura[i] = temperatura
+        self.heart_rate[i] = heart_rate
+        self.spo2[i] = spo2
+        self.head = (i + 1) % self.capacity
+
+    def ordered(self):
+        """Columnas en orden de llegada (copias)"""
+        start = (self.head - self.size) % self.capacity
+        index = (start + np.arange(self.size)) % self.capacity
+        return self.t[index], self.temperatura[index], self.heart_rate[index], self.spo2[index]
+
+    def fill_before(self, t, temperatura, heart_rate, spo2, since):
+        """Antepone lecturas de la base de datos anteriores a `complete_since` (hasta llenar la capacidad)"""
+        older = t < self.complete_since
+        columns = [np.concatenate((new[older], current))
+                   for new, current in zip((t, temperatura, heart_rate, spo2), self.ordered())]
+        kept = columns[0][-self.capacity:]
+        self.t[:len(kept)] = kept
+        self.temperatura[:len(kept)] = columns[1][-self.capacity:]
+        self.heart_rate[:len(kept)] = columns[2][-self.capacity:]
+        self.spo2[:len(kept)] = columns[3][-self.capacity:]
+        self.size = len(kept)
+        self.head = self.size % self.capacity
+        if len(columns[0]) > self.capacity:
+            self.complete_since = kept[0]
+        else:
+            self.complete_since = min(self.complete_since, since)
+
+    @property
+    def nbytes(self):
+        return self.t.nbytes + self.temperatura.nbytes + self.heart_rate.nbytes + self.spo2.nbytes
+
+
+class LiveWindowStore:
+    """
+    Buffers circulares por paciente que cubren los últimos `window_minutes`
+
+    La ingesta añade cada lectura completa y /datos responde las ventanas de
+    5/15/30 minutos desde memoria; solo consulta la base de datos con el buffer
+    frío (recién creado o sin cubrir el rango), y precarga el buffer con ese
+    resultado. La memoria por paciente es fija: `capacity` lecturas.
+    """
+
+    def __init__(self, window_minutes=30, capacity=3600):
+        self.window_minutes = window_minutes
+        self.capacity = capacity
+        self.enabled = False
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """
+        Configura el tamaño de las ventanas y activa el almacén (solo en procesos que ingieren)
+
+        Las ventanas solo son completas si el proceso recibe las lecturas de todos
+        los dispositivos: con MQTT_PARTITIONS > 1 o una suscripción compartida se
+        quedan desactivadas y /datos lee de la base de datos.
+        """
+        self.window_minutes = app.config.get('LIVE_WINDOW_MINUTES', self.window_minutes)
+        self.capacity = app.config.get('LIVE_BUFFER_CAPACITY', self.capacity)
+        if app.config.get('MQTT_PARTITIONS', 1) > 1 or app.config.get('MQTT_SHARED_GROUP'):
+            logger.info("Live windows disabled: this process only receives part of the devices")
+            self.enabled = False
+            return
+        self.enabled = True
+
+    def append(self, patient_id, fecha, temperatura, heart_rate, spo2):
+        """Añade una lectura completa del paciente"""
+        if not self.enabled:
+            return
+        ts = fecha.timestamp()
+        with self._lock:
+            buffer = self._buffers.get(patient_id)
+            if buffer is None:
+                # Aún no precargado: solo cubre desde esta lectura
+                buffer = self._buffers[patient_id] = PatientRingBuffer(self.capacity, ts)
+            buffer.append(ts, temperatura, heart_rate, spo2)
+
+    def get_window(self, patient_id, time_limit, since=None):
+        """
+        Lecturas del paciente desde `time_limit` (y posteriores a `since`) como WindowSample
+        Retorna None si el buffer no cubre el rango y hay que ir a la base de datos
+        """
+        if not self.enabled:
+            return None
+        start = time_limit.timestamp()
+        with self._lock:
+            buffer = self._buffers.get(patient_id)
+            if buffer is None or start < buffer.complete_since:
+                self.misses += 1
+                return None
+            t, temperatura, heart_rate, spo2 = buffer.ordered()
+            self.hits += 1
+
+        mask = t >= start
+        if since is not None:
+            mask &= t > since.timestamp()
+        return [
+            WindowSample(datetime.fromtimestamp(ts), round(temp, 2), hr, sp)
+            for ts, temp, hr, sp in zip(t[mask].tolist(), temperatura[mask].tolist(),
+                                        heart_rate[mask].tolist(), spo2[mask].tolist())
+        ]
+
+    def warm(self, patient_id, records, since):
+        """Precarga el buffer con las lecturas de la base de datos desde `since` (filas de SensorData)"""
+        if not self.enabled:
+            return
+        t = np.fromiter((r.fecha.timestamp() for r in records), dtype=np.float64, count=len(records))
+        temperatura = np.fromiter((r.valor for r in records), dtype=np.float32, count=len(records))
+        heart_rate = np.fromiter((r.heart_rate for r in records), dtype=np.int16, count=len(records))
+        spo2 = np.fromiter((r.spo2 for r in records), dtype=np.int16, count=len(records))
+        with self._lock:
+            buffer = self._buffers.get(patient_id)
+            if buffer is None:
+                buffer = self._buffers[patient_id] = PatientRingBuffer(self.capacity, time.time())
+            buffer.fill_before(t, temperatura, heart_rate, spo2, since.timestamp())
+
+    def warm_active(self, app):
+        """Precarga la ventana completa de todos los pacientes activos"""
+        if not self.enabled:
+            return 0
+        with app.app_context():
+            since = datetime.now() - timedelta(minutes=self.window_minutes)
+            rows = db.session.execute(
+                db.select(SensorData.paciente_id, SensorData.fecha, SensorData.valor,
+                          SensorData.heart_rate, SensorData.spo2)
+                .join(Paciente, Paciente.id == SensorData.paciente_id)
+                .where(Paciente.activo == True, SensorData.fecha >= since)
+                .order_by(SensorData.fecha.asc())
+            ).all()
+        by_patient = {}
+        for row in rows:
+            by_patient.setdefault(row.paciente_id, []).append(row)
+        for patient_id, records in by_patient.items():
+            self.warm(patient_id, records, since)
+        return len(rows)
+
+    def get_stats(self):
+        """Retorna el número de pacientes, la memoria usada y los aciertos del almacén"""
+        with self._lock:
+            pacientes = len(self._buffers)
+            total = sum(b.nbytes for b in self._buffers.values())
+        return {
+            'pacientes': pacientes,
+            'bytes_por_paciente': self.capacity * (8 + 4 + 2 + 2),
+            'bytes_total': total,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+live_windows = LiveWindowStore()
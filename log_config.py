@@ -0,0 +1,89 @@
+"""
+Logging estructurado (una línea JSON por registro) con límite de frecuencia por mensaje
+"""
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Atributos propios de LogRecord: el resto llega por `extra` y se emite como campo
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatea cada registro como un objeto JSON con los campos de `extra`"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Deja pasar como máximo `burst` registros por mensaje cada `interval` segundos
+
+    La clave es el logger, el nivel y la plantilla del mensaje (sin los
+    argumentos), así que un error que se repite con cada lectura no inunda la
+    salida. El primer registro que pasa tras un periodo limitado lleva en
+    `suprimidos` cuántos se descartaron.
+    """
+
+    def __init__(self, burst=10, interval=60):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}  # clave -> [inicio del periodo, emitidos, suprimidos]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suprimidos = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+_handler = None
+
+
+def configure_logging(config):
+    """Instala el manejador de la salida de errores según LOG_LEVEL, LOG_FORMAT y LOG_RATE_LIMIT"""
+    global _handler
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+
+    _handler = logging.StreamHandler(sys.stderr)
+    if config.get('LOG_FORMAT', 'json') == 'json':
+        _handler.setFormatter(JsonFormatter())
+    else:
+        _handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    _handler.addFilter(RateLimitFilter(config.get('LOG_RATE_LIMIT', 10), config.get('LOG_RATE_INTERVAL_SECONDS', 60)))
+    root.addHandler(_handler)
+    root.setLevel(config.get('LOG_LEVEL', 'INFO'))
+    # Cada petición de werkzeug genera una línea: solo avisos y errores
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
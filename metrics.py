@@ -0,0 +1,257 @@
+"""
+Registro de métricas (contadores, medidores e histogramas) en formato de texto de Prometheus
+"""
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from flask import g, request, Response
+from sqlalchemy import event
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Límites en segundos: de 1 ms a 10 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base de las métricas: una serie por combinación de valores de las etiquetas"""
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} espera las etiquetas {self.labels}")
+        return tuple(str(v) for v in labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(Metric):
+    """Contador monótono"""
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            series = list(self._series.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in series]
+
+
+class Gauge(Metric):
+    """Medidor con valor fijado a mano o leído de `fn` al exportar"""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), fn=None, kind=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        if kind:
+            self.kind = kind  # 'counter' para contadores que ya lleva otro objeto
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def _samples(self):
+        if self.fn is not None:
+            try:
+                return [f"{self.name} {_format_value(self.fn())}"]
+            except Exception:
+                return []
+        with self._lock:
+            series = list(self._series.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in series]
+
+
+class Histogram(Metric):
+    """Histograma con límites fijos (acumulados al exportar, como espera Prometheus)"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [conteos por límite (+Inf al final), suma, total]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        lines = []
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Conjunto de métricas del proceso; `render` produce la respuesta de /metrics"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), fn=None, kind=None):
+        return self._register(Gauge(name, help, labels, fn=fn, kind=kind))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+# Métricas de la ingesta MQTT
+mqtt_messages_received = registry.counter('mqtt_messages_received_total', 'Mensajes MQTT recibidos')
+mqtt_messages_parsed = registry.counter('mqtt_messages_parsed_total', 'Mensajes MQTT decodificados y encolados')
+mqtt_messages_failed = registry.counter('mqtt_messages_failed_total', 'Mensajes MQTT descartados por error',
+                                        ('reason',))
+mqtt_samples = registry.counter('mqtt_samples_total', 'Lecturas completas recibidas por formato de payload',
+                                ('format',))
+mqtt_samples_invalid = registry.counter('mqtt_samples_invalid_total', 'Lecturas de lotes binarios fuera de rango')
+db_flush_seconds = registry.histogram('db_flush_seconds', 'Duración de cada INSERT+COMMIT del escritor de lecturas')
+db_flush_rows = registry.counter('db_flush_rows_total', 'Lecturas escritas por el escritor por lotes')
+
+# Métricas de las peticiones HTTP
+http_request_seconds = registry.histogram('http_request_duration_seconds', 'Duración de las peticiones HTTP',
+                                          ('blueprint', 'endpoint', 'method'))
+http_requests = registry.counter('http_requests_total', 'Peticiones HTTP atendidas',
+                                 ('blueprint', 'endpoint', 'method', 'status'))
+db_queries_per_request = registry.histogram('db_queries_per_request', 'Consultas SQL ejecutadas por petición',
+                                            ('blueprint',), buckets=COUNT_BUCKETS)
+
+
+def register_ingest_gauges(ingest_queue, sensor_writer):
+    """Medidores leídos de la cola y del escritor al exportar"""
+    registry.gauge('ingest_queue_depth', 'Mensajes esperando en la cola de ingesta', fn=ingest_queue.depth)
+    registry.gauge('ingest_queue_lag_ms', 'Retraso del último mensaje procesado', fn=lambda: ingest_queue.lag_ms)
+    registry.gauge('ingest_queue_dropped_total', 'Mensajes descartados por la cola llena',
+                   fn=lambda: ingest_queue.dropped, kind='counter')
+    registry.gauge('ingest_writer_pending', 'Lecturas esperando a escribirse',
+                   fn=lambda: sensor_writer.get_stats()['pending'])
+    registry.gauge('ingest_writer_dropped_total', 'Lecturas descartadas por el escritor',
+                   fn=lambda: sensor_writer.dropped, kind='counter')
+
+
+def metrics_response():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+def init_metrics(app, db):
+    """Instrumenta las peticiones y consultas de la app y registra /metrics"""
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        # Solo se cuentan las consultas hechas dentro de una petición
+        if g and 'query_count' in g:
+            g.query_count += 1
+
+    with app.app_context():
+        # Todos los motores, también la réplica a la que db_routing envía las lecturas
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', count_query)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.query_count = 0
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is None or request.endpoint == 'metrics':
+            return response
+        blueprint = request.blueprint or 'app'
+        endpoint = request.endpoint or 'not_found'
+        # En respuestas en streaming solo se mide hasta el primer fragmento
+        http_request_seconds.observe(time.perf_counter() - started, blueprint, endpoint, request.method)
+        http_requests.inc(blueprint, endpoint, request.method, response.status_code)
+        db_queries_per_request.observe(g.pop('query_count', 0), blueprint)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """Métricas del proceso en formato de texto de Prometheus"""
+        return metrics_response()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host='0.0.0.0'):
+    """Sirve /metrics en un hilo aparte (procesos sin servidor web, como ingest_app.py)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -1,8 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+# Las funciones marcadas con db_routing.read_only leen de la réplica si hay una configurada
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Usuario(db.Model):
     __tablename__ = 'usuarios'
@@ -22,6 +24,11 @@ class Usuario(db.Model):
 
 class Paciente(db.Model):
     __tablename__ = 'pacientes'
+    __table_args__ = (
+        # Listado paginado por id con filtro por estado y búsqueda por prefijo del nombre
+        db.Index('ix_pacientes_estado_id', 'estado', 'id'),
+        db.Index('ix_pacientes_nombre', 'nombre'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     nombre = db.Column(db.String(100), nullable=False)
     edad = db.Column(db.Integer, nullable=False)
@@ -42,6 +49,10 @@ class Paciente(db.Model):
 
 class SensorData(db.Model):
     __tablename__ = 'temperatura'
+    __table_args__ = (
+        # Todas las consultas de lecturas filtran por paciente y rango de fechas
+        db.Index('ix_temperatura_paciente_fecha', 'paciente_id', 'fecha'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id'), nullable=True)
     valor = db.Column(db.Float, nullable=False)
@@ -49,14 +60,62 @@ class SensorData(db.Model):
     spo2 = db.Column(db.Integer, nullable=True)
     fecha = db.Column(db.DateTime, default=datetime.now, index=True)
 
+class VitalsRollup(db.Model):
+    """Agregados de lecturas por paciente en intervalos de minuto, hora o día"""
+    __tablename__ = 'temperatura_rollup'
+    paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id'), primary_key=True)
+    granularidad = db.Column(db.String(10), primary_key=True)  # minute, hour, day
+    bucket = db.Column(db.DateTime, primary_key=True)  # Inicio del intervalo
+    muestras = db.Column(db.Integer, nullable=False, default=0)
+    ultima_fecha = db.Column(db.DateTime, nullable=False)  # Fecha de la última lectura agregada
+    
+    temp_sum = db.Column(db.Float, nullable=False, default=0)
+    temp_min = db.Column(db.Float, nullable=True)
+    temp_max = db.Column(db.Float, nullable=True)
+    temp_last = db.Column(db.Float, nullable=True)
+    
+    hr_sum = db.Column(db.Float, nullable=False, default=0)
+    hr_min = db.Column(db.Integer, nullable=True)
+    hr_max = db.Column(db.Integer, nullable=True)
+    hr_last = db.Column(db.Integer, nullable=True)
+    
+    spo2_sum = db.Column(db.Float, nullable=False, default=0)
+    spo2_min = db.Column(db.Integer, nullable=True)
+    spo2_max = db.Column(db.Integer, nullable=True)
+    spo2_last = db.Column(db.Integer, nullable=True)
+
 class Notificacion(db.Model):
     __tablename__ = 'notificaciones'
+    __table_args__ = (
+        # El despachador busca los pendientes por fecha de vencimiento
+        db.Index('ix_notificaciones_enviado_fecha', 'enviado', 'fecha_hora'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id'), nullable=False)
     fecha_hora = db.Column(db.DateTime, nullable=False)
     job_id = db.Column(db.String(100), nullable=True)
     enviado = db.Column(db.Boolean, default=False)
+    intervalo_minutos = db.Column(db.Integer, nullable=True)  # Repetición periódica (None = una sola vez)
+    fecha_envio = db.Column(db.DateTime, nullable=True)  # Último envío
+    caducado = db.Column(db.Boolean, nullable=False, default=False)  # Vencido sin enviar (despachador parado)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.now)
+
+class ComandoDispositivo(db.Model):
+    """Comando enviado a un dispositivo y su estado de entrega"""
+    __tablename__ = 'comandos_dispositivo'
+    __table_args__ = (
+        db.Index('ix_comandos_lote_estado', 'lote', 'estado'),
+    )
+    id = db.Column(db.String(32), primary_key=True)  # Generado al enviar; el dispositivo lo devuelve en el ack
+    lote = db.Column(db.String(32), nullable=False)  # Envío al que pertenece
+    device_id = db.Column(db.String(50), nullable=False)
+    paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id'), nullable=True)
+    comando = db.Column(db.String(100), nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')  # pendiente, enviado, confirmado, fallido
+    intentos = db.Column(db.Integer, nullable=False, default=0)
     fecha_creacion = db.Column(db.DateTime, default=datetime.now)
+    fecha_envio = db.Column(db.DateTime, nullable=True)  # Último intento
+    fecha_confirmacion = db.Column(db.DateTime, nullable=True)
 
 class Configuracion(db.Model):
     __tablename__ = 'configuracion'
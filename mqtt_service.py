@@ -3,75 +3,242 @@ Servicio MQTT para manejar la conexión y recepción de datos
 """
 import paho.mqtt.client as mqtt
 import json
-from datetime import datetime
-from models import db, SensorData, Paciente
-from flask import current_app
+import logging
+import zlib
+from datetime import datetime, timedelta
+from live_readings import LiveReadingsStore
+from ingest_writer import SensorDataWriter
+from ingest_queue import IngestQueue
+from patient_registry import patient_registry
+from event_bus import event_bus, patient_channel
+from vitals_rules import rule_engine
+from live_windows import live_windows
+from command_service import command_channel
+import metrics
+import binary_payload
+from db_routing import replica_router
 
-# Variables globales para lecturas actuales
-current_readings = {
-    'temperature': None,
-    'heart_rate': None,
-    'spo2': None,
-    'last_update': None
-}
+logger = logging.getLogger(__name__)
 
-def init_mqtt(app):
-    """Inicializa el cliente MQTT"""
+# Lecturas actuales por dispositivo
+current_readings = LiveReadingsStore()
+# Escritor por lotes de lecturas hacia la base de datos
+sensor_writer = SensorDataWriter()
+# Cola entre el hilo de red de MQTT y los hilos que procesan los mensajes
+ingest_queue = IngestQueue()
+mqtt_client = None
+# Sufijos de tópico de los lotes binarios y de las lecturas JSON, y desfase admitido del reloj de los dispositivos
+binary_suffix = '/bin'
+json_suffix = '/data'
+binary_max_skew = timedelta(minutes=5)
+
+def process_message(data, received_at=None, replayed=False):
+    """
+    Procesa un mensaje ya decodificado de un dispositivo
+
+    Fusiona la lectura con el estado del dispositivo y, si está completa, la
+    encola para su escritura, la evalúa con el motor de reglas y la difunde a
+    los monitores. Los mensajes reprocesados desde disco (`replayed`) ya no son
+    lecturas en tiempo real: no tocan el estado en vivo y solo se guardan, con
+    su hora de recepción, si traen la lectura completa.
+    """
+    if isinstance(data, binary_payload.BinaryBatch):
+        return process_batch(data.device_id, data.payload, received_at, replayed)
+    logger.debug("Received message: %s", data)
+    
+    # Actualizar lecturas actuales del dispositivo
+    device_id = data.get('device_id')
+    temperature = float(data['temperature']) if data.get('temperature') is not None else None
+    heart_rate = int(data['hr']) if data.get('hr') is not None else None
+    spo2 = int(data['spo2']) if data.get('spo2') is not None else None
+    
+    if replayed:
+        last_update = received_at
+    else:
+        temperature, heart_rate, spo2, last_update = current_readings.update(
+            device_id, temperature, heart_rate, spo2, received_at=received_at
+        )
+    
+    # Guardar en base de datos si tenemos todos los datos
+    if None in [temperature, heart_rate, spo2]:
+        return
+    
+    # Obtener paciente por device_id si viene en el mensaje, sino buscar el activo
+    paciente = None
+    
+    if device_id:
+        paciente = patient_registry.get_by_device(device_id)
+    
+    if not paciente:
+        # Fallback: buscar paciente activo (comportamiento anterior)
+        paciente = patient_registry.get_active()
+    
+    sensor_writer.add(
+        paciente_id=paciente.id if paciente else None,
+        valor=temperature,
+        heart_rate=heart_rate,
+        spo2=spo2,
+        fecha=last_update
+    )
+    metrics.mqtt_samples.inc('json')
+    logger.debug("Datos encolados para paciente %s", paciente.id if paciente else None)
+    
+    if paciente is None or replayed:
+        return
+    
+    publish_sample(paciente, last_update, temperature, heart_rate, spo2)
+
+def process_batch(device_id, payload, received_at=None, replayed=False):
+    """
+    Procesa un lote binario de lecturas de un dispositivo (formato en binary_payload)
+
+    Las muestras se decodifican de una vez y se encolan juntas para el INSERT
+    en bloque; después pasan una a una por las ventanas, las reglas y el bus.
+    Los lotes reprocesados desde disco solo se guardan.
+    """
+    received_at = received_at or datetime.now()
+    try:
+        fechas, temperatura, heart_rate, spo2, invalid = binary_payload.to_readings(
+            payload, received_at, binary_max_skew)
+    except ValueError as e:
+        metrics.mqtt_messages_failed.inc('decode')
+        logger.warning("Invalid binary payload from %s: %s", device_id, e)
+        return
+    if invalid:
+        metrics.mqtt_samples_invalid.inc(amount=invalid)
+    if not fechas:
+        return
+    
+    temperatura, heart_rate, spo2 = temperatura.tolist(), heart_rate.tolist(), spo2.tolist()
+    if not replayed:
+        current_readings.update(device_id, temperatura[-1], heart_rate[-1], spo2[-1], received_at=fechas[-1])
+    
+    paciente = patient_registry.get_by_device(device_id) or patient_registry.get_active()
+    paciente_id = paciente.id if paciente else None
+    sensor_writer.add_many([
+        {'paciente_id': paciente_id, 'valor': t, 'heart_rate': hr, 'spo2': sp, 'fecha': fecha}
+        for fecha, t, hr, sp in zip(fechas, temperatura, heart_rate, spo2)
+    ])
+    metrics.mqtt_samples.inc('bin', amount=len(fechas))
+    
+    if paciente is None or replayed:
+        return
+    
+    for fecha, t, hr, sp in zip(fechas, temperatura, heart_rate, spo2):
+        publish_sample(paciente, fecha, t, hr, sp)
+
+def publish_sample(paciente, fecha, temperature, heart_rate, spo2):
+    """Pasa una lectura en tiempo real por las ventanas en memoria, el motor de reglas y el bus de eventos"""
+    live_windows.append(paciente.id, fecha, temperature, heart_rate, spo2)
+    
+    # Actualizar el estado del paciente según los umbrales de las señales
+    rule_engine.evaluate(paciente, temperature, heart_rate, spo2, fecha)
+    
+    # Difundir la muestra a los monitores abiertos del paciente
+    event_bus.publish(patient_channel(paciente.id), {
+        'x': fecha.strftime("%H:%M:%S"),
+        'ts': int(fecha.timestamp() * 1000),
+        'last_update': fecha.isoformat(),
+        'temperatura_actual': temperature,
+        'heart_rate': heart_rate,
+        'spo2': spo2
+    })
+
+def topic_device_id(topic, suffix):
+    """device_id de un tópico healthmonitor/<device_id><suffix>"""
+    return topic[:-len(suffix)].rsplit('/', 1)[-1]
+
+def device_partition(device_id, partitions):
+    """Partición de un dispositivo, la misma en todos los procesos (hash() cambia entre procesos)"""
+    return zlib.crc32(str(device_id).encode()) % partitions
+
+def init_mqtt(app, ingest=None):
+    """
+    Inicializa el cliente MQTT
+    
+    Con `ingest` desactivado (por defecto según MQTT_INGEST) el cliente solo se
+    usa para publicar comandos y no se suscribe a las lecturas. Con
+    MQTT_PARTITIONS > 1 cada proceso recibe todos los mensajes pero solo procesa
+    los de los dispositivos de su partición (MQTT_PARTITION). Los mensajes de
+    healthmonitor/<device_id>/bin y healthmonitor/<device_id>/data se filtran por
+    el tópico sin decodificarlos; los de otros tópicos, por el device_id del cuerpo.
+    Los mensajes ajenos no cuentan en las métricas ni se registran.
+    """
+    if ingest is None:
+        ingest = app.config.get('MQTT_INGEST', True)
+    if ingest and app.config.get('MQTT_SHARED_GROUP'):
+        # El broker reparte cada mensaje a un proceso distinto: las lecturas parciales
+        # de un dispositivo y el estado de sus reglas acabarían en procesos distintos
+        raise ValueError("MQTT_SHARED_GROUP no está soportado para la ingesta; usa MQTT_PARTITIONS y MQTT_PARTITION")
+    partitions = max(1, app.config.get('MQTT_PARTITIONS', 1))
+    partition = app.config.get('MQTT_PARTITION', 0)
+    if not 0 <= partition < partitions:
+        raise ValueError(f"MQTT_PARTITION debe estar entre 0 y {partitions - 1}")
+    global binary_suffix, json_suffix, binary_max_skew
+    binary_suffix = app.config.get('MQTT_BINARY_SUFFIX', binary_suffix)
+    json_suffix = app.config.get('MQTT_JSON_SUFFIX', json_suffix)
+    binary_max_skew = timedelta(seconds=app.config.get('MQTT_MAX_CLOCK_SKEW_SECONDS', 300))
+    if ingest:
+        current_readings.timeout_ms = app.config.get('DATA_VALIDITY_TIMEOUT', 30000)
+        sensor_writer.init_app(app)
+        ingest_queue.init_app(app, process_message)
+        rule_engine.init_app(app)
+        # Ventanas en memoria de /datos, precargadas antes de recibir lecturas
+        live_windows.init_app(app)
+        live_windows.warm_active(app)
+        metrics.register_ingest_gauges(ingest_queue, sensor_writer)
     client = mqtt.Client()
+    # Comandos a los dispositivos con ack (los acks no pasan por on_message)
+    command_channel.init_app(app, client)
     
     def on_connect(client, userdata, flags, rc):
         if rc == 0:
-            print("MQTT Connected successfully")
-            client.subscribe(app.config['MQTT_TOPIC'])
+            logger.info("MQTT connected to %s", app.config['MQTT_BROKER'])
+            command_channel.subscribe()
+            if ingest:
+                client.subscribe(app.config['MQTT_TOPIC'])
         else:
-            print(f"Failed to connect, return code {rc}")
+            logger.error("MQTT connection refused (rc=%s)", rc)
+    
+    def owns(device_id):
+        return partitions == 1 or device_partition(device_id, partitions) == partition
     
     def on_message(client, userdata, msg):
+        # Hilo de red de paho: solo decodificar y encolar, el resto lo hacen los trabajadores
+        if msg.topic.endswith(binary_suffix):
+            # Lote binario: el device_id va en el tópico y se decodifica en los trabajadores
+            device_id = topic_device_id(msg.topic, binary_suffix)
+            if not owns(device_id):
+                return
+            metrics.mqtt_messages_received.inc()
+            metrics.mqtt_messages_parsed.inc()
+            ingest_queue.put(device_id, binary_payload.BinaryBatch(device_id, msg.payload))
+            return
+        # Con el device_id en el tópico los mensajes ajenos se descartan antes de decodificarlos;
+        # en otros tópicos los errores de decodificación solo cuentan en la partición del tópico
+        device_id = topic_device_id(msg.topic, json_suffix) if msg.topic.endswith(json_suffix) else None
+        if device_id is not None and not owns(device_id):
+            return
+        reports_errors = owns(msg.topic if device_id is None else device_id)
         try:
-            topic = msg.topic
-            payload = msg.payload.decode()
-            data = json.loads(payload)
-            
-            print(f"Received message on {topic}: {data}")
-            
-            # Actualizar lecturas actuales
-            if 'temperature' in data and data['temperature'] is not None:
-                current_readings['temperature'] = float(data['temperature'])
-            if 'hr' in data and data['hr'] is not None:
-                current_readings['heart_rate'] = int(data['hr'])
-            if 'spo2' in data and data['spo2'] is not None:
-                current_readings['spo2'] = int(data['spo2'])
-            
-            current_readings['last_update'] = datetime.now()
-            
-            # Guardar en base de datos si tenemos todos los datos
-            if None not in [current_readings['temperature'], current_readings['heart_rate'], current_readings['spo2']]:
-                with app.app_context():
-                    # Obtener paciente por device_id si viene en el mensaje, sino buscar el activo
-                    device_id = data.get('device_id')
-                    paciente = None
-                    
-                    if device_id:
-                        paciente = Paciente.query.filter_by(device_id=device_id).first()
-                    
-                    if not paciente:
-                        # Fallback: buscar paciente activo (comportamiento anterior)
-                        paciente = Paciente.query.filter_by(activo=True).first()
-                    
-                    record = SensorData(
-                        paciente_id=paciente.id if paciente else None,
-                        valor=current_readings['temperature'],
-                        heart_rate=current_readings['heart_rate'],
-                        spo2=current_readings['spo2']
-                    )
-                    db.session.add(record)
-                    db.session.commit()
-                    print(f"Datos guardados para paciente: {paciente.nombre if paciente else 'Desconocido'}")
-                    
-        except json.JSONDecodeError:
-            print(f"Error decoding JSON from payload: {payload}")
-        except Exception as e:
-            print(f"Error processing MQTT message: {str(e)}")
+            data = json.loads(msg.payload.decode())
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            if reports_errors:
+                metrics.mqtt_messages_received.inc()
+                metrics.mqtt_messages_failed.inc('decode')
+                logger.warning("Error decoding JSON on %s", msg.topic, extra={'payload': msg.payload[:200]})
+            return
+        if not isinstance(data, dict):
+            if reports_errors:
+                metrics.mqtt_messages_received.inc()
+                metrics.mqtt_messages_failed.inc('invalid')
+                logger.warning("Ignoring non-object MQTT payload on %s", msg.topic)
+            return
+        if device_id is None and not owns(data.get('device_id')):
+            return
+        metrics.mqtt_messages_received.inc()
+        metrics.mqtt_messages_parsed.inc()
+        ingest_queue.put(data.get('device_id'), data)
     
     client.on_connect = on_connect
     client.on_message = on_message
@@ -83,17 +250,34 @@ def init_mqtt(app):
         mqtt_client = client
         return client
     except Exception as e:
-        print(f"Error connecting to MQTT broker: {e}")
+        logger.error("Error connecting to MQTT broker: %s", e)
         return None
 
-def get_current_readings():
-    """Retorna las lecturas actuales"""
-    return current_readings
+def get_current_readings(device_id=None):
+    """Retorna las lecturas actuales del dispositivo indicado"""
+    return current_readings.get(device_id)
+
+def get_ingest_stats():
+    """Retorna los contadores de la ingesta de datos"""
+    return {
+        'cola': ingest_queue.get_stats(),
+        'writer': sensor_writer.get_stats(),
+        'pacientes_cache': patient_registry.get_stats(),
+        'reglas': rule_engine.get_stats(),
+        'ventanas': live_windows.get_stats(),
+        'eventos': event_bus.get_stats(),
+        'comandos': command_channel.get_stats(),
+        'replica': replica_router.get_stats(),
+        'dispositivos_en_vivo': len(current_readings)
+    }
 
 def publish_message(topic, message):
     """Publica un mensaje en el tópico especificado"""
     if mqtt_client:
-        mqtt_client.publish(topic, message)
-        print(f"Published message to {topic}: {message}")
+        info = mqtt_client.publish(topic, message)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.warning("Error publishing to %s: %s", topic, mqtt.error_string(info.rc))
+            return False
+        logger.info("Published message to %s: %s", topic, message)
         return True
     return False
@@ -0,0 +1,221 @@
+"""
+Particionado por tiempo de la tabla de lecturas y retención de datos antiguos
+"""
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text, bindparam
+from models import db, Paciente, SensorData
+
+TABLE = SensorData.__tablename__
+
+
+def period_start(fecha, interval):
+    """Inicio del periodo (día o semana ISO) que contiene `fecha`"""
+    day = fecha.replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def period_step(interval):
+    return timedelta(weeks=1) if interval == 'week' else timedelta(days=1)
+
+
+def partition_name(start):
+    return f"p{start:%Y%m%d}"
+
+
+def is_mysql():
+    return db.engine.dialect.name in ('mysql', 'mariadb')
+
+
+def get_partitions():
+    """
+    Particiones de la tabla como lista de (nombre, límite superior o None para MAXVALUE)
+    Retorna una lista vacía si la tabla no está particionada o el motor no lo soporta
+    """
+    if not is_mysql():
+        return []
+    rows = db.session.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {'table': TABLE}).all()
+
+    partitions = []
+    for name, description in rows:
+        if description == 'MAXVALUE':
+            partitions.append((name, None))
+        else:
+            # PARTITION_DESCRIPTION es TO_DAYS(límite); 719528 = TO_DAYS('1970-01-01')
+            partitions.append((name, datetime(1970, 1, 1) + timedelta(days=int(description) - 719528)))
+    return partitions
+
+
+def _partition_clause(start, interval):
+    upper = start + period_step(interval)
+    return f"PARTITION {partition_name(start)} VALUES LESS THAN (TO_DAYS('{upper:%Y-%m-%d}'))"
+
+
+def ensure_indexes():
+    """Crea los índices de lecturas (paciente_id, fecha) y del listado de pacientes si no existen"""
+    for table in (SensorData.__table__, Paciente.__table__):
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
+def partition_table(interval='day', ahead=7):
+    """
+    Convierte la tabla de lecturas en una tabla particionada por RANGE(TO_DAYS(fecha))
+
+    Operación pesada pensada para ejecutarse una vez en una ventana de mantenimiento.
+    MySQL exige que la columna de particionado forme parte de la clave primaria y no
+    admite claves foráneas en tablas particionadas, por lo que se elimina la FK a
+    pacientes y la clave primaria pasa a ser (id, fecha).
+    """
+    if not is_mysql():
+        raise RuntimeError("El particionado solo está soportado en MySQL/MariaDB")
+    if get_partitions():
+        return False
+
+    foreign_keys = db.session.execute(text(
+        "SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS "
+        "WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+    ), {'table': TABLE}).scalars().all()
+    for name in foreign_keys:
+        db.session.execute(text(f"ALTER TABLE {TABLE} DROP FOREIGN KEY `{name}`"))
+
+    oldest = db.session.query(db.func.min(SensorData.fecha)).scalar() or datetime.now()
+    start = period_start(oldest, interval)
+    last = period_start(datetime.now(), interval) + period_step(interval) * ahead
+    clauses = []
+    while start <= last:
+        clauses.append(_partition_clause(start, interval))
+        start += period_step(interval)
+    clauses.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+
+    db.session.execute(text(
+        f"ALTER TABLE {TABLE} MODIFY fecha DATETIME NOT NULL, "
+        f"DROP PRIMARY KEY, ADD PRIMARY KEY (id, fecha)"
+    ))
+    db.session.execute(text(
+        f"ALTER TABLE {TABLE} PARTITION BY RANGE (TO_DAYS(fecha)) ({', '.join(clauses)})"
+    ))
+    db.session.commit()
+    return True
+
+
+def create_future_partitions(partitions, interval='day', ahead=7):
+    """Divide la partición MAXVALUE para tener `ahead` periodos creados por adelantado"""
+    bounded = [upper for _, upper in partitions if upper is not None]
+    if not bounded:
+        return []
+
+    start = max(bounded)
+    target = period_start(datetime.now(), interval) + period_step(interval) * ahead
+    clauses = []
+    created = []
+    while start <= target:
+        clauses.append(_partition_clause(start, interval))
+        created.append(partition_name(start))
+        start += period_step(interval)
+    if not clauses:
+        return []
+
+    clauses.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    db.session.execute(text(f"ALTER TABLE {TABLE} REORGANIZE PARTITION pmax INTO ({', '.join(clauses)})"))
+    return created
+
+
+def drop_expired_partitions(partitions, cutoff):
+    """Elimina las particiones cuyo límite superior es anterior a `cutoff`; retorna (nombres, filas aprox.)"""
+    expired = [name for name, upper in partitions if upper is not None and upper <= cutoff]
+    # Nunca eliminar todas las particiones acotadas
+    if len(expired) >= len([p for p in partitions if p[1] is not None]):
+        expired = expired[:-1]
+    if not expired:
+        return [], 0
+
+    rows = db.session.execute(text(
+        "SELECT COALESCE(SUM(TABLE_ROWS), 0) FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IN :names"
+    ).bindparams(bindparam('names', expanding=True)), {'table': TABLE, 'names': expired}).scalar()
+    db.session.execute(text(f"ALTER TABLE {TABLE} DROP PARTITION {', '.join(expired)}"))
+    return expired, int(rows or 0)
+
+
+def delete_in_chunks(cutoff, chunk_size=5000, pause_ms=100):
+    """
+    Borrado de respaldo para motores sin particionado
+
+    Elimina las lecturas anteriores a `cutoff` en bloques de `chunk_size` filas,
+    cada uno en su propia transacción y con una pausa entre bloques, para no
+    mantener bloqueos largos ni frenar la ingesta. Retorna las filas eliminadas.
+    """
+    deleted = 0
+    while True:
+        ids = db.session.query(SensorData.id).filter(
+            SensorData.fecha < cutoff
+        ).order_by(SensorData.id).limit(chunk_size).all()
+        if not ids:
+            break
+        db.session.query(SensorData).filter(
+            SensorData.id.in_([row.id for row in ids])
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+        if len(ids) < chunk_size:
+            break
+        time.sleep(pause_ms / 1000.0)
+    return deleted
+
+
+def maintain(app):
+    """
+    Retención de lecturas: crea particiones futuras y elimina las caducadas,
+    o borra por bloques si la tabla no está particionada
+
+    Retorna un resumen con el modo usado, las filas y las particiones eliminadas.
+    """
+    days = app.config.get('OLD_DATA_RETENTION_DAYS', 30)
+    interval = app.config.get('PARTITION_INTERVAL', 'day')
+    ahead = app.config.get('PARTITIONS_AHEAD', 7)
+    cutoff = datetime.now() - timedelta(days=days)
+
+    partitions = get_partitions()
+    if partitions:
+        created = create_future_partitions(partitions, interval, ahead)
+        dropped, rows = drop_expired_partitions(partitions, cutoff)
+        db.session.commit()
+        return {'modo': 'particiones', 'filas': rows, 'particiones_eliminadas': dropped,
+                'particiones_creadas': created}
+
+    rows = delete_in_chunks(cutoff,
+                            chunk_size=app.config.get('CLEANUP_CHUNK_SIZE', 5000),
+                            pause_ms=app.config.get('CLEANUP_CHUNK_PAUSE_MS', 100))
+    return {'modo': 'borrado', 'filas': rows, 'particiones_eliminadas': [], 'particiones_creadas': []}
+
+
+def init_partitions(app):
+    """
+    Registra los comandos de índices y de particionado
+
+    Los índices no se crean al arrancar: con varios procesos web el CREATE INDEX
+    concurrente falla y el arranque queda bloqueado mientras se construye. Se
+    crean una vez con `flask indexes-init` como paso del despliegue.
+    """
+
+    @app.cli.command('indexes-init')
+    def indexes_init_command():
+        """Crea los índices de lecturas y pacientes que falten"""
+        ensure_indexes()
+        print("Índices de lecturas y pacientes creados")
+
+    @app.cli.command('partitions-init')
+    def partitions_init_command():
+        """Particiona la tabla de lecturas por fecha (MySQL/MariaDB)"""
+        interval = app.config.get('PARTITION_INTERVAL', 'day')
+        if partition_table(interval, app.config.get('PARTITIONS_AHEAD', 7)):
+            print(f"Tabla {TABLE} particionada por {interval}")
+        else:
+            print(f"La tabla {TABLE} ya estaba particionada")
@@ -0,0 +1,155 @@
+"""
+Caché en memoria del registro de pacientes (búsquedas por id y device_id)
+"""
+import threading
+import time
+from models import db, Paciente
+
+
+class PatientEntry:
+    """Datos de un paciente necesarios en la ingesta y el monitoreo"""
+    __slots__ = ('id', 'nombre', 'device_id', 'estado', 'activo', 'foto_url')
+
+    def __init__(self, id, nombre, device_id, estado, activo, foto_url):
+        self.id = id
+        self.nombre = nombre
+        self.device_id = device_id
+        self.estado = estado
+        self.activo = activo
+        self.foto_url = foto_url
+
+
+class PatientRegistry:
+    """
+    Instantánea de la tabla de pacientes indexada por id y por device_id
+
+    La instantánea se recarga completa con una sola consulta cuando caduca
+    (`ttl` segundos) o cuando se invalida explícitamente tras una modificación.
+    La invalidación solo afecta al proceso actual; en otros procesos el TTL
+    acota el tiempo que pueden servir datos desactualizados. Un device_id que no
+    está en la instantánea (paciente recién registrado) se busca en la BD; si
+    tampoco existe allí se recuerda durante `negative_ttl` segundos para no
+    consultar con cada lectura de un dispositivo desconocido.
+    """
+
+    def __init__(self, app=None, ttl=60, negative_ttl=5):
+        self.app = None
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._by_id = {}
+        self._by_device = {}
+        self._unknown_devices = {}  # device_id -> instante hasta el que se da por desconocido
+        self._active = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.device_lookups = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config.get('PATIENT_CACHE_TTL', self.ttl)
+        self.negative_ttl = app.config.get('PATIENT_CACHE_NEGATIVE_TTL', self.negative_ttl)
+
+    def invalidate(self):
+        """Descarta la instantánea; la próxima búsqueda recargará desde la BD"""
+        self._loaded_at = None
+
+    def update_estados(self, estados):
+        """Actualiza en la instantánea el estado de los pacientes {id: estado} sin recargarla"""
+        by_id = self._by_id
+        for patient_id, estado in estados.items():
+            entry = by_id.get(patient_id)
+            if entry is not None:
+                entry.estado = estado
+
+    def get_by_id(self, patient_id):
+        """Retorna el PatientEntry con ese id o None"""
+        self._ensure_fresh()
+        return self._by_id.get(int(patient_id))
+
+    def get_by_device(self, device_id):
+        """Retorna el PatientEntry asociado al dispositivo o None"""
+        self._ensure_fresh()
+        entry = self._by_device.get(device_id)
+        if entry is None and device_id:
+            entry = self._lookup_device(device_id)
+        return entry
+
+    def _lookup_device(self, device_id):
+        now = time.monotonic()
+        if self._unknown_devices.get(device_id, 0) > now:
+            return None
+        columns = (Paciente.id, Paciente.nombre, Paciente.device_id,
+                   Paciente.estado, Paciente.activo, Paciente.foto_url)
+        with self.app.app_context():
+            row = db.session.query(*columns).filter(Paciente.device_id == device_id).first()
+        with self._lock:
+            self.device_lookups += 1
+            if row is None:
+                self._unknown_devices[device_id] = now + self.negative_ttl
+                return None
+            entry = PatientEntry(*row)
+            # Se añade a la instantánea vigente hasta la próxima recarga
+            self._by_id[entry.id] = entry
+            self._by_device[device_id] = entry
+            return entry
+
+    def get_active(self):
+        """Retorna el primer paciente activo (mismo criterio que filter_by(activo=True).first())"""
+        self._ensure_fresh()
+        return self._active
+
+    def _ensure_fresh(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.ttl:
+            self.hits += 1
+            return
+        with self._lock:
+            # Otro hilo pudo recargar mientras esperábamos el lock
+            loaded_at = self._loaded_at
+            if loaded_at is not None and time.monotonic() - loaded_at < self.ttl:
+                self.hits += 1
+                return
+            self.misses += 1
+            self._reload()
+
+    def _reload(self):
+        columns = (Paciente.id, Paciente.nombre, Paciente.device_id,
+                   Paciente.estado, Paciente.activo, Paciente.foto_url)
+        with self.app.app_context():
+            rows = db.session.query(*columns).order_by(Paciente.id).all()
+
+        by_id = {}
+        by_device = {}
+        active = None
+        for row in rows:
+            entry = PatientEntry(*row)
+            by_id[entry.id] = entry
+            if entry.device_id:
+                by_device[entry.device_id] = entry
+            if active is None and entry.activo:
+                active = entry
+
+        self._by_id, self._by_device, self._active = by_id, by_device, active
+        self._unknown_devices = {}
+        self._loaded_at = time.monotonic()
+        self.reloads += 1
+
+    def get_stats(self):
+        """Retorna los contadores de la caché"""
+        return {
+            'pacientes': len(self._by_id),
+            'hits': self.hits,
+            'misses': self.misses,
+            'reloads': self.reloads,
+            'device_lookups': self.device_lookups
+        }
+
+
+patient_registry = PatientRegistry()
@@ -0,0 +1,340 @@
+"""
+Envío de los recordatorios de medicación guardados en la tabla notificaciones
+"""
+import atexit
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from models import db, Notificacion, Configuracion
+
+logger = logging.getLogger(__name__)
+
+LEADER_KEY = 'reminder_leader'
+
+# Columnas añadidas a notificaciones después de su creación
+NEW_COLUMNS = (
+    ('intervalo_minutos', 'INTEGER NULL'),
+    ('fecha_envio', 'DATETIME NULL'),
+    ('caducado', 'BOOLEAN NOT NULL DEFAULT 0')
+)
+
+
+def ensure_schema():
+    """Crea la tabla de notificaciones o le añade las columnas e índices que falten"""
+    inspector = inspect(db.engine)
+    table = Notificacion.__table__
+    if not inspector.has_table(table.name):
+        table.create(bind=db.engine)
+        return
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    for name, ddl in NEW_COLUMNS:
+        if name not in existing:
+            db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {ddl}"))
+    db.session.commit()
+    for index in table.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+
+
+def next_occurrence(fecha_hora, interval_minutes, now):
+    """Primera repetición de un recordatorio periódico posterior a `now`"""
+    step = timedelta(minutes=interval_minutes)
+    if fecha_hora > now:
+        return fecha_hora
+    return fecha_hora + step * ((now - fecha_hora) // step + 1)
+
+
+class ReminderDispatcher:
+    """
+    Despachador de recordatorios con un único líder entre todos los procesos
+
+    La tabla notificaciones es la fuente de verdad. El proceso que tiene la
+    concesión (fila 'reminder_leader' de configuracion, renovada cada pocos
+    segundos) mantiene en un montículo solo los recordatorios pendientes de las
+    próximas `horizon_minutes`; el resto se queda en la base de datos, así que
+    cientos de miles de recordatorios pendientes no ocupan memoria. El hilo
+    duerme hasta el siguiente vencimiento, envía de una vez todos los que han
+    vencido y los marca con un UPDATE en bloque. Los periódicos
+    (`intervalo_minutos`) se reprograman en lugar de marcarse como enviados.
+    Los que vencieron hace más de `max_delay_minutes` (despachador parado) no se
+    envían: los periódicos pasan a su próxima repetición y los de una sola vez
+    se marcan como enviados y caducados.
+    """
+
+    def __init__(self, publish=None, horizon_minutes=60, refresh_seconds=15, lease_seconds=30,
+                 max_delay_minutes=10, retry_seconds=30):
+        self.app = None
+        self.publish = publish
+        self.topic = 'healthmonitor/control'
+        self.message = 'VIBRAR'
+        self.horizon = timedelta(minutes=horizon_minutes)
+        self.refresh_seconds = refresh_seconds
+        self.lease_seconds = lease_seconds
+        self.max_delay = timedelta(minutes=max_delay_minutes)
+        self.retry_seconds = retry_seconds
+
+        self.owner = None
+        self.is_leader = False
+        self._heap = []  # (epoch de vencimiento, id de la notificación)
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+        self._next_refresh = 0.0
+        self._next_lease = 0.0
+
+        self.sent = 0
+        self.failed = 0
+        self.expired = 0
+        self.batches = 0
+
+    def init_app(self, app, publish):
+        """Configura el despachador con la app y arranca su hilo"""
+        self.app = app
+        self.publish = publish
+        self.topic = app.config.get('REMINDER_TOPIC', self.topic)
+        self.message = app.config.get('REMINDER_MESSAGE', self.message)
+        self.horizon = timedelta(minutes=app.config.get('REMINDER_HORIZON_MINUTES', 60))
+        self.refresh_seconds = app.config.get('REMINDER_REFRESH_SECONDS', self.refresh_seconds)
+        self.lease_seconds = app.config.get('REMINDER_LEASE_SECONDS', self.lease_seconds)
+        self.max_delay = timedelta(minutes=app.config.get('REMINDER_MAX_DELAY_MINUTES', 10))
+        self.start()
+
+    def start(self):
+        if self._running:
+            return
+        # Identificador propio del proceso (tras un fork el pid cambia)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='reminder-dispatcher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Detiene el hilo y libera la concesión para que otro proceso la tome de inmediato"""
+        if not self._running:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=5)
+        if self.is_leader:
+            try:
+                with self.app.app_context():
+                    db.session.execute(
+                        db.update(Configuracion)
+                        .where(Configuracion.clave == LEADER_KEY, Configuracion.valor == self.owner)
+                        .values(fecha_modificacion=datetime(1970, 1, 1))
+                    )
+                    db.session.commit()
+            except Exception as e:
+                logger.warning("Error releasing reminder lease: %s", e)
+            self.is_leader = False
+
+    def add(self, notificacion_id, fecha_hora):
+        """Avisa de un recordatorio nuevo; si vence antes de la próxima recarga se programa ya"""
+        with self._cond:
+            if self.is_leader and fecha_hora <= datetime.now() + self.horizon:
+                heapq.heappush(self._heap, (fecha_hora.timestamp(), notificacion_id))
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                timeout = self._wait_time()
+                if timeout > 0:
+                    self._cond.wait(timeout=timeout)
+                if not self._running:
+                    return
+            try:
+                with self.app.app_context():
+                    self._tick()
+            except Exception as e:
+                logger.exception("Error in reminder dispatcher")
+                db.session.remove()
+                time.sleep(1)
+
+    def _wait_time(self):
+        now = time.time()
+        wake = min(self._next_lease, self._next_refresh)
+        if self._heap:
+            wake = min(wake, self._heap[0][0])
+        return max(wake - now, 0)
+
+    def _tick(self):
+        now = time.time()
+        if now >= self._next_lease:
+            self._next_lease = now + self.lease_seconds / 3
+            if not self._renew_lease():
+                with self._cond:
+                    self._heap = []
+                # Recargar en cuanto se obtenga la concesión
+                self._next_refresh = self._next_lease
+                return
+        if now >= self._next_refresh:
+            self._refresh()
+            self._next_refresh = now + self.refresh_seconds
+
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[1])
+        if due:
+            self._dispatch(due)
+
+    def _renew_lease(self):
+        """Toma o renueva la concesión de líder; retorna True si este proceso es el líder"""
+        now = datetime.now()
+        result = db.session.execute(
+            db.update(Configuracion)
+            .where(Configuracion.clave == LEADER_KEY,
+                   db.or_(Configuracion.valor == self.owner,
+                          Configuracion.fecha_modificacion < now - timedelta(seconds=self.lease_seconds)))
+            .values(valor=self.owner, fecha_modificacion=now)
+        )
+        leader = result.rowcount == 1
+        if not leader and Configuracion.query.filter_by(clave=LEADER_KEY).first() is None:
+            db.session.add(Configuracion(clave=LEADER_KEY, valor=self.owner, fecha_modificacion=now,
+                                         descripcion='Proceso que envía los recordatorios de medicación'))
+            leader = True
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Otro proceso creó la fila a la vez
+            db.session.rollback()
+            leader = False
+
+        if leader != self.is_leader:
+            logger.info("Reminder dispatcher %s: %s", self.owner, 'leader' if leader else 'follower')
+        self.is_leader = leader
+        return leader
+
+    def _refresh(self):
+        """Recarga el montículo con los recordatorios pendientes dentro del horizonte"""
+        now = datetime.now()
+        self._expire_stale(now)
+        rows = db.session.execute(
+            db.select(Notificacion.id, Notificacion.fecha_hora)
+            .where(Notificacion.enviado == False,
+                   Notificacion.fecha_hora >= now - self.max_delay,
+                   Notificacion.fecha_hora <= now + self.horizon)
+        ).all()
+        heap = [(row.fecha_hora.timestamp(), row.id) for row in rows]
+        heapq.heapify(heap)
+        with self._cond:
+            self._heap = heap
+
+    def _expire_stale(self, now):
+        # Recordatorios que vencieron con el despachador parado: los periódicos pasan a su
+        # próxima repetición y los de una sola vez se cierran como caducados
+        stale = db.session.execute(
+            db.select(Notificacion.id, Notificacion.fecha_hora, Notificacion.intervalo_minutos)
+            .where(Notificacion.enviado == False,
+                   Notificacion.fecha_hora < now - self.max_delay)
+        ).all()
+        if not stale:
+            return
+        once = [row.id for row in stale if not row.intervalo_minutos]
+        recurring = [
+            {'id': row.id, 'fecha_hora': next_occurrence(row.fecha_hora, row.intervalo_minutos, now)}
+            for row in stale if row.intervalo_minutos
+        ]
+        if once:
+            db.session.execute(
+                db.update(Notificacion).where(Notificacion.id.in_(once)).values(enviado=True, caducado=True)
+            )
+            self.expired += len(once)
+            logger.warning("Expired %d one-shot reminders overdue by more than %s", len(once), self.max_delay)
+        if recurring:
+            db.session.execute(db.update(Notificacion), recurring)
+        db.session.commit()
+
+    def _dispatch(self, ids):
+        """Envía un lote de recordatorios vencidos y los marca en bloque"""
+        now = datetime.now()
+        # Releer el lote: pueden haberse borrado, enviado o movido desde la recarga
+        rows = db.session.execute(
+            db.select(Notificacion.id, Notificacion.fecha_hora, Notificacion.intervalo_minutos)
+            .where(Notificacion.id.in_(ids),
+                   Notificacion.enviado == False,
+                   Notificacion.fecha_hora <= now)
+        ).all()
+        if not rows:
+            return
+
+        for index, row in enumerate(rows):
+            if not self.publish(self.topic, self.message):
+                # Sin conexión con el broker: reintentar los que faltan más tarde
+                retry = time.time() + self.retry_seconds
+                with self._cond:
+                    for pending in rows[index:]:
+                        heapq.heappush(self._heap, (retry, pending.id))
+                self.failed += len(rows) - index
+                rows = rows[:index]
+                break
+        if not rows:
+            return
+
+        once = [row.id for row in rows if not row.intervalo_minutos]
+        recurring = [
+            {'id': row.id, 'fecha_hora': next_occurrence(row.fecha_hora, row.intervalo_minutos, now),
+             'fecha_envio': now}
+            for row in rows if row.intervalo_minutos
+        ]
+        if once:
+            db.session.execute(
+                db.update(Notificacion).where(Notificacion.id.in_(once)).values(enviado=True, fecha_envio=now)
+            )
+        if recurring:
+            db.session.execute(db.update(Notificacion), recurring)
+        db.session.commit()
+
+        limit = now + self.horizon
+        with self._cond:
+            for item in recurring:
+                if item['fecha_hora'] <= limit:
+                    heapq.heappush(self._heap, (item['fecha_hora'].timestamp(), item['id']))
+        self.sent += len(rows)
+        self.batches += 1
+
+    def get_stats(self):
+        """Retorna el rol del proceso y los contadores del despachador"""
+        with self._cond:
+            pending = len(self._heap)
+        return {
+            'leader': self.is_leader,
+            'owner': self.owner,
+            'in_memory': pending,
+            'sent': self.sent,
+            'failed': self.failed,
+            'expired': self.expired,
+            'batches': self.batches
+        }
+
+
+reminder_dispatcher = ReminderDispatcher()
+
+
+def init_reminders(app):
+    """
+    Registra el comando de esquema de notificaciones y arranca el despachador
+
+    El esquema no se actualiza al arrancar (ver init_partitions): hay que ejecutar
+    `flask reminders-init` en el despliegue antes de levantar los procesos web.
+    """
+    from mqtt_service import publish_message
+
+    @app.cli.command('reminders-init')
+    def reminders_init_command():
+        """Crea la tabla de notificaciones o le añade las columnas e índices que falten"""
+        ensure_schema()
+        print("Esquema de notificaciones actualizado")
+
+    if app.config.get('REMINDERS_ENABLED', True):
+        reminder_dispatcher.init_app(app, publish_message)
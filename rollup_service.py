@@ -0,0 +1,319 @@
+"""
+Mantenimiento y consulta de los agregados (rollups) de lecturas por paciente
+"""
+import time
+from datetime import timedelta
+from sqlalchemy.exc import IntegrityError
+from models import db, SensorData, VitalsRollup, Configuracion
+
+WATERMARK_KEY = 'rollup_watermark'
+LOCK_KEY = 'rollup_lock'
+
+# Granularidades de más fina a más gruesa
+GRANULARITIES = {
+    'minute': timedelta(minutes=1),
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1)
+}
+
+SIGNALS = (('temp', 'valor'), ('hr', 'heart_rate'), ('spo2', 'spo2'))
+
+# Huecos de ids vistos tras la marca de agua: primer id que falta -> momento en que se vio
+_gaps = {}
+_ready = False
+
+
+def truncate(fecha, granularity):
+    """Inicio del intervalo de `granularity` que contiene `fecha`"""
+    if granularity == 'minute':
+        return fecha.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return fecha.replace(minute=0, second=0, microsecond=0)
+    return fecha.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_watermark(for_update=False):
+    """Último id de SensorData incluido en los agregados, o None si nunca se han construido"""
+    query = Configuracion.query.filter_by(clave=WATERMARK_KEY)
+    if for_update:
+        # Lectura con bloqueo: ve el último valor confirmado aunque la transacción ya leyera antes
+        query = query.with_for_update()
+    row = query.first()
+    return int(row.valor) if row else None
+
+
+def lock_rollups():
+    """
+    Bloquea la fila 'rollup_lock' de configuracion hasta el próximo commit o rollback
+
+    El job de agregados corre en todos los procesos web; con el bloqueo, cada
+    lote se calcula y se guarda con su marca de agua en un solo proceso a la vez.
+    """
+    row = Configuracion.query.filter_by(clave=LOCK_KEY).with_for_update().first()
+    if row is not None:
+        return
+    try:
+        db.session.add(Configuracion(clave=LOCK_KEY, valor='', descripcion='Bloqueo de la actualización de agregados'))
+        db.session.commit()
+    except IntegrityError:
+        # Otro proceso creó la fila a la vez
+        db.session.rollback()
+    Configuracion.query.filter_by(clave=LOCK_KEY).with_for_update().first()
+
+
+def set_watermark(last_id):
+    row = Configuracion.query.filter_by(clave=WATERMARK_KEY).first()
+    if row is None:
+        row = Configuracion(clave=WATERMARK_KEY, descripcion='Último id de temperatura incluido en temperatura_rollup')
+        db.session.add(row)
+    row.valor = str(last_id)
+
+
+def is_ready():
+    """Indica si los agregados están construidos y se pueden usar en las consultas"""
+    global _ready
+    # Una vez creada, la marca de agua no se borra: basta consultarla hasta verla
+    if not _ready:
+        _ready = get_watermark() is not None
+    return _ready
+
+
+class Aggregate:
+    """Agregado en memoria de las lecturas de un intervalo (mismas columnas que VitalsRollup)"""
+    __slots__ = ('muestras', 'ultima_fecha',
+                 'temp_sum', 'temp_min', 'temp_max', 'temp_last',
+                 'hr_sum', 'hr_min', 'hr_max', 'hr_last',
+                 'spo2_sum', 'spo2_min', 'spo2_max', 'spo2_last')
+
+    def __init__(self):
+        self.muestras = 0
+        self.ultima_fecha = None
+        for prefix, _ in SIGNALS:
+            setattr(self, f'{prefix}_sum', 0)
+            setattr(self, f'{prefix}_min', None)
+            setattr(self, f'{prefix}_max', None)
+            setattr(self, f'{prefix}_last', None)
+
+    def add(self, reading):
+        """Incorpora una lectura (fila de SensorData)"""
+        newer = self.ultima_fecha is None or reading.fecha >= self.ultima_fecha
+        self.muestras += 1
+        for prefix, column in SIGNALS:
+            self._add_value(prefix, getattr(reading, column), newer)
+        if newer:
+            self.ultima_fecha = reading.fecha
+
+    def _add_value(self, prefix, value, newer):
+        if value is None:
+            return
+        setattr(self, f'{prefix}_sum', getattr(self, f'{prefix}_sum') + value)
+        current_min = getattr(self, f'{prefix}_min')
+        current_max = getattr(self, f'{prefix}_max')
+        if current_min is None or value < current_min:
+            setattr(self, f'{prefix}_min', value)
+        if current_max is None or value > current_max:
+            setattr(self, f'{prefix}_max', value)
+        if newer:
+            setattr(self, f'{prefix}_last', value)
+
+    def merge_into(self, rollup):
+        """Combina este agregado con un VitalsRollup ya guardado"""
+        newer = rollup.ultima_fecha is None or self.ultima_fecha >= rollup.ultima_fecha
+        rollup.muestras = (rollup.muestras or 0) + self.muestras
+        for prefix, _ in SIGNALS:
+            rollup_sum = getattr(rollup, f'{prefix}_sum') or 0
+            setattr(rollup, f'{prefix}_sum', rollup_sum + getattr(self, f'{prefix}_sum'))
+            for bound, pick in (('min', min), ('max', max)):
+                ours = getattr(self, f'{prefix}_{bound}')
+                theirs = getattr(rollup, f'{prefix}_{bound}')
+                if ours is not None:
+                    setattr(rollup, f'{prefix}_{bound}', ours if theirs is None else pick(ours, theirs))
+            if newer and getattr(self, f'{prefix}_last') is not None:
+                setattr(rollup, f'{prefix}_last', getattr(self, f'{prefix}_last'))
+        if newer:
+            rollup.ultima_fecha = self.ultima_fecha
+
+    def as_row(self, paciente_id, granularity, bucket):
+        row = {name: getattr(self, name) for name in self.__slots__}
+        row.update(paciente_id=paciente_id, granularidad=granularity, bucket=bucket)
+        return row
+
+
+def _committed_prefix(readings, watermark, safety_lag, now):
+    """
+    Lecturas hasta el primer hueco de ids que aún puede rellenarse
+
+    Con varios escritores a la vez (escritor por lotes, ingest_app, importación)
+    un id menor puede hacerse visible después de uno mayor. Un hueco se salta
+    solo cuando lleva `safety_lag` segundos sin rellenarse (transacción
+    deshecha); antes, la marca de agua se detiene justo delante.
+    """
+    expected = watermark + 1
+    for i, reading in enumerate(readings):
+        # Sin marca de agua previa no hay lecturas anteriores que esperar
+        if reading.id != expected and (i or watermark):
+            first_seen = _gaps.setdefault(expected, now)
+            if now - first_seen < safety_lag:
+                return readings[:i]
+        expected = reading.id + 1
+    return readings
+
+
+def update_rollups(batch_size=10000, max_batches=None, safety_lag=30):
+    """
+    Incorpora a los agregados las lecturas con id posterior a la marca de agua
+
+    Procesa la tabla en lotes de `batch_size` filas; cada lote se guarda junto
+    con la nueva marca de agua en la misma transacción, así que una interrupción
+    nunca cuenta dos veces la misma lectura. La marca de agua no pasa de un hueco
+    de ids hasta que lleva `safety_lag` segundos abierto (ver _committed_prefix).
+    Cada lote se procesa con lock_rollups tomado, así que varios procesos que
+    ejecutan el job a la vez no agregan el mismo rango de ids.
+    Retorna el número de lecturas procesadas.
+    """
+    processed = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        lock_rollups()
+        watermark = get_watermark(for_update=True) or 0
+        readings = db.session.query(
+            SensorData.id, SensorData.paciente_id, SensorData.fecha,
+            SensorData.valor, SensorData.heart_rate, SensorData.spo2
+        ).filter(SensorData.id > watermark).order_by(SensorData.id).limit(batch_size).all()
+        fetched = len(readings)
+        readings = _committed_prefix(readings, watermark, safety_lag, time.monotonic())
+        if not readings:
+            db.session.rollback()  # Libera el bloqueo
+            break
+
+        for granularity in GRANULARITIES:
+            _apply_batch(readings, granularity)
+
+        watermark = readings[-1].id
+        set_watermark(watermark)
+        db.session.commit()
+        for gap in [gap for gap in _gaps if gap <= watermark]:
+            del _gaps[gap]
+
+        processed += len(readings)
+        batches += 1
+        if len(readings) < fetched or fetched < batch_size:
+            break
+
+    if batches == 0 and get_watermark() is None:
+        # Tabla vacía: dejamos la marca de agua para que las consultas usen los agregados
+        lock_rollups()
+        if get_watermark(for_update=True) is None:
+            set_watermark(0)
+        db.session.commit()
+
+    return processed
+
+
+def _apply_batch(readings, granularity):
+    # Agregar primero en memoria para tocar cada fila de la tabla una sola vez
+    aggregates = {}
+    for reading in readings:
+        if reading.paciente_id is None:
+            continue
+        key = (reading.paciente_id, truncate(reading.fecha, granularity))
+        aggregate = aggregates.get(key)
+        if aggregate is None:
+            aggregate = aggregates[key] = Aggregate()
+        aggregate.add(reading)
+    if not aggregates:
+        return
+
+    patient_ids = {k[0] for k in aggregates}
+    buckets = [k[1] for k in aggregates]
+    existing = VitalsRollup.query.filter(
+        VitalsRollup.granularidad == granularity,
+        VitalsRollup.paciente_id.in_(patient_ids),
+        VitalsRollup.bucket >= min(buckets),
+        VitalsRollup.bucket <= max(buckets)
+    ).all()
+    existing = {(r.paciente_id, r.bucket): r for r in existing}
+
+    new_rows = []
+    for key, aggregate in aggregates.items():
+        rollup = existing.get(key)
+        if rollup is None:
+            new_rows.append(aggregate.as_row(key[0], granularity, key[1]))
+        else:
+            aggregate.merge_into(rollup)
+    if new_rows:
+        db.session.execute(VitalsRollup.__table__.insert(), new_rows)
+
+
+def backfill(batch_size=10000, progress=None, safety_lag=30):
+    """Reconstruye todos los agregados desde cero a partir de la tabla de lecturas"""
+    started = time.perf_counter()
+    lock_rollups()
+    VitalsRollup.query.delete()
+    set_watermark(0)
+    _gaps.clear()
+    db.session.commit()
+
+    total = 0
+    while True:
+        processed = update_rollups(batch_size=batch_size, max_batches=1, safety_lag=safety_lag)
+        if not processed:
+            break
+        total += processed
+        if progress:
+            progress(total, time.perf_counter() - started)
+    return total
+
+
+def choose_granularity(days, max_points):
+    """
+    Granularidad más gruesa que aún aporta al menos `max_points` puntos en el rango
+    Retorna None si ninguna alcanza (el rango es corto y conviene usar los datos crudos)
+    """
+    span = timedelta(days=days)
+    for granularity in reversed(list(GRANULARITIES)):
+        if span / GRANULARITIES[granularity] >= max_points:
+            return granularity
+    return None
+
+
+def get_series(patient_id, since, granularity):
+    """Promedios por intervalo de un paciente desde `since`"""
+    return VitalsRollup.query.filter(
+        VitalsRollup.paciente_id == patient_id,
+        VitalsRollup.granularidad == granularity,
+        VitalsRollup.bucket >= truncate(since, granularity)
+    ).order_by(VitalsRollup.bucket.asc()).all()
+
+
+def get_averages(since):
+    """Promedio global de cada señal desde `since` (a partir de los agregados por minuto)"""
+    totals = db.session.query(
+        db.func.sum(VitalsRollup.muestras),
+        db.func.sum(VitalsRollup.temp_sum),
+        db.func.sum(VitalsRollup.hr_sum),
+        db.func.sum(VitalsRollup.spo2_sum)
+    ).filter(
+        VitalsRollup.granularidad == 'minute',
+        VitalsRollup.bucket >= truncate(since, 'minute')
+    ).one()
+    count = totals[0] or 0
+    if not count:
+        return 0, 0, 0
+    return totals[1] / count, totals[2] / count, totals[3] / count
+
+
+def init_rollups(app):
+    """Crea la tabla de agregados si no existe y registra el comando de reconstrucción"""
+    with app.app_context():
+        VitalsRollup.__table__.create(bind=db.engine, checkfirst=True)
+
+    @app.cli.command('rollups-backfill')
+    def rollups_backfill_command():
+        """Reconstruye los agregados de lecturas (temperatura_rollup)"""
+        def report(total, elapsed):
+            print(f"{total} lecturas agregadas ({total / elapsed:.0f} lecturas/s)")
+        total = backfill(batch_size=app.config.get('ROLLUP_BATCH_SIZE', 10000), progress=report,
+                         safety_lag=app.config.get('ROLLUP_SAFETY_LAG_SECONDS', 30))
+        print(f"Agregados reconstruidos: {total} lecturas")
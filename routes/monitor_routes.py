@@ -1,11 +1,20 @@
 """
 Rutas para el monitor en tiempo real y estadísticas
 """
-from flask import Blueprint, render_template, jsonify, request, session
+import json
+import logging
+from datetime import datetime
+from flask import Blueprint, render_template, jsonify, request, session, abort, Response, stream_with_context, current_app
 from controllers.monitor_controller import MonitorController
 from controllers.patient_controller import PatientController
-from mqtt_service import get_current_readings
-from utils import login_required
+from mqtt_service import get_current_readings, get_ingest_stats
+from patient_registry import patient_registry
+from event_bus import event_bus, patient_channel
+from dashboard_snapshot import dashboard_snapshot
+from vitals_rules import STATUS_CHANNEL
+from utils import login_required, json_response
+
+logger = logging.getLogger(__name__)
 
 monitor_bp = Blueprint('monitor', __name__)
 
@@ -14,55 +23,70 @@ monitor_bp = Blueprint('monitor', __name__)
 def index():
     """Vista principal del monitor en tiempo real"""
     paciente_activo = MonitorController.get_active_patient()
-    todos_pacientes = PatientController.get_all_patients()
     
     return render_template('index.html', 
                          user_name=session.get('user_name', 'Usuario'),
-                         paciente=paciente_activo,
-                         pacientes=todos_pacientes)
+                         paciente=paciente_activo)
 
 @monitor_bp.route('/<int:patient_id>')
 @login_required
 def monitor_patient(patient_id):
     """Vista de monitoreo para un paciente específico"""
     paciente = PatientController.get_patient_by_id(patient_id)
-    todos_pacientes = PatientController.get_all_patients()
     
     return render_template('index.html', 
                          user_name=session.get('user_name', 'Usuario'),
-                         paciente=paciente,
-                         pacientes=todos_pacientes)
+                         paciente=paciente)
+
+def parse_since(value):
+    """Convierte el parámetro `since` (epoch en ms, admite decimales, o ISO 8601) a datetime"""
+    if not value:
+        return None
+    try:
+        return datetime.fromtimestamp(float(value) / 1000)
+    except ValueError:
+        return datetime.fromisoformat(value)
 
 @monitor_bp.route('/datos')
 @login_required
 def get_data():
-    """API para obtener datos en tiempo real e históricos"""
-    range_param = request.args.get('range', '5min')
-    paciente_id = request.args.get('paciente_id')
+    """
+    API para obtener datos en tiempo real e históricos
     
-    records = MonitorController.get_sensor_data(range_param, paciente_id)
-    current_readings = get_current_readings()
+    Con `since_id` (último id recibido) o `since` (epoch en ms o ISO 8601) solo
+    retorna las lecturas nuevas, además de los valores actuales.
+    Con `format=columnar` retorna un eje de tiempo compartido y un arreglo por señal.
+    """
+    range_param = request.args.get('range', '5min')
+    paciente_id = request.args.get('paciente_id', type=int)
+    since_id = request.args.get('since_id', type=int)
+    try:
+        since = parse_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': 'Parámetro since inválido'}), 400
     
     # Identificar el paciente que se está visualizando
     paciente_visualizado = None
     if paciente_id:
-        paciente_visualizado = PatientController.get_patient_by_id(paciente_id)
+        paciente_visualizado = patient_registry.get_by_id(paciente_id)
+        if paciente_visualizado is None:
+            abort(404)
     else:
-        paciente_visualizado = MonitorController.get_active_patient()
+        paciente_visualizado = patient_registry.get_active()
+    
+    records = MonitorController.get_sensor_data(range_param, paciente_visualizado.id if paciente_visualizado else None,
+                                                since_id=since_id, since=since)
 
     # Verificar correspondencia de device_id
     # Solo mostramos datos en tiempo real si el device_id de las lecturas actuales coincide con el del paciente visualizado
-    readings_device_id = current_readings.get('device_id')
     patient_device_id = paciente_visualizado.device_id if paciente_visualizado else None
+    current_readings = get_current_readings(patient_device_id)
+    readings_device_id = current_readings.get('device_id')
     
-    print(f"DEBUG: Checking device match. Readings ID: {readings_device_id}, Patient ID: {patient_device_id}, Patient Name: {paciente_visualizado.nombre if paciente_visualizado else 'None'}")
-    
-    show_live_data = False
-    if readings_device_id and patient_device_id and readings_device_id == patient_device_id:
-        show_live_data = True
-        print("DEBUG: Device IDs match. Showing live data.")
-    else:
-        print("DEBUG: Device IDs DO NOT match or missing. Hiding live data.")
+    show_live_data = bool(readings_device_id and patient_device_id and readings_device_id == patient_device_id)
+    logger.debug("Device match for patient %s: readings %s, patient %s, live=%s",
+                 paciente_visualizado.id if paciente_visualizado else None,
+                 readings_device_id, patient_device_id, show_live_data)
         
     if not show_live_data:
         # Si los device_id no coinciden, limpiamos las lecturas actuales para que se muestre el valor por defecto (1)
@@ -74,22 +98,102 @@ def get_data():
             'device_id': None
         }
     
-    data = MonitorController.format_sensor_data(records, current_readings)
+    # En consultas incrementales sin lecturas nuevas, los valores actuales salen de la última lectura guardada
+    last_record = None
+    incremental = since_id is not None or since is not None
+    if incremental and not records and not show_live_data and paciente_visualizado:
+        last_record = MonitorController.get_latest_record(paciente_visualizado.id)
+    
+    if request.args.get('format') == 'columnar':
+        data = MonitorController.format_sensor_data_columnar(records, current_readings, last_record,
+                                                             incremental=incremental, since_id=since_id)
+        return json_response(data)
+    
+    data = MonitorController.format_sensor_data(records, current_readings, last_record,
+                                                incremental=incremental, since_id=since_id)
     
     return jsonify(data)
 
+def sse_response(channel, event_name):
+    """Respuesta SSE con los eventos del canal (reanuda desde Last-Event-ID)"""
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    subscription = event_bus.subscribe(channel, last_event_id)
+    heartbeat = current_app.config.get('SSE_HEARTBEAT_SECONDS', 15)
+    retry_ms = current_app.config.get('SSE_RETRY_MS', 3000)
+    
+    def generate():
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            while True:
+                event = subscription.get(timeout=heartbeat)
+                if event is None:
+                    # Comentario SSE para mantener viva la conexión a través de proxies
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"id: {event.id}\nevent: {event_name}\ndata: {json.dumps(event.data)}\n\n"
+        finally:
+            event_bus.unsubscribe(subscription)
+    
+    return Response(stream_with_context(generate()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@monitor_bp.route('/stream/<int:patient_id>')
+@login_required
+def stream(patient_id):
+    """Stream SSE con cada nueva lectura del paciente"""
+    if patient_registry.get_by_id(patient_id) is None:
+        abort(404)
+    return sse_response(patient_channel(patient_id), 'sample')
+
+@monitor_bp.route('/stream/estados')
+@login_required
+def stream_status():
+    """Stream SSE con los cambios de estado de todos los pacientes"""
+    return sse_response(STATUS_CHANNEL, 'estado')
+
 @monitor_bp.route('/stats')
 @login_required
 def stats():
     """Vista de estadísticas globales (Dashboard)"""
-    stats_data = MonitorController.get_global_stats()
+    stats_data = dashboard_snapshot.get()
     return render_template('stats.html', stats=stats_data)
 
+@monitor_bp.route('/api/stats/global')
+@login_required
+def api_global_stats():
+    """API con la instantánea de estadísticas globales"""
+    return jsonify(dashboard_snapshot.get())
+
+@monitor_bp.route('/api/ingest/stats')
+@login_required
+def api_ingest_stats():
+    """API con los contadores de ingesta de datos"""
+    return jsonify(get_ingest_stats())
+
 @monitor_bp.route('/api/stats')
 @login_required
 def api_stats():
-    """API para datos estadísticos"""
+    """
+    API para datos estadísticos
+    
+    Con `stream=1` retorna todas las lecturas crudas del rango como filas
+    [t, temperatura, heart_rate, spo2], generadas por lotes desde la base de datos.
+    """
     days = int(request.args.get('days', 7))
     patient_id = request.args.get('patient_id')
-    data = MonitorController.get_stats_data(days, patient_id)
+    if request.args.get('stream'):
+        batch_size = current_app.config.get('STREAM_BATCH_SIZE', 5000)
+        return Response(stream_with_context(MonitorController.stream_stats_json(days, patient_id, batch_size)),
+                        mimetype='application/json')
+    
+    max_points = request.args.get('max_points', type=int)
+    method = request.args.get('downsample', 'lttb')
+    columnar = request.args.get('format') == 'columnar'
+    try:
+        data = MonitorController.get_stats_data(days, patient_id, max_points, method, columnar=columnar)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if columnar:
+        return json_response(data)
     return jsonify(data)
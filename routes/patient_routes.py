@@ -1,21 +1,23 @@
 """
 Rutas para gestión de pacientes
 """
-from flask import Blueprint, render_template, request, jsonify
-from controllers.patient_controller import PatientController
+from datetime import datetime
+from flask import Blueprint, render_template, request, jsonify, Response, stream_with_context, current_app
+from controllers.patient_controller import PatientController, EXPORT_FORMATS
 from utils import login_required
+import import_service
+from reminder_service import reminder_dispatcher
+from command_service import command_channel, resolve_targets, get_batch_status
 
 patient_bp = Blueprint('patients', __name__)
 
 @patient_bp.route('/patients')
 @login_required
 def index():
-    """Vista principal de lista de pacientes"""
-    pacientes = PatientController.get_all_patients()
+    """Vista principal de lista de pacientes (la tabla se carga por páginas desde /api/pacientes)"""
     stats = PatientController.get_patients_stats()
     
     return render_template('patients.html', 
-                         pacientes=pacientes,
                          total_pacientes=stats['total'],
                          pacientes_normales=stats['normales'],
                          pacientes_advertencia=stats['advertencia'],
@@ -23,6 +25,42 @@ def index():
 
 # API Endpoints
 
+def patient_to_dict(paciente):
+    """Representación JSON de un paciente"""
+    return {
+        'id': paciente.id,
+        'nombre': paciente.nombre,
+        'edad': paciente.edad,
+        'email': paciente.email,
+        'telefono': paciente.telefono,
+        'device_id': paciente.device_id,
+        'estado': paciente.estado,
+        'activo': paciente.activo,
+        'ultima_visita': paciente.ultima_visita.isoformat() if paciente.ultima_visita else None,
+        'notas': paciente.notas,
+        'foto_url': paciente.foto_url
+    }
+
+@patient_bp.route('/api/pacientes', methods=['GET'])
+@login_required
+def list_patients():
+    """
+    Listar pacientes por páginas
+    
+    Parámetros: `after` (cursor retornado en `siguiente`), `limit`, `estado` y
+    `q` (prefijo del nombre).
+    """
+    pacientes, siguiente = PatientController.list_patients(
+        after=request.args.get('after', type=int),
+        limit=request.args.get('limit', 50, type=int),
+        estado=request.args.get('estado') or None,
+        search=request.args.get('q', '').strip() or None
+    )
+    return jsonify({
+        'pacientes': [patient_to_dict(p) for p in pacientes],
+        'siguiente': siguiente
+    })
+
 @patient_bp.route('/api/pacientes', methods=['POST'])
 @login_required
 def create_patient():
@@ -41,18 +79,7 @@ def manage_patient(id):
     try:
         if request.method == 'GET':
             paciente = PatientController.get_patient_by_id(id)
-            return jsonify({
-                'id': paciente.id,
-                'nombre': paciente.nombre,
-                'edad': paciente.edad,
-                'email': paciente.email,
-                'telefono': paciente.telefono,
-                'device_id': paciente.device_id,
-                'estado': paciente.estado,
-                'ultima_visita': paciente.ultima_visita.isoformat() if paciente.ultima_visita else None,
-                'notas': paciente.notas,
-                'foto_url': paciente.foto_url
-            })
+            return jsonify(patient_to_dict(paciente))
         
         elif request.method == 'PUT':
             data = request.json
@@ -89,7 +116,10 @@ def get_notifications(id):
         return jsonify([{
             'id': n.id,
             'fecha_hora': n.fecha_hora.isoformat(),
-            'enviado': n.enviado
+            'enviado': n.enviado,
+            'intervalo_minutos': n.intervalo_minutos,
+            'fecha_envio': n.fecha_envio.isoformat() if n.fecha_envio else None,
+            'caducado': n.caducado
         } for n in notificaciones])
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -106,25 +136,21 @@ def schedule_notification(id):
             return jsonify({'error': 'Fecha y hora son requeridas'}), 400
             
         # Parsear fecha y hora
-        from datetime import datetime
         run_date = datetime.fromisoformat(fecha_hora_str)
+        intervalo = int(data['intervalo_minutos']) if data.get('intervalo_minutos') else None
+        if intervalo is not None and intervalo <= 0:
+            return jsonify({'error': 'El intervalo debe ser positivo'}), 400
         
-        # Tópico y mensaje fijos para vibración
-        topic = "healthmonitor/control"
-        message = "VIBRAR"
-        
-        from scheduler_service import schedule_medication_reminder
-        job_id = schedule_medication_reminder(run_date, topic, message)
-        
-        # Guardar en BD
+        # Guardar en BD; el despachador de recordatorios lo envía al vencer
         from models import db, Notificacion
         notificacion = Notificacion(
             paciente_id=id,
             fecha_hora=run_date,
-            job_id=job_id
+            intervalo_minutos=intervalo
         )
         db.session.add(notificacion)
         db.session.commit()
+        reminder_dispatcher.add(notificacion.id, run_date)
         
         return jsonify({
             'message': 'Notificación programada exitosamente',
@@ -136,23 +162,114 @@ def schedule_notification(id):
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@patient_bp.route('/api/notificaciones/stats')
+@login_required
+def api_notifications_stats():
+    """API con el estado del despachador de recordatorios de este proceso"""
+    return jsonify(reminder_dispatcher.get_stats())
+
 @patient_bp.route('/api/pacientes/<int:patient_id>/notificaciones/<int:id>', methods=['DELETE'])
 @login_required
 def delete_notification(patient_id, id):
     """Eliminar una notificación programada"""
     try:
         from models import db, Notificacion
-        from scheduler_service import cancel_job
         
+        # El despachador relee cada lote antes de enviarlo, así que basta con borrar la fila
         notificacion = Notificacion.query.get_or_404(id)
-        
-        # Cancelar job si existe
-        if notificacion.job_id:
-            cancel_job(notificacion.job_id)
-            
         db.session.delete(notificacion)
         db.session.commit()
         
         return jsonify({'message': 'Notificación eliminada exitosamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 400
+
+@patient_bp.route('/api/pacientes/<int:id>/export', methods=['GET'])
+@login_required
+def export_vitals(id):
+    """Exportar el histórico de lecturas de un paciente (CSV o NDJSON, opcionalmente gzip)"""
+    try:
+        paciente = PatientController.get_patient_by_id(id)
+        fmt = request.args.get('format', 'csv')
+        since = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        until = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+        compress = request.args.get('gzip') in ('1', 'true')
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Formato de exportación no soportado: {fmt}")
+        
+        chunks = PatientController.export_vitals(
+            paciente.id, since, until, fmt, compress,
+            batch_size=current_app.config.get('STREAM_BATCH_SIZE', 5000)
+        )
+        # Primer fragmento antes de responder; un rango vacío en NDJSON sin gzip no produce ninguno
+        first_chunk = next(chunks, b'')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    filename = f"paciente_{paciente.id}_vitales.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    
+    def generate():
+        yield first_chunk
+        yield from chunks
+    
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@patient_bp.route('/api/dispositivos/<device_id>/import', methods=['POST'])
+@login_required
+def import_readings(device_id):
+    """Importar lecturas históricas de un dispositivo (fichero CSV/NDJSON, opcionalmente .gz)"""
+    upload = request.files.get('file')
+    if upload is not None:
+        filename, stream = upload.filename, upload.stream
+    else:
+        filename, stream = request.args.get('filename', ''), request.stream
+    
+    try:
+        fmt = import_service.detect_format(filename, request.args.get('format'))
+        result = import_service.import_readings(
+            device_id, import_service.open_stream(stream, filename), fmt,
+            batch_size=current_app.config.get('IMPORT_BATCH_SIZE', 20000)
+        )
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@patient_bp.route('/api/dispositivos/comandos', methods=['POST'])
+@login_required
+def send_command():
+    """
+    Enviar un comando a los dispositivos de varios pacientes
+    
+    Cuerpo: {"comando": "VIBRAR", "pacientes": [ids]} o {"comando": ..., "estado": "critico"};
+    sin filtro se envía a todos los pacientes con dispositivo
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'El cuerpo debe ser un objeto JSON'}), 400
+    comando = data.get('comando')
+    if not comando:
+        return jsonify({'error': 'Comando requerido'}), 400
+    pacientes = data.get('pacientes')
+    if pacientes is not None and not (isinstance(pacientes, list) and all(
+            isinstance(p, int) and not isinstance(p, bool) for p in pacientes)):
+        return jsonify({'error': 'pacientes debe ser una lista de ids'}), 400
+    estado = data.get('estado')
+    if estado is not None and not isinstance(estado, str):
+        return jsonify({'error': 'estado debe ser un texto'}), 400
+    try:
+        targets = resolve_targets(pacientes, estado)
+        lote, total = command_channel.send(targets, comando)
+        return jsonify({'lote': lote, 'dispositivos': total}), 202
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+
+@patient_bp.route('/api/dispositivos/comandos/<lote>')
+@login_required
+def command_status(lote):
+    """Estado de entrega de los comandos de un lote"""
+    return jsonify(get_batch_status(lote))
@@ -1,6 +1,7 @@
+import logging
 from apscheduler.schedulers.background import BackgroundScheduler
-from mqtt_service import publish_message
-from datetime import datetime
+
+logger = logging.getLogger(__name__)
 
 scheduler = BackgroundScheduler()
 
@@ -13,41 +14,47 @@ def init_scheduler(app):
     # Necesitamos importar db y SensorData aquí o pasarlos, pero para evitar importaciones circulares
     # podemos definir la función de limpieza dentro de init_scheduler o usar app context
     
-    from models import db, SensorData
-    from datetime import timedelta
+    import partition_service
 
     def clean_old_data():
         with app.app_context():
-            days = app.config.get('OLD_DATA_RETENTION_DAYS', 30)
-            old_records = SensorData.query.filter(
-                SensorData.fecha < datetime.now() - timedelta(days=days)
-            ).delete()
-            db.session.commit()
-            print(f"Deleted {old_records} old records")
+            result = partition_service.maintain(app)
+            logger.info("Deleted %s old records (%s), partitions dropped: %s, created: %s", result['filas'],
+                        result['modo'], result['particiones_eliminadas'], result['particiones_creadas'])
 
     scheduler.add_job(func=clean_old_data, trigger="interval", hours=24, id='clean_old_data', replace_existing=True)
-
-def schedule_medication_reminder(run_date, topic, message):
-    """Programa un recordatorio de medicación (solo vibración)"""
     
-    def job_function(topic, message):
-        # Enviar comando de vibración
-        if topic and message:
-            publish_message(topic, message)
-
-    job = scheduler.add_job(
-        func=job_function,
-        trigger='date',
-        run_date=run_date,
-        args=[topic, message]
-    )
-    return job.id
-
-def cancel_job(job_id):
-    """Cancela un trabajo programado"""
-    try:
-        scheduler.remove_job(job_id)
-        return True
-    except Exception as e:
-        print(f"Error cancelling job {job_id}: {e}")
-        return False
+    # Actualización incremental de los agregados por minuto/hora/día
+    import rollup_service
+    
+    def update_rollups():
+        with app.app_context():
+            processed = rollup_service.update_rollups(batch_size=app.config.get('ROLLUP_BATCH_SIZE', 10000),
+                                                      safety_lag=app.config.get('ROLLUP_SAFETY_LAG_SECONDS', 30))
+            if processed:
+                logger.info("Rollups updated with %d readings", processed)
+    
+    scheduler.add_job(func=update_rollups, trigger="interval", seconds=app.config.get('ROLLUP_INTERVAL_SECONDS', 60),
+                      id='update_rollups', replace_existing=True, max_instances=1, coalesce=True)
+    
+    # Predicciones de todos los pacientes activos a partir de los agregados por minuto
+    from forecast_service import forecast_engine
+    forecast_engine.configure(app)
+    
+    def update_forecasts():
+        with app.app_context():
+            forecast_engine.update()
+    
+    scheduler.add_job(func=update_forecasts, trigger="interval", seconds=app.config.get('FORECAST_INTERVAL_SECONDS', 60),
+                      id='update_forecasts', replace_existing=True, max_instances=1, coalesce=True)
+    
+    # Instantánea de estadísticas globales del dashboard
+    from dashboard_snapshot import dashboard_snapshot
+    
+    def refresh_dashboard_snapshot():
+        with app.app_context():
+            dashboard_snapshot.refresh()
+    
+    scheduler.add_job(func=refresh_dashboard_snapshot, trigger="interval",
+                      seconds=app.config.get('STATS_SNAPSHOT_INTERVAL_SECONDS', 15),
+                      id='refresh_dashboard_snapshot', replace_existing=True, max_instances=1, coalesce=True)
@@ -0,0 +1,49 @@
+"""
+Pruebas de la conversión de fechas y la lectura de la importación masiva
+"""
+import io
+from datetime import datetime, timezone
+import numpy as np
+from import_service import iter_batches, parse_times
+
+EPOCH = 1700000000
+EPOCH_LOCAL = np.datetime64(datetime.fromtimestamp(EPOCH), 'us')
+
+
+def test_naive_iso_strings():
+    fechas = parse_times(['2024-01-01T10:00:00', '2024-01-01 10:00:01.5', ''])
+    assert fechas[0] == np.datetime64('2024-01-01T10:00:00')
+    assert fechas[1] == np.datetime64('2024-01-01T10:00:01.500')
+    assert np.isnat(fechas[2])
+
+
+def test_epoch_integers():
+    fechas = parse_times([EPOCH, EPOCH * 1000])
+    assert (fechas == EPOCH_LOCAL).all()
+
+
+def test_epoch_strings():
+    fechas = parse_times([str(EPOCH), str(EPOCH * 1000)])
+    assert (fechas == EPOCH_LOCAL).all()
+    assert fechas.tolist()[0].year == datetime.fromtimestamp(EPOCH).year
+
+
+def test_offset_strings_to_local_time():
+    iso_utc = datetime.fromtimestamp(EPOCH, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    fechas = parse_times([iso_utc + 'Z', iso_utc + '+00:00'])
+    assert (fechas == EPOCH_LOCAL).all()
+
+
+def test_mixed_batch_uses_same_conversion():
+    iso_utc = datetime.fromtimestamp(EPOCH, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+    fechas = parse_times([iso_utc + 'Z', EPOCH, 'no es una fecha', '99999999999999999999'])
+    assert fechas[0] == fechas[1] == EPOCH_LOCAL
+    assert np.isnat(fechas[2]) and np.isnat(fechas[3])
+
+
+def test_ndjson_non_object_lines_are_invalid_rows():
+    lines = io.StringIO('{"fecha": "2024-01-01T00:00:00", "valor": 36.5}\n[1, 2]\n"texto"\n42\nnull\n')
+    batches = list(iter_batches(lines, 'ndjson'))
+    assert len(batches) == 1
+    assert batches[0][0][:2] == ('2024-01-01T00:00:00', 36.5)
+    assert batches[0][1:] == [(None, None, None, None)] * 4
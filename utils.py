@@ -1,8 +1,14 @@
 """
 Utilidades compartidas
 """
+import json
 from functools import wraps
-from flask import session, redirect, url_for, flash
+from flask import session, redirect, url_for, flash, current_app
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 def login_required(f):
     """Decorador para requerir inicio de sesión"""
@@ -13,3 +19,11 @@ def login_required(f):
             return redirect(url_for('auth.login'))
         return f(*args, **kwargs)
     return decorated_function
+
+def json_response(data, status=200):
+    """Respuesta JSON compacta, serializada con orjson cuando está instalado"""
+    if orjson is not None:
+        body = orjson.dumps(data)
+    else:
+        body = json.dumps(data, separators=(',', ':'))
+    return current_app.response_class(body, status=status, mimetype='application/json')
@@ -0,0 +1,218 @@
+"""
+Motor de reglas en streaming que mantiene Paciente.estado a partir de las lecturas
+"""
+import atexit
+import logging
+import threading
+from datetime import timedelta
+from models import db, Paciente
+from patient_registry import patient_registry
+from event_bus import event_bus
+
+logger = logging.getLogger(__name__)
+
+# Estados de menor a mayor gravedad
+STATES = ('normal', 'advertencia', 'critico')
+SEVERITY = {state: level for level, state in enumerate(STATES)}
+
+# Canal del bus de eventos con los cambios de estado de todos los pacientes
+STATUS_CHANNEL = 'estados'
+
+# Rango (mínimo, máximo) admitido por señal en cada nivel; fuera de él se pasa a ese nivel
+DEFAULT_THRESHOLDS = {
+    'temperature': {'advertencia': (35.5, 37.8), 'critico': (35.0, 39.0)},
+    'heart_rate': {'advertencia': (50, 110), 'critico': (40, 130)},
+    'spo2': {'advertencia': (94, None), 'critico': (90, None)}
+}
+
+# Margen que una señal debe recuperar dentro del rango antes de bajar de nivel
+DEFAULT_HYSTERESIS = {'temperature': 0.2, 'heart_rate': 5, 'spo2': 1}
+
+
+def classify(signal, value, thresholds, hysteresis=0, current=0):
+    """
+    Nivel de gravedad de una señal
+
+    Para bajar por debajo del nivel `current` el valor debe quedar dentro del
+    rango con un margen de `hysteresis`, lo que evita oscilar en el límite.
+    """
+    level = 0
+    for state in STATES[1:]:
+        low, high = thresholds[signal][state]
+        margin = hysteresis if SEVERITY[state] <= current else 0
+        if (low is not None and value < low + margin) or (high is not None and value > high - margin):
+            level = SEVERITY[state]
+    return level
+
+
+class PatientRuleState:
+    """Estado del motor para un paciente"""
+    __slots__ = ('estado', 'candidato', 'desde')
+
+    def __init__(self, estado):
+        self.estado = estado
+        self.candidato = None
+        self.desde = None
+
+
+class VitalsRuleEngine:
+    """
+    Evalúa cada lectura completa y actualiza el estado del paciente
+
+    El trabajo por muestra es O(1): se clasifica cada señal contra los umbrales
+    y se compara con el estado en memoria del paciente. Un nuevo nivel solo se
+    confirma cuando se mantiene durante `sustain_seconds` (al empeorar) o
+    `recovery_seconds` (al mejorar). Los cambios confirmados se publican en el
+    bus de eventos y se escriben en la base de datos en lote cada `flush_interval_ms`.
+    """
+
+    def __init__(self, app=None, sustain_seconds=10, recovery_seconds=30, flush_interval_ms=1000):
+        self.app = None
+        self.thresholds = DEFAULT_THRESHOLDS
+        self.hysteresis = DEFAULT_HYSTERESIS
+        self.sustain = timedelta(seconds=sustain_seconds)
+        self.recovery = timedelta(seconds=recovery_seconds)
+        self.flush_interval_ms = flush_interval_ms
+
+        self._states = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.evaluated = 0
+        self.changes = 0
+        self.written = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configura los umbrales con la app y arranca el hilo de escritura"""
+        self.app = app
+        self.thresholds = app.config.get('VITAL_THRESHOLDS') or DEFAULT_THRESHOLDS
+        self.hysteresis = app.config.get('VITAL_HYSTERESIS') or DEFAULT_HYSTERESIS
+        self.sustain = timedelta(seconds=app.config.get('RULES_SUSTAIN_SECONDS', 10))
+        self.recovery = timedelta(seconds=app.config.get('RULES_RECOVERY_SECONDS', 30))
+        self.flush_interval_ms = app.config.get('RULES_FLUSH_INTERVAL_MS', self.flush_interval_ms)
+        self.start()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='vitals-rules-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Detiene el hilo y escribe los cambios pendientes"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        self.flush()
+
+    def evaluate(self, patient, temperature, heart_rate, spo2, fecha):
+        """Procesa una lectura completa de `patient` (PatientEntry); retorna el nuevo estado si cambió"""
+        with self._lock:
+            state = self._states.get(patient.id)
+            if state is None:
+                estado = patient.estado if patient.estado in SEVERITY else 'normal'
+                state = self._states[patient.id] = PatientRuleState(estado)
+            current = SEVERITY[state.estado]
+
+            level = max(
+                classify('temperature', temperature, self.thresholds, self.hysteresis['temperature'], current),
+                classify('heart_rate', heart_rate, self.thresholds, self.hysteresis['heart_rate'], current),
+                classify('spo2', spo2, self.thresholds, self.hysteresis['spo2'], current)
+            )
+            self.evaluated += 1
+
+            if level == current:
+                state.candidato = None
+                return None
+            if state.candidato != level:
+                state.candidato = level
+                state.desde = fecha
+            window = self.sustain if level > current else self.recovery
+            if fecha - state.desde < window:
+                return None
+
+            previous = state.estado
+            state.estado = STATES[level]
+            state.candidato = None
+            self._pending[patient.id] = state.estado
+            self.changes += 1
+
+        event_bus.publish(STATUS_CHANNEL, {
+            'paciente_id': patient.id,
+            'nombre': patient.nombre,
+            'estado': STATES[level],
+            'estado_anterior': previous,
+            'fecha': fecha.isoformat(),
+            'temperatura': temperature,
+            'heart_rate': heart_rate,
+            'spo2': spo2
+        })
+        return STATES[level]
+
+    def reset(self, patient_id):
+        """
+        Olvida el estado en memoria de un paciente (p. ej. tras editarlo a mano)
+
+        Solo afecta al motor del proceso actual. Con la ingesta en ingest_app.py
+        (MQTT_INGEST=false) su motor conserva el estado anterior hasta que las
+        lecturas lo lleven a otro nivel, y entonces sobrescribe el puesto a mano.
+        """
+        with self._lock:
+            self._states.pop(patient_id, None)
+            self._pending.pop(patient_id, None)
+
+    def flush(self):
+        """Escribe en un solo UPDATE por lotes los estados que cambiaron; retorna cuántos"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending or self.app is None:
+            return 0
+
+        try:
+            with self.app.app_context():
+                db.session.execute(db.update(Paciente), [
+                    {'id': patient_id, 'estado': estado} for patient_id, estado in pending.items()
+                ])
+                db.session.commit()
+        except Exception as e:
+            logger.error("Error writing %d patient states: %s", len(pending), e)
+            # Reintentar en el siguiente ciclo salvo que haya un cambio más reciente
+            with self._lock:
+                for patient_id, estado in pending.items():
+                    self._pending.setdefault(patient_id, estado)
+            return 0
+
+        patient_registry.update_estados(pending)
+        self.written += len(pending)
+        return len(pending)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval_ms / 1000.0):
+            self.flush()
+
+    def get_stats(self):
+        """Retorna los contadores del motor y los pacientes por estado en memoria"""
+        with self._lock:
+            estados = {state: 0 for state in STATES}
+            for state in self._states.values():
+                estados[state.estado] += 1
+            pending = len(self._pending)
+        return {
+            'evaluated': self.evaluated,
+            'changes': self.changes,
+            'written': self.written,
+            'pending': pending,
+            'estados': estados
+        }
+
+
+rule_engine = VitalsRuleEngine()